@@ -1,36 +1,49 @@
+import os
 import pickle
 from SimPy.Statistics import SummaryStat
+from supports.DrawStoreSupport import HSVDrawStore
 
 # read data
 read_path = 'tree_outputs/dics/'
-pkl_file = open('{}DicHSV1.pkl'.format(read_path), 'rb')
-hsv1_dic = pickle.load(pkl_file)
-pkl_file = open('{}DicHSV2.pkl'.format(read_path), 'rb')
-hsv2_dic = pickle.load(pkl_file)
-pkl_file.close()
-
-hsv1_outcome_list = hsv1_dic['qaly_id_non_age_sex_list']
-hsv2_outcome_list = hsv2_dic['qaly_id_non_age_sex_list']
-
-# within each PSA iteration
-avg_qaly_list = []
-total_qaly_list = []
-avg_hsv1_id_list = []
-avg_hsv2_id_list = []
-for i in range(len(hsv1_outcome_list)):
-    hsv1_qaly_per_psa = hsv1_outcome_list[i][0]
-    hsv1_id_per_psa = hsv1_outcome_list[i][1]
-    hsv2_qaly_per_psa = hsv2_outcome_list[i][0]
-    hsv2_id_per_psa = hsv2_outcome_list[i][1]
-    # total QALYs loss
-    qaly_per_psa = sum(hsv1_qaly_per_psa) + sum(hsv2_qaly_per_psa)
-    # total HSV incidence
-    id_per_psa = sum(hsv1_id_per_psa) + sum(hsv2_id_per_psa)
-    # append
-    avg_hsv1_id_list.append(sum(hsv1_id_per_psa))
-    avg_hsv2_id_list.append(sum(hsv2_id_per_psa))
-    avg_qaly_list.append(qaly_per_psa / id_per_psa)
-    total_qaly_list.append(qaly_per_psa)
+draws_path = 'tree_outputs/draws/'
+
+if os.path.isdir('{}hsv1'.format(draws_path)) and os.path.isdir('{}hsv2'.format(draws_path)):
+    # memory-mapped raw draws
+    hsv1_draws = HSVDrawStore('{}hsv1'.format(draws_path))
+    hsv2_draws = HSVDrawStore('{}hsv2'.format(draws_path))
+    avg_hsv1_id_list = hsv1_draws['incidence'].sum(axis=(1, 2))
+    avg_hsv2_id_list = hsv2_draws['incidence'].sum(axis=(1, 2))
+    total_qaly_list = hsv1_draws['t_qaly_hsv_avg'] + hsv2_draws['t_qaly_hsv_avg']
+    avg_qaly_list = total_qaly_list / (avg_hsv1_id_list + avg_hsv2_id_list)
+else:
+    pkl_file = open('{}DicHSV1.pkl'.format(read_path), 'rb')
+    hsv1_dic = pickle.load(pkl_file)
+    pkl_file = open('{}DicHSV2.pkl'.format(read_path), 'rb')
+    hsv2_dic = pickle.load(pkl_file)
+    pkl_file.close()
+
+    hsv1_outcome_list = hsv1_dic['qaly_id_non_age_sex_list']
+    hsv2_outcome_list = hsv2_dic['qaly_id_non_age_sex_list']
+
+    # within each PSA iteration
+    avg_qaly_list = []
+    total_qaly_list = []
+    avg_hsv1_id_list = []
+    avg_hsv2_id_list = []
+    for i in range(len(hsv1_outcome_list)):
+        hsv1_qaly_per_psa = hsv1_outcome_list[i][0]
+        hsv1_id_per_psa = hsv1_outcome_list[i][1]
+        hsv2_qaly_per_psa = hsv2_outcome_list[i][0]
+        hsv2_id_per_psa = hsv2_outcome_list[i][1]
+        # total QALYs loss
+        qaly_per_psa = sum(hsv1_qaly_per_psa) + sum(hsv2_qaly_per_psa)
+        # total HSV incidence
+        id_per_psa = sum(hsv1_id_per_psa) + sum(hsv2_id_per_psa)
+        # append
+        avg_hsv1_id_list.append(sum(hsv1_id_per_psa))
+        avg_hsv2_id_list.append(sum(hsv2_id_per_psa))
+        avg_qaly_list.append(qaly_per_psa / id_per_psa)
+        total_qaly_list.append(qaly_per_psa)
 
 ######################
 # SUMMARY STATISTICS #
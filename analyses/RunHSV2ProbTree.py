@@ -1,108 +1,294 @@
+import os
 import pickle
+from functools import partial
 import numpy as np
-import pandas as pd
 from classes import DecisionTreeClass as dt
-from supports.RunProbTreeSupport import get_summary_stats
+from supports.RunProbTreeSupport import get_summary_stats, run_psa_in_parallel, run_adaptive_psa, clear_psa_shards, \
+    get_distributions, get_headline_outputs, get_headline_output_names, ComponentLossAccumulator
+from supports.DrawStoreSupport import write_draw_store
+from supports.RandomValueGenerators import PSADraws, check_adaptive_sampler
+from supports.VarianceReductionSupport import get_control_draws, get_variance_reduced_stats
+from supports.ProfilingSupport import profiler
+from supports.OneWaySensitivitySupport import get_override_values
 from classes.ParameterClass import ParametersTypeTwo
-from classes.ProbTreeClasses import buildHSV2Tree
+from classes.ProbTreeClasses import buildHSV2Tree, recur_period_cache
 
 # Parameter initiation
 DISCOUNT = 0.06      # (float) discounting rate
+DISCOUNT_SA_LIST = []   # (list of float) discounting rates of sensitivity analysis evaluated in the same PSA pass
 NUM_PSA = 1000       # (int) number of probability sensitivity analysis iterations
+NUM_WORKERS = 1      # (int) number of worker processes for PSA iterations, 1 = serial, None = all CPUs
+CHUNK_SIZE = None    # (int) number of PSA iterations per worker task, None = 4 tasks per worker
+CHECKPOINT_DIR = None    # (str) folder of saved PSA iterations to resume from (opt-in, e.g.
+                         # 'tree_outputs/checkpoints/hsv2'), None = off
+PRESAMPLE = False    # (bool) sample all PSA iterations up front, False = one seed per iteration (as before)
+SAMPLER = 'random'   # (str) sampler of PSA parameter draws: 'random', 'lhs' (Latin hypercube), 'sobol' (scrambled
+                     # Sobol) or 'antithetic', other than 'random' draws are sampled up front ('lhs' cannot be
+                     # used with ADAPTIVE, the first draws of a Latin hypercube are not one)
+ADAPTIVE = False     # (bool) run PSA iterations until the headline outputs converge, False = NUM_PSA iterations
+MCSE_TOLERANCE = 0.01   # (float) adaptive PSA stops once MCSE / |mean| of every headline output is below this
+MIN_PSA = 200        # (int) minimum number of PSA iterations of adaptive PSA
+MAX_PSA = 5000       # (int) maximum number of PSA iterations of adaptive PSA
+BATCH_SIZE = 100     # (int) number of PSA iterations between convergence checks of adaptive PSA
+ADAPTIVE_DIR = 'tree_outputs/adaptive'  # (str) folder of the stopping trace and headline outputs of adaptive PSA
+VARIANCE_REDUCTION = False  # (bool) antithetic pairs of parameter draws (in place of SAMPLER) and headline
+                            # outputs adjusted by control variates, with effective sample size gain
+VR_DIR = 'tree_outputs/variance_reduction'  # (str) folder of the variance-reduced headline outputs
+PROFILE = False      # (bool) time the stages of the run, print a breakdown and save it to PROFILE_PATH
+PROFILE_PATH = 'tree_outputs/profile/hsv2.json'   # (str) per-stage times and counters of the run
 virus_type = 'HSV-2'
 sex_list = ['male', 'female']
 age_list = [21, 27, 32, 42]
 age_text_list = ['18-24', '25-29', '30-34', '35-49']
 
-hsv2_params = ParametersTypeTwo()
-mf_id_lists = []        # male amd female incidence list
-mf_utility_lists = []   # male and female QALYs list
-mf_infreq_lists = []    # male and female # of infrequent recurrence list
-mf_freq_lists = []      # male and female # of frequent recurrence list
-mf_freq_cst_lists = []  # male and female # of frequent (with CST) recurrence list
-
 # QALYs breakdowns
 # primary outbreak, aseptic meningitis, urinary retention, psychological,
 # infrequent recurrence, frequent recurrence (no CST), frequent recurrence (with CST)
-colnames = ['primary', 'am', 'ur', 'psych', 'infreq', 'freq_no_cst', 'freq_cst', 'rm', 'sex', 'age', 'iter_num']
-component_df = pd.DataFrame(columns=colnames)
-
-# Main Analysis and Probability Sensitivity Analysis
-for i in range(NUM_PSA):
-    print('current number of iterations:', i)
-    # random number generator
-    rng = np.random.RandomState(seed=i)
-    # resample age and sex independent parameters
-    hsv2_params.resample_hsv2_non_age_sex_params(rng=rng)
-    f_id_distr = hsv2_params.f_id_distr     # incidence - female
-    m_id_distr = hsv2_params.m_id_distr     # incidence - male
-    mf_id_lists.append(m_id_distr + f_id_distr)
-    utility_list = []
-    infreq_r_sex_list = []
-    freq_r_sex_list = []
-    freq_cst_r_sex_list = []
-    # resample sex dependent parameters
+components = ['primary', 'am', 'ur', 'psych', 'infreq', 'freq_no_cst', 'freq_cst', 'rm']
+
+
+def resample_hsv2(params, rng):
+    """ resample the parameters of a PSA iteration (in the order of simulate_hsv2) """
+    params.resample_hsv2_non_age_sex_params(rng=rng)
     for sex in sex_list:
-        utility_list_each_sex = []
-        infreq_r_age_list = []
-        freq_r_age_list = []
-        freq_cst_r_age_list = []
-        hsv2_params.resample_hsv2_sex_params(sex=sex, rng=rng)
-        for age in age_list:
-            # adjust disutility based on background utility (by age)
-            hsv2_params.update_hsv2_age_params(age_of_infection=age)
-            # construct HSV-2 probabilistic tree
-            dictDecisions, dictChances, dictTerminals, infreq_r, freq_r, freq_cst_r = \
-                buildHSV2Tree(params=hsv2_params, sex=sex, discount=DISCOUNT, age_of_infection=age)
-            infreq_r_age_list.append(infreq_r)
-            freq_r_age_list.append(freq_r)
-            freq_cst_r_age_list.append(freq_cst_r)
-            # calculate expected QALYs loss
-            myDT = dt.DecisionNode('d1', dictDecisions, dictChances, dictTerminals)
-            myDT.evaluate()
-            cost_utility = myDT.get_cost_utility()
-            age_sex_specific_utility = cost_utility['c0'][-1]
-            utility_list_each_sex.append(age_sex_specific_utility)
-            # age- and sex- specific component QALYs lost
-            breakdown_uti_dic = myDT.get_component_loss()['c0']
-            df = pd.DataFrame([[breakdown_uti_dic[colnames[0]], breakdown_uti_dic[colnames[1]],
-                                breakdown_uti_dic[colnames[2]], breakdown_uti_dic[colnames[3]],
-                                breakdown_uti_dic[colnames[4]], breakdown_uti_dic[colnames[5]],
-                                breakdown_uti_dic[colnames[6]], breakdown_uti_dic[colnames[7]],
-                                sex, age, i]],
-                              columns=colnames)
-            component_df = component_df.append(df)
-        utility_list.append(utility_list_each_sex)
-        infreq_r_sex_list.append(infreq_r_age_list[-1])
-        freq_r_sex_list.append(freq_r_age_list[-1])
-        freq_cst_r_sex_list.append(freq_cst_r_age_list[-1])
-
-    mf_utility_lists.append(utility_list[0] + utility_list[1])
-    mf_infreq_lists.append(infreq_r_sex_list)
-    mf_freq_lists.append(freq_r_sex_list)
-    mf_freq_cst_lists.append(freq_cst_r_sex_list)
-
-age_sex_specific_qaly, non_age_sex_qaly_avg, t_qaly_f_avg, t_qaly_m_avg, t_qaly_hsv_avg, qaly_id_non_age_sex_list = \
-    get_summary_stats(mf_utility_lists=mf_utility_lists,
-                      mf_id_lists=mf_id_lists,
-                      age_list=age_list,
-                      sex_list=sex_list,
-                      num_psa=NUM_PSA,
-                      virus_type='HSV-2')
-# output dictionary
-hsv2_Dic = {'age_sex_specific_qaly': age_sex_specific_qaly,         # QALYs lost per case by age and sex
-            'non_age_sex_qaly_avg': non_age_sex_qaly_avg,           # QALYs lost per case - general
-            't_qaly_f_avg': t_qaly_f_avg,                           # total QALYs lost - female
-            't_qaly_m_avg': t_qaly_m_avg,                           # total QALYs lost - male
-            't_qaly_hsv_avg': t_qaly_hsv_avg,                       # total QALYs lost - general
-            'infreq_recur': mf_infreq_lists,                        # num of infrequent recurrences by sex
-            'freq_no_cst_recur': mf_freq_lists,                     # num of frequent recurrences by sex
-            'freq_cst_recur': mf_freq_cst_lists,                    # num of frequent recurrences (CST) by sex
-            'qaly_id_non_age_sex_list': qaly_id_non_age_sex_list}   # incidence
-
-# Save outputs
-output = open('tree_outputs/dics/DicHSV2.pkl', 'wb')
-pickle.dump(hsv2_Dic, output)
-output.close()
-# save component QALYs lost
-component_df.to_csv('tree_outputs/component_utl/hsv2.csv')
+        params.resample_hsv2_sex_params(sex=sex, rng=rng)
+
+
+def get_hsv2_controls(params):
+    """ :return: generators of the parameters used as control variates of the headline outputs (incidence,
+    recurrence rates and psychosocial disutility) """
+    return [params.incidence.hsv2_male_incidence, params.incidence.hsv2_female_incidence,
+            params.m_infreq_first_year_recur_rate, params.m_freq_nocst_first_year_recur_rate,
+            params.m_freq_cst_first_year_recur_rate, params.f_infreq_first_year_recur_rate,
+            params.f_freq_nocst_first_year_recur_rate, params.f_freq_cst_first_year_recur_rate,
+            params.diagnosis_disu]
+
+
+def simulate_hsv2(params, psa_draws, seeds, scenarios=None):
+    """ run PSA iterations of the HSV-2 probabilistic tree
+    :param params: (ParametersTypeTwo) parameters, resampled in each iteration
+    :param psa_draws: (PSADraws) parameter draws of all iterations sampled up front, None = sample each iteration
+    :param seeds: list of iteration indices, also used as random seeds if psa_draws is None
+    :param scenarios: list of (dictionary of parameter samples to override (see get_override_values) or None,
+                      list of discounting rates) evaluated on the same parameter samples of each iteration,
+                      None = no override with DISCOUNT and DISCOUNT_SA_LIST
+    :return: list of results of each iteration: [incidence list, QALYs list, # of infrequent recurrence list,
+             # of frequent recurrence list, # of frequent (with CST) recurrence list, component QALYs lost array,
+             (# of cache hits, # of cache misses),
+             list of QALYs lists for each pair of scenario and discounting rate after the first, by scenario]
+             (QALYs list, # of recurrence lists and component QALYs lost are of the first scenario and rate)
+    """
+    results = []
+    if scenarios is None:
+        scenarios = [(None, [DISCOUNT] + DISCOUNT_SA_LIST)]
+    # recurrent periods of all discounting rates are calculated together
+    recur_period_cache.discount_list = list(dict.fromkeys(
+        discount for _, discount_list in scenarios for discount in discount_list))
+    # trees of all iterations, sexes, ages, scenarios and discounting rates share the same structure and are
+    # evaluated together
+    list_dict_decisions = [[] for _ in scenarios]   # decision nodes of each tree, for each scenario
+    list_dict_chances = [[] for _ in scenarios]     # chance nodes of each tree, for each scenario
+    # terminal nodes of each tree, for each scenario and discounting rate
+    list_dict_terminals = [[[] for _ in discount_list] for _, discount_list in scenarios]
+    for i in seeds:
+        profiler.count('psa_iterations')
+        num_hits, num_misses = recur_period_cache.num_hits, recur_period_cache.num_misses
+        # random number generator (or draws of this iteration)
+        rng = np.random.RandomState(seed=i) if psa_draws is None else psa_draws.get_iteration(iteration=i)
+        # resample age and sex independent parameters
+        params.resample_hsv2_non_age_sex_params(rng=rng)
+        # parameter values of each scenario
+        override_values = [None if overrides is None else get_override_values(overrides=overrides, iteration=i)
+                           for overrides, _ in scenarios]
+        f_id_distr = params.f_id_distr     # incidence - female
+        m_id_distr = params.m_id_distr     # incidence - male
+        infreq_r_sex_list = []
+        freq_r_sex_list = []
+        freq_cst_r_sex_list = []
+        # resample sex dependent parameters
+        for sex in sex_list:
+            infreq_r_age_list = []
+            freq_r_age_list = []
+            freq_cst_r_age_list = []
+            params.resample_hsv2_sex_params(sex=sex, rng=rng)
+            for s, dic_values in enumerate(override_values):
+                if dic_values is not None:
+                    params.override_samples(dic_values=dic_values)
+                for age in age_list:
+                    # adjust disutility based on background utility (by age)
+                    params.update_hsv2_age_params(age_of_infection=age)
+                    # construct HSV-2 probabilistic tree (only terminal nodes depend on discounting)
+                    for k, discount in enumerate(scenarios[s][1]):
+                        dictDecisions, dictChances, dictTerminals, infreq_r, freq_r, freq_cst_r = \
+                            buildHSV2Tree(params=params, sex=sex, discount=discount, age_of_infection=age)
+                        list_dict_terminals[s][k].append(dictTerminals)
+                    if s == 0:
+                        infreq_r_age_list.append(infreq_r)
+                        freq_r_age_list.append(freq_r)
+                        freq_cst_r_age_list.append(freq_cst_r)
+                    list_dict_decisions[s].append(dictDecisions)
+                    list_dict_chances[s].append(dictChances)
+                # back to the sampled values for the next scenario
+                params.restore_samples()
+            infreq_r_sex_list.append(infreq_r_age_list[-1])
+            freq_r_sex_list.append(freq_r_age_list[-1])
+            freq_cst_r_sex_list.append(freq_cst_r_age_list[-1])
+
+        results.append([m_id_distr + f_id_distr, None, infreq_r_sex_list, freq_r_sex_list, freq_cst_r_sex_list, None,
+                        (recur_period_cache.num_hits - num_hits, recur_period_cache.num_misses - num_misses), []])
+
+    if len(results) == 0:
+        return results
+
+    # calculate expected QALYs loss of all trees in one pass
+    myDT = dt.compile_tree('d1', list_dict_decisions[0][0], list_dict_chances[0][0], list_dict_terminals[0][0][0])
+    myDT.evaluate_batch(list_dict_chances[0], list_dict_terminals[0][0])
+    utilities = myDT.get_batch_cost_utility()['c0'][-1]
+    # age- and sex- specific component QALYs lost
+    breakdown_uti_dic = myDT.get_batch_component_loss()['c0']
+    component_values = np.column_stack([breakdown_uti_dic[name] for name in components])
+    num_groups = len(sex_list) * len(age_list)  # number of trees per iteration
+    for k, result in enumerate(results):
+        result[1] = utilities[k * num_groups:(k + 1) * num_groups].tolist()
+        result[5] = component_values[k * num_groups:(k + 1) * num_groups]
+    # expected QALYs loss of the other pairs of scenario and discounting rate
+    for s, list_dict_terminals_by_discount in enumerate(list_dict_terminals):
+        for k, list_dict_terminals_sa in enumerate(list_dict_terminals_by_discount):
+            if s == 0 and k == 0:
+                continue    # evaluated above
+            myDT.evaluate_batch(list_dict_chances[s], list_dict_terminals_sa)
+            utilities = myDT.get_batch_cost_utility()['c0'][-1]
+            for j, result in enumerate(results):
+                result[7].append(utilities[j * num_groups:(j + 1) * num_groups].tolist())
+    return results
+
+
+if __name__ == '__main__':
+    if PROFILE:
+        profiler.enable()
+    hsv2_params = ParametersTypeTwo()
+
+    # Main Analysis and Probability Sensitivity Analysis
+    psa_draws = None
+    sampler = 'antithetic' if VARIANCE_REDUCTION else SAMPLER
+    if ADAPTIVE:
+        check_adaptive_sampler(sampler=sampler, min_psa=MIN_PSA, batch_size=BATCH_SIZE)
+    if PRESAMPLE or sampler != 'random':
+        psa_draws = PSADraws(params=hsv2_params, resample=resample_hsv2, num_psa=MAX_PSA if ADAPTIVE else NUM_PSA,
+                             rng=np.random.RandomState(seed=0), sampler=sampler)
+    # settings the PSA iterations depend on (saved iterations of other settings are not resumed)
+    psa_config = {'discount_list': [DISCOUNT] + DISCOUNT_SA_LIST, 'sex_list': sex_list,
+                  'age_list': age_list, 'components': components,
+                  'presampled': None if psa_draws is None else (psa_draws.sampler, psa_draws.numPsa),
+                  'parameters': get_distributions(params=hsv2_params)}
+    if ADAPTIVE:
+        # stop once the headline outputs are estimated precisely enough
+        psa_results, headline_stats, stopping_trace = run_adaptive_psa(
+            simulate=partial(simulate_hsv2, hsv2_params, psa_draws),
+            get_outputs=lambda result: get_headline_outputs(utility=result[1], incidence=result[0],
+                                                            sex_list=sex_list),
+            output_names=get_headline_output_names(sex_list=sex_list, age_list=age_list),
+            tolerance=MCSE_TOLERANCE, min_psa=MIN_PSA, max_psa=MAX_PSA, batch_size=BATCH_SIZE,
+            num_workers=NUM_WORKERS, chunk_size=CHUNK_SIZE, checkpoint_dir=CHECKPOINT_DIR, config=psa_config)
+        print(headline_stats.to_dataframe().to_string(index=False))
+        os.makedirs(ADAPTIVE_DIR, exist_ok=True)
+        stopping_trace.to_csv(os.path.join(ADAPTIVE_DIR, 'hsv2_trace.csv'), index=False)
+        headline_stats.to_dataframe().to_csv(os.path.join(ADAPTIVE_DIR, 'hsv2_outputs.csv'), index=False)
+    else:
+        psa_results = run_psa_in_parallel(simulate=partial(simulate_hsv2, hsv2_params, psa_draws), num_psa=NUM_PSA,
+                                          num_workers=NUM_WORKERS, chunk_size=CHUNK_SIZE,
+                                          checkpoint_dir=CHECKPOINT_DIR, config=psa_config)
+    num_psa = len(psa_results)     # number of PSA iterations run
+    if VARIANCE_REDUCTION:
+        # headline outputs with antithetic pairs averaged and adjusted by control variates
+        controls, control_means = get_control_draws(psa_draws=psa_draws, generators=get_hsv2_controls(hsv2_params),
+                                                    num_psa=num_psa)
+        headline_outputs = [get_headline_outputs(utility=result[1], incidence=result[0], sex_list=sex_list)
+                            for result in psa_results]
+        vr_stats = get_variance_reduced_stats(outputs=headline_outputs,
+                                              output_names=get_headline_output_names(sex_list=sex_list,
+                                                                                     age_list=age_list),
+                                              controls=controls, control_means=control_means, pair_size=2)
+        print(vr_stats.to_string(index=False))
+        os.makedirs(VR_DIR, exist_ok=True)
+        vr_stats.to_csv(os.path.join(VR_DIR, 'hsv2.csv'), index=False)
+    mf_id_lists = [result[0] for result in psa_results]         # male amd female incidence list
+    mf_utility_lists = [result[1] for result in psa_results]    # male and female QALYs list
+    mf_infreq_lists = [result[2] for result in psa_results]     # male and female # of infrequent recurrence list
+    mf_freq_lists = [result[3] for result in psa_results]       # male and female # of frequent recurrence list
+    mf_freq_cst_lists = [result[4] for result in psa_results]   # male and female # of frequent (with CST) recurrence
+    component_losses = ComponentLossAccumulator(components=components, sex_list=sex_list, age_list=age_list,
+                                                num_psa=num_psa)
+    for i, result in enumerate(psa_results):
+        component_losses.add_iteration(iter_num=i, values=result[5])
+
+    # number of recurrent periods served from the cache vs. calculated
+    num_cache_hits = sum(result[6][0] for result in psa_results)
+    num_cache_misses = sum(result[6][1] for result in psa_results)
+    profiler.count('recur_period_cache_hits', num=num_cache_hits)
+    profiler.count('recur_period_cache_misses', num=num_cache_misses)
+    print('recurrent period cache:', {'hits': num_cache_hits,
+                                      'misses': num_cache_misses,
+                                      'hit_rate': num_cache_hits / max(num_cache_hits + num_cache_misses, 1)})
+
+    age_sex_specific_qaly, non_age_sex_qaly_avg, t_qaly_f_avg, t_qaly_m_avg, t_qaly_hsv_avg, \
+        qaly_id_non_age_sex_list = get_summary_stats(mf_utility_lists=mf_utility_lists,
+                                                     mf_id_lists=mf_id_lists,
+                                                     age_list=age_list,
+                                                     sex_list=sex_list,
+                                                     num_psa=num_psa,
+                                                     virus_type='HSV-2')
+    # output dictionary
+    hsv2_Dic = {'age_sex_specific_qaly': age_sex_specific_qaly,         # QALYs lost per case by age and sex
+                'non_age_sex_qaly_avg': non_age_sex_qaly_avg,           # QALYs lost per case - general
+                't_qaly_f_avg': t_qaly_f_avg,                           # total QALYs lost - female
+                't_qaly_m_avg': t_qaly_m_avg,                           # total QALYs lost - male
+                't_qaly_hsv_avg': t_qaly_hsv_avg,                       # total QALYs lost - general
+                'infreq_recur': mf_infreq_lists,                        # num of infrequent recurrences by sex
+                'freq_no_cst_recur': mf_freq_lists,                     # num of frequent recurrences by sex
+                'freq_cst_recur': mf_freq_cst_lists,                    # num of frequent recurrences (CST) by sex
+                'qaly_id_non_age_sex_list': qaly_id_non_age_sex_list}   # incidence
+
+    # Save outputs
+    with profiler.stage('write_outputs'):
+        output = open('tree_outputs/dics/DicHSV2.pkl', 'wb')
+        pickle.dump(hsv2_Dic, output)
+        output.close()
+    # QALYs lost with the discounting rates of sensitivity analysis
+    for k, discount in enumerate(DISCOUNT_SA_LIST):
+        age_sex_specific_qaly, non_age_sex_qaly_avg, t_qaly_f_avg, t_qaly_m_avg, t_qaly_hsv_avg, \
+            qaly_id_non_age_sex_list = get_summary_stats(mf_utility_lists=[result[7][k] for result in psa_results],
+                                                         mf_id_lists=mf_id_lists,
+                                                         age_list=age_list,
+                                                         sex_list=sex_list,
+                                                         num_psa=num_psa,
+                                                         virus_type='HSV-2')
+        hsv2_sa_Dic = {'discount': discount,
+                       'age_sex_specific_qaly': age_sex_specific_qaly,
+                       'non_age_sex_qaly_avg': non_age_sex_qaly_avg,
+                       't_qaly_f_avg': t_qaly_f_avg,
+                       't_qaly_m_avg': t_qaly_m_avg,
+                       't_qaly_hsv_avg': t_qaly_hsv_avg,
+                       'qaly_id_non_age_sex_list': qaly_id_non_age_sex_list}
+        with profiler.stage('write_outputs'):
+            output = open('tree_outputs/dics/DicHSV2_discount_{}.pkl'.format(discount), 'wb')
+            pickle.dump(hsv2_sa_Dic, output)
+            output.close()
+    # save component QALYs lost
+    component_losses.to_csv('tree_outputs/component_utl/hsv2.csv')
+    # save raw draws (draw x sex x age)
+    draw_shape = (num_psa, len(sex_list), len(age_list))
+    write_draw_store(store_dir='tree_outputs/draws/hsv2',
+                     dic_arrays={'qaly_per_case': np.reshape(mf_utility_lists, draw_shape),
+                                 'incidence': np.reshape(mf_id_lists, draw_shape),
+                                 'components': component_losses.values.reshape(draw_shape + (len(components),)),
+                                 'component_names': components,
+                                 'sexes': sex_list,
+                                 'ages': age_list})
+    # remove saved PSA iterations once the outputs of the complete run are saved
+    if CHECKPOINT_DIR is not None:
+        clear_psa_shards(checkpoint_dir=CHECKPOINT_DIR)
+    # time spent in each stage of the run
+    if PROFILE:
+        profiler.print_report()
+        profiler.write_json(path=PROFILE_PATH)
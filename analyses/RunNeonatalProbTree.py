@@ -1,88 +1,239 @@
+import os
 import numpy as np
 import pickle
+from functools import partial
 from classes import DecisionTreeClass as dt
 from classes.ParameterClass import ParametersNeonatal
 from classes.ProbTreeClasses import buildNeonatalTree
+from supports.RunProbTreeSupport import get_distributions, run_psa_in_parallel, run_adaptive_psa, clear_psa_shards
+from supports.DrawStoreSupport import write_draw_store
+from supports.RandomValueGenerators import PSADraws, check_adaptive_sampler
+from supports.VarianceReductionSupport import get_control_draws, get_variance_reduced_stats
+from supports.ProfilingSupport import profiler
 from SimPy.Statistics import SummaryStat
 
 # Parameter initiation
 DISCOUNT = 0.03     # (float) discounting rate
 NUM_PSA = 1000      # (int) number of repetition for PSA
+NUM_WORKERS = 1     # (int) number of worker processes for PSA iterations, 1 = serial, None = all CPUs
+CHUNK_SIZE = None   # (int) number of PSA iterations per worker task, None = 4 tasks per worker
+CHECKPOINT_DIR = None    # (str) folder of saved PSA iterations to resume from (opt-in, e.g.
+                         # 'tree_outputs/checkpoints/neonatal'), None = off
+PRESAMPLE = False   # (bool) sample all PSA iterations up front, False = one seed per iteration (as before)
+SAMPLER = 'random'  # (str) sampler of PSA parameter draws: 'random', 'lhs' (Latin hypercube), 'sobol' (scrambled
+                    # Sobol) or 'antithetic', other than 'random' draws are sampled up front ('lhs' cannot be
+                    # used with ADAPTIVE, the first draws of a Latin hypercube are not one)
+ADAPTIVE = False    # (bool) run PSA iterations until the headline outputs converge, False = NUM_PSA iterations
+MCSE_TOLERANCE = 0.01   # (float) adaptive PSA stops once MCSE / |mean| of every headline output is below this
+MIN_PSA = 200       # (int) minimum number of PSA iterations of adaptive PSA
+MAX_PSA = 5000      # (int) maximum number of PSA iterations of adaptive PSA
+BATCH_SIZE = 100    # (int) number of PSA iterations between convergence checks of adaptive PSA
+ADAPTIVE_DIR = 'tree_outputs/adaptive'  # (str) folder of the stopping trace and headline outputs of adaptive PSA
+VARIANCE_REDUCTION = False  # (bool) antithetic pairs of parameter draws (in place of SAMPLER) and headline
+                            # outputs adjusted by control variates, with effective sample size gain
+VR_DIR = 'tree_outputs/variance_reduction'  # (str) folder of the variance-reduced headline outputs
+PROFILE = False     # (bool) time the stages of the run, print a breakdown and save it to PROFILE_PATH
+PROFILE_PATH = 'tree_outputs/profile/neonatal.json'   # (str) per-stage times and counters of the run
 
 ###################
 # NEONATAL HERPES #
 ###################
-SIM_TIME = 15        # (int) 0=life time, ≥1: exact years for simulation duration
-
-# specify parameter distributions
-params_neonate = ParametersNeonatal(discount=DISCOUNT, sim_time=SIM_TIME)
-# initiating results
-incidence_list = []                 # incidence
-neonate_qaly_loss_list = []         # neonatal + maternal: per case QLAYs lost
-neonate_total_qaly_loss_list = []   # neonatal + maternal: total QLAYs lost
-maternal_qaly_loss_list = []        # maternal: per case QALYs lost
-maternal_total_qaly_loss_list = []  # maternal: total QALYs lost
-
-# Main Analysis and Probability Sensitivity Analysis
-for i in range(NUM_PSA):
-    print('current number of iterations:', i)
-    # random number generator
-    rng = np.random.RandomState(seed=i)
-    # resample parameters
-    params_neonate.resample_by_distr(seed=i)
-    # incidence
-    incidence = params_neonate.incidence_sample/100000 * 3791712
-    incidence_list.append(incidence)
-    # construct probabilistic tree
-    dictDecisions, dictChances, dictTerminals, dictTerminals_maternal = buildNeonatalTree(params=params_neonate)
-    # calculate expected QALYs loss for neonatal + maternal
-    myDT = dt.DecisionNode('d1', dictDecisions, dictChances, dictTerminals)
-    myDT.evaluate()
-    cost_utility = myDT.get_cost_utility()
-    neonate_qaly_loss_list.append(cost_utility['c0'][-1])
-    neonate_total_qaly_loss_list.append(incidence * cost_utility['c0'][-1])
+SIM_TIME_LIST = [15]    # (list of int) simulation durations evaluated in one PSA pass, 0=life time, ≥1: exact years
+
+
+def resample_neonatal(params, rng):
+    """ resample the parameters of a PSA iteration """
+    params.resample_by_distr(seed=0, rng=rng)
+
+
+def get_neonatal_controls(params):
+    """ :return: generators of the parameters used as control variates of the headline outputs (incidence,
+    transmission routes, intrapartum outcomes and their disutilities) """
+    return [params.incidence, params.route_of_transmission, params.intrapartum_sem_cns_dis,
+            params.intrapartum_mild_disu, params.intrapartum_moderate_disu, params.intrapartum_severe_disu]
+
+
+def simulate_neonatal(params, psa_draws, seeds):
+    """ run PSA iterations of the neonatal probabilistic tree
+    :param params: (ParametersNeonatal) parameters, resampled in each iteration
+    :param psa_draws: (PSADraws) parameter draws of all iterations sampled up front, None = sample each iteration
+    :param seeds: list of iteration indices, also used as random seeds if psa_draws is None
+    :return: list of results of each iteration: [incidence, per case QALYs lost (neonatal + maternal),
+             per case QALYs lost (maternal), quality-adjusted life expectancy for stillbirth], where QALYs lost are
+             lists with one value for each simulation length of params.sim_time_list
+    """
+    results = []
+    # trees of all iterations and simulation lengths share the same structure and are evaluated together
+    list_dict_decisions = []            # decision nodes of each tree
+    list_dict_chances = []              # chance nodes of each tree
+    list_dict_terminals = []            # terminal nodes of each tree: neonatal + maternal
+    list_dict_terminals_maternal = []   # terminal nodes of each tree: maternal
+    for i in seeds:
+        profiler.count('psa_iterations')
+        # resample parameters (QALYs loss of all simulation lengths is calculated together)
+        params.resample_by_distr(seed=i, rng=None if psa_draws is None else psa_draws.get_iteration(iteration=i))
+        # incidence
+        incidence = params.incidence_sample/100000 * 3791712
+        for sim_time in params.sim_time_list:
+            params.set_sim_time(sim_time=sim_time)
+            # construct probabilistic tree
+            dictDecisions, dictChances, dictTerminals, dictTerminals_maternal = buildNeonatalTree(params=params)
+            list_dict_decisions.append(dictDecisions)
+            list_dict_chances.append(dictChances)
+            list_dict_terminals.append(dictTerminals)
+            list_dict_terminals_maternal.append(dictTerminals_maternal)
+        results.append([incidence, None, None, params.qaly_death])
+
+    if len(results) == 0:
+        return results
+
+    # calculate expected QALYs loss for neonatal + maternal of all iterations in one pass
+    num_sim_times = len(params.sim_time_list)   # number of trees per iteration
+    myDT = dt.compile_tree('d1', list_dict_decisions[0], list_dict_chances[0], list_dict_terminals[0])
+    myDT.evaluate_batch(list_dict_chances, list_dict_terminals)
+    losses = myDT.get_batch_cost_utility()['c0'][-1].reshape(len(results), num_sim_times)
+    for result, loss in zip(results, losses.tolist()):
+        result[1] = loss
     # calculate expected QALYs loss of maternal
-    myDT_maternal = dt.DecisionNode('d1', dictDecisions, dictChances, dictTerminals_maternal)
-    myDT_maternal.evaluate()
-    cost_utility_maternal = myDT_maternal.get_cost_utility()
-    maternal_qaly_loss = cost_utility_maternal['c0'][-1]
-    maternal_qaly_loss_list.append(maternal_qaly_loss)
-    maternal_total_qaly_loss_list.append(incidence * maternal_qaly_loss)
-
-print('simulation length', SIM_TIME)
-print('discount rate', DISCOUNT)
-# incidence
-incidence_stat = SummaryStat(name='incidence of neonatal herpes in 2018', data=incidence_list)
-incidence_avg = incidence_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
-print('total number of births infected by HSV in 2018:', incidence_avg)
-# neonatal + maternal
-qaly_loss_per_infection_stat = SummaryStat(name='QALYs loss due to neonatal herpes', data=neonate_qaly_loss_list)
-qaly_loss_total_stat = SummaryStat(name='Total QALYs loss due to neonatal herpes', data=neonate_total_qaly_loss_list)
-qaly_loss_per_infection_avg = qaly_loss_per_infection_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
-qaly_loss_total_avg = qaly_loss_total_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
-print('The average and 95% CI of QALYs loss due to per neonatal herpes:', qaly_loss_per_infection_avg)
-print('The average and 95% CI of QALYs loss due to neonatal herpes in 2018:', qaly_loss_total_avg)
-print('quality-adjusted life expectancy for stillbirth', round(params_neonate.qaly_death, 2))
-# maternal
-maternal_qaly_loss_per_infection_stat = SummaryStat(name='maternal QALYs loss due to per neonatal herpes',
-                                                    data=maternal_qaly_loss_list)
-maternal_qaly_loss_total_stat = SummaryStat(name='maternal QALYs loss due to neonatal herpes in 2018',
-                                            data=maternal_total_qaly_loss_list)
-maternal_qaly_loss_per_infection_avg = \
-    maternal_qaly_loss_per_infection_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
-maternal_qaly_loss_total_avg = \
-    maternal_qaly_loss_total_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
-print('The average and 95% CI maternal QALYs loss due to per neonatal herpes:', maternal_qaly_loss_per_infection_avg)
-print('The average and 95% CI maternal QALYs loss due to neonatal herpes in 2018:', maternal_qaly_loss_total_avg)
-
-# output dictionary
-N_dic = {'simulation length': SIM_TIME,                                 # simulation length
-         'num_case': incidence_avg,                                     # incidence
-         'loss_per_infection': qaly_loss_per_infection_avg,             # QALYs lost per infection: neonatal+maternal
-         'loss_total': qaly_loss_total_avg,                             # QALYs lost total: neonatal+maternal
-         'm_loss_per_infection': maternal_qaly_loss_per_infection_avg,  # QALYs lost per infection: maternal
-         'm_loss_total': maternal_qaly_loss_total_avg}                  # QALYs lost total: maternal
-# save output
-output = open('tree_outputs/dics/neonatalGH_{}.pkl'.format(SIM_TIME), 'wb')
-pickle.dump(N_dic, output)
-output.close()
+    myDT.evaluate_batch(list_dict_chances, list_dict_terminals_maternal)
+    losses = myDT.get_batch_cost_utility()['c0'][-1].reshape(len(results), num_sim_times)
+    for result, loss in zip(results, losses.tolist()):
+        result[2] = loss
+    return results
+
+
+def get_neonatal_output_names():
+    """ :return: names of the headline outputs of a PSA iteration (see get_neonatal_outputs) """
+    return ['{}_{}'.format(name, sim_time) for sim_time in SIM_TIME_LIST
+            for name in ['loss_per_infection', 'loss_total', 'm_loss_per_infection', 'm_loss_total']]
+
+
+def get_neonatal_outputs(result):
+    """ :return: headline outputs of a PSA iteration: QALYs lost per infection and total QALYs lost (neonatal +
+    maternal and maternal) for each simulation length """
+    return [value for k in range(len(SIM_TIME_LIST))
+            for value in [result[1][k], result[0] * result[1][k], result[2][k], result[0] * result[2][k]]]
+
+
+if __name__ == '__main__':
+    if PROFILE:
+        profiler.enable()
+    sampler = 'antithetic' if VARIANCE_REDUCTION else SAMPLER
+    # specify parameter distributions
+    if ADAPTIVE:
+        check_adaptive_sampler(sampler=sampler, min_psa=MIN_PSA, batch_size=BATCH_SIZE)
+        # maternal disutilities are sampled up front for the maximum number of PSA iterations
+        params_neonate = ParametersNeonatal(discount=DISCOUNT, sim_time=SIM_TIME_LIST[0], sim_time_list=SIM_TIME_LIST,
+                                            num_psa=MAX_PSA)
+    else:
+        params_neonate = ParametersNeonatal(discount=DISCOUNT, sim_time=SIM_TIME_LIST[0], sim_time_list=SIM_TIME_LIST)
+
+    # Main Analysis and Probability Sensitivity Analysis
+    psa_draws = None
+    if PRESAMPLE or sampler != 'random':
+        psa_draws = PSADraws(params=params_neonate, resample=resample_neonatal,
+                             num_psa=MAX_PSA if ADAPTIVE else NUM_PSA,
+                             rng=np.random.RandomState(seed=0), sampler=sampler)
+    # settings the PSA iterations depend on (saved iterations of other settings are not resumed)
+    psa_config = {'discount': DISCOUNT, 'sim_time_list': SIM_TIME_LIST,
+                  'num_maternal_disu': params_neonate.num_psa,
+                  'presampled': None if psa_draws is None else (psa_draws.sampler, psa_draws.numPsa),
+                  'parameters': get_distributions(params=params_neonate)}
+    if ADAPTIVE:
+        # stop once the headline outputs are estimated precisely enough
+        psa_results, headline_stats, stopping_trace = run_adaptive_psa(
+            simulate=partial(simulate_neonatal, params_neonate, psa_draws),
+            get_outputs=get_neonatal_outputs, output_names=get_neonatal_output_names(),
+            tolerance=MCSE_TOLERANCE, min_psa=MIN_PSA, max_psa=MAX_PSA, batch_size=BATCH_SIZE,
+            num_workers=NUM_WORKERS, chunk_size=CHUNK_SIZE, checkpoint_dir=CHECKPOINT_DIR, config=psa_config)
+        print(headline_stats.to_dataframe().to_string(index=False))
+        os.makedirs(ADAPTIVE_DIR, exist_ok=True)
+        stopping_trace.to_csv(os.path.join(ADAPTIVE_DIR, 'neonatal_trace.csv'), index=False)
+        headline_stats.to_dataframe().to_csv(os.path.join(ADAPTIVE_DIR, 'neonatal_outputs.csv'), index=False)
+    else:
+        psa_results = run_psa_in_parallel(simulate=partial(simulate_neonatal, params_neonate, psa_draws),
+                                          num_psa=NUM_PSA, num_workers=NUM_WORKERS, chunk_size=CHUNK_SIZE,
+                                          checkpoint_dir=CHECKPOINT_DIR, config=psa_config)
+    num_psa = len(psa_results)     # number of PSA iterations run
+    if VARIANCE_REDUCTION:
+        # headline outputs with antithetic pairs averaged and adjusted by control variates
+        controls, control_means = get_control_draws(psa_draws=psa_draws,
+                                                    generators=get_neonatal_controls(params_neonate),
+                                                    num_psa=num_psa)
+        vr_stats = get_variance_reduced_stats(outputs=[get_neonatal_outputs(result) for result in psa_results],
+                                              output_names=get_neonatal_output_names(),
+                                              controls=controls, control_means=control_means, pair_size=2)
+        print(vr_stats.to_string(index=False))
+        os.makedirs(VR_DIR, exist_ok=True)
+        vr_stats.to_csv(os.path.join(VR_DIR, 'neonatal.csv'), index=False)
+    # incidence
+    incidence_list = [result[0] for result in psa_results]
+    incidence_stat = SummaryStat(name='incidence of neonatal herpes in 2018', data=incidence_list)
+    incidence_avg = incidence_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
+    # quality-adjusted life expectancy for stillbirth
+    qaly_death = psa_results[-1][3]
+
+    # summarize and save the outputs of each simulation length
+    for k, sim_time in enumerate(SIM_TIME_LIST):
+        # neonatal + maternal: per case QLAYs lost
+        neonate_qaly_loss_list = [result[1][k] for result in psa_results]
+        # neonatal + maternal: total QLAYs lost
+        neonate_total_qaly_loss_list = [result[0] * result[1][k] for result in psa_results]
+        # maternal: per case QALYs lost
+        maternal_qaly_loss_list = [result[2][k] for result in psa_results]
+        # maternal: total QALYs lost
+        maternal_total_qaly_loss_list = [result[0] * result[2][k] for result in psa_results]
+
+        print('simulation length', sim_time)
+        print('discount rate', DISCOUNT)
+        # incidence
+        print('total number of births infected by HSV in 2018:', incidence_avg)
+        # neonatal + maternal
+        qaly_loss_per_infection_stat = SummaryStat(name='QALYs loss due to neonatal herpes',
+                                                   data=neonate_qaly_loss_list)
+        qaly_loss_total_stat = SummaryStat(name='Total QALYs loss due to neonatal herpes',
+                                           data=neonate_total_qaly_loss_list)
+        qaly_loss_per_infection_avg = \
+            qaly_loss_per_infection_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
+        qaly_loss_total_avg = qaly_loss_total_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
+        print('The average and 95% CI of QALYs loss due to per neonatal herpes:', qaly_loss_per_infection_avg)
+        print('The average and 95% CI of QALYs loss due to neonatal herpes in 2018:', qaly_loss_total_avg)
+        print('quality-adjusted life expectancy for stillbirth', round(qaly_death, 2))
+        # maternal
+        maternal_qaly_loss_per_infection_stat = SummaryStat(name='maternal QALYs loss due to per neonatal herpes',
+                                                            data=maternal_qaly_loss_list)
+        maternal_qaly_loss_total_stat = SummaryStat(name='maternal QALYs loss due to neonatal herpes in 2018',
+                                                    data=maternal_total_qaly_loss_list)
+        maternal_qaly_loss_per_infection_avg = \
+            maternal_qaly_loss_per_infection_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
+        maternal_qaly_loss_total_avg = \
+            maternal_qaly_loss_total_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
+        print('The average and 95% CI maternal QALYs loss due to per neonatal herpes:',
+              maternal_qaly_loss_per_infection_avg)
+        print('The average and 95% CI maternal QALYs loss due to neonatal herpes in 2018:',
+              maternal_qaly_loss_total_avg)
+
+        # output dictionary
+        N_dic = {'simulation length': sim_time,                             # simulation length
+                 'num_case': incidence_avg,                                 # incidence
+                 'loss_per_infection': qaly_loss_per_infection_avg,         # QALYs lost per infection: neonatal+mat.
+                 'loss_total': qaly_loss_total_avg,                         # QALYs lost total: neonatal+maternal
+                 'm_loss_per_infection': maternal_qaly_loss_per_infection_avg,  # QALYs lost per infection: maternal
+                 'm_loss_total': maternal_qaly_loss_total_avg}              # QALYs lost total: maternal
+        # save output
+        with profiler.stage('write_outputs'):
+            output = open('tree_outputs/dics/neonatalGH_{}.pkl'.format(sim_time), 'wb')
+            pickle.dump(N_dic, output)
+            output.close()
+        # save raw draws
+        write_draw_store(store_dir='tree_outputs/draws/neonatal_{}'.format(sim_time),
+                         dic_arrays={'incidence': incidence_list,
+                                     'loss_per_infection': neonate_qaly_loss_list,
+                                     'm_loss_per_infection': maternal_qaly_loss_list})
+    # remove saved PSA iterations once the outputs of the complete run are saved
+    if CHECKPOINT_DIR is not None:
+        clear_psa_shards(checkpoint_dir=CHECKPOINT_DIR)
+    # time spent in each stage of the run
+    if PROFILE:
+        profiler.print_report()
+        profiler.write_json(path=PROFILE_PATH)
@@ -0,0 +1,76 @@
+import os
+from functools import partial
+import numpy as np
+import pandas as pd
+from supports.OneWaySensitivitySupport import run_one_way_sensitivity
+from supports.RunProbTreeSupport import get_psa_outcomes
+from supports.ScenarioRegistrySupport import scenario_registry
+from classes.ParameterClass import ParametersTypeOne, ParametersTypeTwo
+from analyses.RunHSV1ProbTree import simulate_hsv1, sex_list, age_list
+from analyses.RunHSV2ProbTree import simulate_hsv2
+
+# Parameter initiation
+BASE_DISCOUNT = 0.03    # (float) discounting rate of the base case
+NUM_PSA = 1000          # (int) number of probability sensitivity analysis iterations (shared by all scenarios)
+NUM_WORKERS = 1         # (int) number of worker processes for PSA iterations, 1 = serial, None = all CPUs
+CHUNK_SIZE = None       # (int) number of PSA iterations per worker task, None = 4 tasks per worker
+OUTPUT_PATH = 'tree_outputs/sensitivity/one_way.csv'    # (str) results table (read by Fig7)
+
+# one-way sensitivity analysis scenarios (in the order of Fig7)
+# 'discount': discounting rate, 'overrides': parameter samples overridden by a scenario of the registry
+SCENARIOS = [
+    {'name': '0.06 discount rate', 'discount': 0.06},
+    {'name': '0 discount rate', 'discount': 0},
+    {'name': 'GBD symptomatic outbreak disutility',
+     'overrides': scenario_registry.get_overrides(name='GBD symptomatic outbreak disutility')},
+    {'name': '0.02 psychosocial disutility',
+     'overrides': scenario_registry.get_overrides(name='0.02 psychosocial disutility')},
+    {'name': '0 psychosocial disutility',
+     'overrides': scenario_registry.get_overrides(name='0 psychosocial disutility')},
+]
+
+
+def get_hsv1_outcome_draws(psa_results, k):
+    """ :return: QALYs lost per case and total QALYs lost of each PSA iteration with the k-th pair of scenario and
+    discounting rate """
+    utility = [result[1] if k == 0 else result[5][k - 1] for result in psa_results]
+    return get_outcome_draws(utility=utility, incidence=[result[0] for result in psa_results])
+
+
+def get_hsv2_outcome_draws(psa_results, k):
+    """ :return: QALYs lost per case and total QALYs lost of each PSA iteration with the k-th pair of scenario and
+    discounting rate """
+    utility = [result[1] if k == 0 else result[7][k - 1] for result in psa_results]
+    return get_outcome_draws(utility=utility, incidence=[result[0] for result in psa_results])
+
+
+def get_outcome_draws(utility, incidence):
+    """ :param utility: list of age- and sex-specific QALYs lost per case of each PSA iteration
+    :param incidence: list of age- and sex-specific incidence of each PSA iteration """
+    draw_shape = (len(utility), len(sex_list), len(age_list))
+    outcomes = get_psa_outcomes(utility=np.reshape(utility, draw_shape),
+                                incidence=np.reshape(incidence, draw_shape),
+                                sex_list=sex_list)
+    return {'qaly_per_case': outcomes['non_age_sex_qaly'],
+            'total_qaly': outcomes['t_qaly_hsv']}
+
+
+if __name__ == '__main__':
+    rows = []
+    for virus_type, params, simulate, get_draws in [('HSV-1', ParametersTypeOne(), simulate_hsv1,
+                                                     get_hsv1_outcome_draws),
+                                                    ('HSV-2', ParametersTypeTwo(), simulate_hsv2,
+                                                     get_hsv2_outcome_draws)]:
+        virus_rows = run_one_way_sensitivity(simulate=partial(simulate, params, None),
+                                             get_outcome_draws=get_draws,
+                                             scenarios=SCENARIOS,
+                                             base_discount=BASE_DISCOUNT,
+                                             num_psa=NUM_PSA,
+                                             num_workers=NUM_WORKERS,
+                                             chunk_size=CHUNK_SIZE)
+        rows.extend(dict(row, virus_type=virus_type) for row in virus_rows)
+
+    # save results table
+    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+    pd.DataFrame(rows, columns=['virus_type', 'scenario', 'outcome', 'mean', 'lower', 'upper']).to_csv(
+        OUTPUT_PATH, index=False)
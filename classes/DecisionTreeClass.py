@@ -1,6 +1,8 @@
 from enum import Enum
 import copy
+import numpy as np
 import matplotlib.pyplot as plt
+from supports.ProfilingSupport import profiler, profiled
 
 
 class Columns(Enum):
@@ -253,6 +255,304 @@ def create_future_nodes(names, dict_chances, dict_terminals):
     return future_nodes
 
 
+class CompiledTree:
+    def __init__(self, name, dict_decisions, dict_chances, dict_terminals):
+        """ compiles the structure of a decision tree once into topologically ordered flat arrays, so that trees
+        with the same structure but different probabilities and payoffs are evaluated by array reductions
+        without building the node graph again
+        :param name: (string) key of the decision node in the dictionary of decision nodes
+        :param dict_decisions: dictionary of decision nodes
+        :param dict_chances: dictionary of chance nodes
+        :param dict_terminals: dictionary of terminal nodes
+        """
+        if name not in dict_decisions:
+            raise ValueError('{} is not in the decision node dictionary'.format(name))
+        self.name = name
+
+        # nodes in pre-order, a parent is always before its future nodes
+        self.nodeNames = []     # name of each node
+        self.isChance = []      # whether each node is a chance node (otherwise a terminal node)
+        self.parents = []       # index of the parent node, -1 for future nodes of the decision node
+        self.probSlots = []     # index of the probability of this node in the probability list of its parent
+        self.depths = []        # depth of each node, 0 for future nodes of the decision node
+        self.roots = []         # indices of future nodes of the decision node
+        for root_name in dict_decisions[name][Columns.NODES.value]:
+            self._add_node(root_name, -1, len(self.roots), 0, dict_chances, dict_terminals)
+
+        num_nodes = len(self.nodeNames)
+        self.parents = np.array(self.parents, dtype=int)
+        self.probSlots = np.array(self.probSlots, dtype=int)
+        self.depths = np.array(self.depths, dtype=int)
+        self.isChance = np.array(self.isChance, dtype=bool)
+        self.chanceNodes = np.flatnonzero(self.isChance).tolist()
+        # nodes at each depth (in pre-order), used to pass probabilities down and outcomes up level by level
+        self.levels = [np.flatnonzero(self.depths == depth) for depth in range(self.depths.max(initial=-1) + 1)]
+        # indices of the nodes in the subtree of each root, in pre-order and in post-order
+        self.subtrees = []
+        for k, root in enumerate(self.roots):
+            end = self.roots[k + 1] if k + 1 < len(self.roots) else num_nodes
+            self.subtrees.append(np.arange(root, end))
+        self.postOrders = [self._get_post_order(subtree) for subtree in self.subtrees]
+
+        # outcomes of the last evaluation, shape (# of nodes, # of draws)
+        self.eCosts = np.zeros((num_nodes, 0))
+        self.eUtilities = np.zeros((num_nodes, 0))
+        self.cumProbs = np.ones((num_nodes, 0))
+        self.componentKeys = []     # names of components
+        self.hasComponents = np.zeros((num_nodes, 0), dtype=bool)     # whether each node has each component
+        self.components = np.zeros((num_nodes, 0, 0))   # expected components of each node
+
+    def _add_node(self, name, parent, prob_slot, depth, dict_chances, dict_terminals):
+        """ adds a node and its future nodes (names not in the node dictionaries are skipped) """
+        if name in dict_chances:
+            is_chance = True
+        elif name in dict_terminals:
+            is_chance = False
+        else:
+            return False
+
+        index = len(self.nodeNames)
+        self.nodeNames.append(name)
+        self.isChance.append(is_chance)
+        self.parents.append(parent)
+        self.probSlots.append(prob_slot)
+        self.depths.append(depth)
+        if parent == -1:
+            self.roots.append(index)
+
+        if is_chance:
+            i = 0  # iterator in future nodes
+            for future_name in dict_chances[name][Columns.NODES.value]:
+                if self._add_node(future_name, index, i, depth + 1, dict_chances, dict_terminals):
+                    i += 1
+        return True
+
+    def _get_post_order(self, subtree):
+        """ :returns indices of nodes in the subtree in post-order (future nodes before their parent) """
+        post_order = []
+        children = {}
+        for index in subtree[1:]:
+            children.setdefault(self.parents[index], []).append(index)
+
+        def visit(index):
+            for child in children.get(index, []):
+                visit(child)
+            post_order.append(index)
+
+        visit(subtree[0])
+        return post_order
+
+    def _get_node_values(self, dict_chances, dict_terminals):
+        """ returns the probability of moving from the parent to each node, the immediate cost and utility of each
+        node and the component dictionary of each node of one draw """
+        cost_col, utility_col, dics_col, prob_col = \
+            Columns.COST.value, Columns.UTILITY.value, Columns.DICS.value, Columns.PROB.value
+        nodes = [dict_chances[name] if is_chance else dict_terminals[name]
+                 for name, is_chance in zip(self.nodeNames, self.isChance.tolist())]
+        probs = [1 if parent == -1 else nodes[parent][prob_col][slot]
+                 for parent, slot in zip(self.parents.tolist(), self.probSlots.tolist())]
+        costs = [node[cost_col] for node in nodes]
+        utilities = [node[utility_col] for node in nodes]
+        component_dics = [node[dics_col] for node in nodes]
+        return probs, costs, utilities, component_dics
+
+    def evaluate(self, dict_chances, dict_terminals):
+        """ evaluates the expected cost, utility, components and cumulative probability of each node
+        :param dict_chances: dictionary of chance nodes (same structure as the compiled tree)
+        :param dict_terminals: dictionary of terminal nodes (same structure as the compiled tree)
+        """
+        self.evaluate_batch([dict_chances], [dict_terminals])
+
+    def evaluate_batch(self, list_dict_chances, list_dict_terminals):
+        """ evaluates a batch of draws given as node dictionaries (see evaluate_arrays)
+        :param list_dict_chances: list of dictionaries of chance nodes, one per draw
+        :param list_dict_terminals: list of dictionaries of terminal nodes, one per draw
+        """
+        with profiler.stage('read_tree_dicts'):
+            node_values = [self._get_node_values(dict_chances, dict_terminals)
+                           for dict_chances, dict_terminals in zip(list_dict_chances, list_dict_terminals)]
+            num_nodes, num_draws = len(self.nodeNames), len(node_values)
+            probs = np.array([values[0] for values in node_values], dtype=float).reshape(num_draws, num_nodes)
+            costs = np.array([values[1] for values in node_values], dtype=float).reshape(num_draws, num_nodes)
+            utilities = np.array([values[2] for values in node_values], dtype=float).reshape(num_draws, num_nodes)
+
+            # (draw x node x component) array of immediate components, keys in the order they first appear
+            component_keys = []
+            columns = {}
+            draws, rows, cols, component_values = [], [], [], []
+            for draw, values in enumerate(node_values):
+                for index, dic in enumerate(values[3]):
+                    for key, value in dic.items():
+                        if key not in columns:
+                            columns[key] = len(component_keys)
+                            component_keys.append(key)
+                        draws.append(draw)
+                        rows.append(index)
+                        cols.append(columns[key])
+                        component_values.append(value)
+            components = np.zeros((num_draws, num_nodes, len(component_keys)))
+            components[draws, rows, cols] = component_values
+            has_components = np.zeros((num_nodes, len(component_keys)), dtype=bool)
+            has_components[rows, cols] = True
+
+        self.evaluate_arrays(probs, costs, utilities, components,
+                             component_keys=component_keys, has_components=has_components)
+
+    @profiled('evaluate_tree')
+    def evaluate_arrays(self, probs, costs, utilities, components=None, component_keys=None, has_components=None):
+        """ evaluates the expected cost, utility, components and cumulative probability of each node for a batch
+        of draws in one pass, outcomes have shape (# of nodes, # of draws)
+        :param probs: (draw x node) array of probabilities of moving from the parent to each node
+                      (1 for future nodes of the decision node), nodes in the order of self.nodeNames
+        :param costs: (draw x node) array of immediate costs
+        :param utilities: (draw x node) array of immediate utilities
+        :param components: (draw x node x component) array of immediate components (utilities of chance nodes
+                           broken down), None = no components
+        :param component_keys: list of names of components (default: 0, 1, 2, ...)
+        :param has_components: (node x component) array of whether each node has each component
+                               (default: components not 0 in some draw)
+        """
+        probs = np.asarray(probs, dtype=float)
+        costs = np.asarray(costs, dtype=float)
+        utilities = np.asarray(utilities, dtype=float)
+        num_draws, num_nodes = probs.shape
+        if components is None:
+            components = np.zeros((num_draws, num_nodes, 0))
+        components = np.asarray(components, dtype=float)
+        if costs.shape != probs.shape or utilities.shape != probs.shape or components.shape[:2] != probs.shape \
+                or num_nodes != len(self.nodeNames):
+            raise ValueError('wrong shape of arrays: {}, {}, {} and {} for {} nodes'.format(
+                probs.shape, costs.shape, utilities.shape, components.shape, len(self.nodeNames)))
+        self.componentKeys = list(range(components.shape[2])) if component_keys is None else list(component_keys)
+        self.hasComponents = np.any(components != 0, axis=0) if has_components is None \
+            else np.asarray(has_components, dtype=bool)
+
+        # check components and probabilities of future nodes of chance nodes
+        chances = self.chanceNodes
+        bad_components = ~np.isclose(components[:, chances].sum(axis=2), utilities[:, chances], rtol=1e-12, atol=0)
+        if bad_components.any():
+            draw, k = np.argwhere(bad_components)[0]
+            raise ValueError('Sum of components should be the utility. It is {} instead of {} for node {}.'.format(
+                components[draw, chances[k]].sum(), utilities[draw, chances[k]], self.nodeNames[chances[k]]))
+        prob_sums = np.zeros((num_nodes, num_draws))
+        np.add.at(prob_sums, self.parents[self.parents >= 0], probs.T[self.parents >= 0])
+        bad_probs = ~((0.99999 < prob_sums[chances]) & (prob_sums[chances] < 1.00001))
+        if bad_probs.any():
+            k, draw = np.argwhere(bad_probs)[0]
+            raise ValueError('Sum of probabilities out of chance nodes should be 1. It is {} for node {}.'
+                             .format(prob_sums[chances[k], draw], self.nodeNames[chances[k]]))
+
+        # (node x draw) matrix of probabilities and (node x draw x [cost, utility, components]) of immediate outcomes
+        probs = probs.T
+        outcomes = np.zeros((num_nodes, num_draws, len(self.componentKeys) + 2))
+        outcomes[:, :, 0] = costs.T
+        outcomes[:, :, 1] = utilities.T
+        own_components = np.zeros_like(outcomes)
+        own_components[:, :, 2:] = components.transpose(1, 0, 2)
+
+        # cumulative probabilities: from the top level down
+        self.cumProbs = np.ones((num_nodes, num_draws))
+        for level in self.levels[1:]:
+            self.cumProbs[level] = self.cumProbs[self.parents[level]] * probs[level]
+
+        # expected outcomes: from the bottom level up, adding future nodes in order
+        for depth in range(len(self.levels) - 1, -1, -1):
+            level = self.levels[depth]
+            # immediate components are added after the components of future nodes
+            outcomes[level] += own_components[level]
+            if depth > 0:
+                np.add.at(outcomes, self.parents[level], outcomes[level] * probs[level][:, :, None])
+        self.eCosts = outcomes[:, :, 0]
+        self.eUtilities = outcomes[:, :, 1]
+        self.components = outcomes[:, :, 2:]
+
+    def get_cost_utility(self):
+        """ returns the expected cost and health utility of each decisions (of the first draw)
+        :return: dictionary of outcomes where key = node name and value =[expected cost, expected utility]
+        """
+        outcomes = dict()
+        for key, (costs, utilities) in self.get_batch_cost_utility().items():
+            outcomes[key] = [float(costs[0]), float(utilities[0])]
+        return outcomes
+
+    def get_component_loss(self):
+        """ return breakdowns of the expected cost and health utility of each decision (of the first draw) """
+        outcomes = dict()
+        for key, components in self.get_batch_component_loss().items():
+            outcomes[key] = {component: float(values[0]) for component, values in components.items()}
+        return outcomes
+
+    def get_terminal_prob(self):
+        """ :returns a dictionary where key = the name of terminal nodes (if any) and values = probabilities
+        (of the first draw) """
+        terminal_prob = dict()
+        for key, probs in self.get_batch_terminal_prob().items():
+            terminal_prob[key] = {terminal: float(values[0]) for terminal, values in probs.items()}
+        return terminal_prob
+
+    def get_batch_cost_utility(self):
+        """ :return: dictionary of outcomes where key = node name and
+        value =[array of expected costs, array of expected utilities] (one element per draw) """
+        outcomes = dict()
+        for root in self.roots:
+            outcomes[self.nodeNames[root]] = [self.eCosts[root], self.eUtilities[root]]
+        return outcomes
+
+    @profiled('component_breakdown')
+    def get_batch_component_loss(self):
+        """ :return: dictionary of outcomes where key = node name and value = dictionary of arrays of expected
+        components (one element per draw, 0 for draws where the component does not appear) """
+        outcomes = dict()
+        for root, post_order in zip(self.roots, self.postOrders):
+            # components in the subtree, in the order they appear when future nodes are aggregated first
+            has_components = self.hasComponents[post_order]
+            cols = np.flatnonzero(has_components.any(axis=0))
+            cols = cols[np.argsort(has_components[:, cols].argmax(axis=0), kind='stable')]
+            outcomes[self.nodeNames[root]] = {self.componentKeys[col]: self.components[root, :, col] for col in cols}
+        return outcomes
+
+    def get_batch_terminal_prob(self):
+        """ :returns a dictionary where key = the name of terminal nodes (if any) and values = arrays of
+        probabilities (one element per draw) """
+        terminal_prob = dict()
+        for root, subtree in zip(self.roots, self.subtrees):
+            terminal_prob[self.nodeNames[root]] = {self.nodeNames[index]: self.cumProbs[index]
+                                                   for index in subtree if not self.isChance[index]}
+
+            # error checking: sum of cumulative probabilities of terminal nodes should be 1
+            s = 0
+            for key in terminal_prob[self.nodeNames[root]]:
+                s += terminal_prob[self.nodeNames[root]][key]
+            assert np.all((0.99999 < s) & (s < 1.00001)), \
+                'Sum of cumulative probabilities of terminal nodes should be 1. It is {} for node {}.'\
+                    .format(s, self.nodeNames[root])
+
+        return terminal_prob
+
+
+# compiled trees, key: structure of the tree (names of nodes and their future nodes)
+_dic_compiled_trees = {}
+
+
+@profiled('compile_tree')
+def compile_tree(name, dict_decisions, dict_chances, dict_terminals):
+    """ returns the compiled tree for the structure of these node dictionaries, each structure is compiled once
+    :param name: (string) key of the decision node in the dictionary of decision nodes
+    :param dict_decisions: dictionary of decision nodes
+    :param dict_chances: dictionary of chance nodes
+    :param dict_terminals: dictionary of terminal nodes
+    :return: (CompiledTree) compiled tree, call evaluate(dict_chances, dict_terminals) or
+             evaluate_batch(list_dict_chances, list_dict_terminals) before getting outcomes
+    """
+    key = (name,
+           tuple((node, tuple(values[Columns.NODES.value])) for node, values in dict_decisions.items()),
+           tuple((node, tuple(values[Columns.NODES.value])) for node, values in dict_chances.items()),
+           tuple(dict_terminals))
+    if key not in _dic_compiled_trees:
+        _dic_compiled_trees[key] = CompiledTree(name, dict_decisions, dict_chances, dict_terminals)
+    return _dic_compiled_trees[key]
+
+
 def graph_outcomes(decision_tree):
     """ plots the expected cost and expected utility of choices """
 
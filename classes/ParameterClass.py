@@ -1,8 +1,11 @@
+import itertools
 from supports.UtilityOrderSupport import *
 from supports.DemographicValuesSupport import get_adjusted_disu
 from supports.RandomValueGenerators import BetaValueGenerator, LogNormalValueGenerator, DirichletValueGenerator
+from supports.ProfilingSupport import profiled
 from supports.ParameterAndRecurrentPeriodSupport import separate_cst_helper, \
-    life_table_get_long_term_loss_mixed_sex, life_table_get_long_term_loss
+    life_table_get_long_term_loss_mixed_sex, life_table_get_cumulative_loss_batch, \
+    life_table_get_cumulative_loss_mixed_sex_batch, get_loss_within_duration
 
 
 class Incidence:
@@ -61,6 +64,10 @@ class Incidence:
         self.male_age_specific_incidence_sample = [prob * total_id_m for prob in prob_m_age_spcfc_id_sample]
 
 
+# identities of parameter samples, unique across all parameter objects
+_sample_ids = itertools.count(start=1)
+
+
 class Parameters:
     def __init__(self):
         """ 1) age and sex insensitive parameters & initiations; 2) age and sex sensitive initiations """
@@ -109,6 +116,13 @@ class Parameters:
         ##################
         # initialization #
         ##################
+        # identity of the current parameter sample, changes whenever non-age or sex parameters are resampled
+        self.sample_id = 0
+        # parameter samples overridden by a scenario (name: value) and their sampled values
+        self.dic_overrides = {}
+        self._dic_sampled_values = {}
+        # identity of the current overrides, changes whenever parameter samples are overridden or restored
+        self.override_id = 0
         # Non Age and Sex Parameters #
         # incidence
         self.f_id_distr = None
@@ -148,7 +162,34 @@ class Parameters:
         self.am_qaly = 0
         self.ur_qaly = 0
 
+    def _update_sample_id(self):
+        self.sample_id = next(_sample_ids)
+
+    def override_samples(self, dic_values):
+        """ set parameter samples to the given values (e.g. for a sensitivity analysis scenario) until
+        restore_samples is called; the overridden values are listed in dic_overrides (recurrent periods cached for
+        the current sample are reused if they do not depend on the overridden parameters)
+        :param dic_values: dictionary of parameter sample name (e.g. 'diagnosis_disu_sample') and value
+        """
+        for name, value in dic_values.items():
+            if not hasattr(self, name):
+                raise ValueError('wrong parameter sample name: {}'.format(name))
+            if name not in self.dic_overrides:
+                self._dic_sampled_values[name] = getattr(self, name)
+            setattr(self, name, value)
+            self.dic_overrides[name] = value
+        self.override_id = next(_sample_ids)
+
+    def restore_samples(self):
+        """ set the parameter samples changed by override_samples back to the sampled values """
+        for name, value in self._dic_sampled_values.items():
+            setattr(self, name, value)
+        self.dic_overrides = {}
+        self._dic_sampled_values = {}
+        self.override_id = next(_sample_ids)
+
     def resample_non_age_sex_params(self, rng):
+        self._update_sample_id()
         # primary infection diagnosis [undiagnosed vs. diagnosed]
         diagnose_prob_sample = self.diagnose_prob.sample(rng=rng)
         self.list_diagnose = [(1 - diagnose_prob_sample), diagnose_prob_sample]
@@ -262,6 +303,7 @@ class ParametersTypeOne(Parameters):
         # urinary retention, recurrent period
         self.urinary_retention_recur_prob_sample = None
 
+    @profiled('resample_params')
     def resample_hsv1_non_age_sex_params(self, rng):
         self.resample_non_age_sex_params(rng=rng)
         ##############################
@@ -317,8 +359,10 @@ class ParametersTypeOne(Parameters):
         self.recur_treat_duration_sample = self.recur_treat_duration.sample(rng=rng)
         # complication (parent class - urinary retention & aseptic meningitis)
 
+    @profiled('resample_params')
     def resample_hsv1_sex_params(self, sex, rng):
         # self.resample_sex_params(sex=sex, rng=rng)
+        self._update_sample_id()
         if sex == 'male':
             self.infreq_first_year_recur_rate_sample = self.m_infreq_first_year_recur_rate.sample(rng=rng)
             self.infreq_second_year_recur_rate_sample = self.m_infreq_second_year_recur_rate.sample(rng=rng)
@@ -328,6 +372,7 @@ class ParametersTypeOne(Parameters):
         else:
             raise ValueError('wrong sex type')
 
+    @profiled('update_age_params')
     def update_hsv1_age_params(self, age_of_infection):
         self.update_age_params(age_of_infection=age_of_infection)
 
@@ -446,6 +491,7 @@ class ParametersTypeTwo(Parameters):
         self.freq_nocst_first_year_recur_rate_sample = None
         self.freq_cst_first_year_recur_rate_sample = None
 
+    @profiled('resample_params')
     def resample_hsv2_non_age_sex_params(self, rng):
         self.resample_non_age_sex_params(rng=rng)
         ####################
@@ -508,8 +554,10 @@ class ParametersTypeTwo(Parameters):
         #############################################
         self.avg_yearly_recur_reduction_sample = self.avg_yearly_recur_reduction.sample(rng=rng)
 
+    @profiled('resample_params')
     def resample_hsv2_sex_params(self, sex, rng):
         # self.resample_sex_params(sex=sex, rng=rng)
+        self._update_sample_id()
         if sex == 'male':
             # outcome after primary infection
             self.nor_am_ur_after_primary_prob_sample = self.m_sympt_primary_outcome.sample(rng=rng)
@@ -539,23 +587,33 @@ class ParametersTypeTwo(Parameters):
         else:
             raise ValueError('wrong sex type')
 
+    @profiled('update_age_params')
     def update_hsv2_age_params(self, age_of_infection):
         self.update_age_params(age_of_infection=age_of_infection)
 
 
 class ParametersNeonatal:
-    def __init__(self, discount=0.03, sim_time=0, num_psa=1000):
+    def __init__(self, discount=0.03, sim_time=0, num_psa=1000, cache_dir='tree_outputs/cache/maternal_disu',
+                 sim_time_list=None):
         """
         :param discount: discounting rate
         :param sim_time: simulation length. 0: lifetime, ≥1: the actual number of years to simulation
+        :param num_psa: number of PSA iterations
+        :param cache_dir: folder of cached maternal disutility matrices, None = do not cache on disk
+        :param sim_time_list: list of simulation lengths whose QALYs loss is calculated together for every draw
+                              (to switch between them with set_sim_time), None = [sim_time]
         """
         self.num_psa = num_psa
+        self.cache_dir = cache_dir
 
         # discounting
         self.discount = discount
 
         # simulation length
         self.sim_time = sim_time
+        self.sim_time_list = [sim_time] if sim_time_list is None else list(sim_time_list)
+        if self.sim_time not in self.sim_time_list:
+            raise ValueError('wrong simulation length, sim_time should be in sim_time_list')
 
         ####################
         # INCIDENCE / RATE #
@@ -632,9 +690,8 @@ class ParametersNeonatal:
         self.intrapartum_severe_disu = \
             BetaValueGenerator(mean=0.84, stdv=0.05, note='disutility due to intrapartum severe neurological sequelae')
 
-        self.maternal_disu_matrix = self._sample_by_utility_order(mil=self.maternal_mil_disu,
-                                                                  mod=self.maternal_mod_disu,
-                                                                  sev=self.maternal_sev_disu)
+        # correlated maternal disutilities (mild, moderate, severe) of PSA iterations, generated on first use
+        self._maternal_disu_matrix = None
 
         ##############
         # INITIATION #
@@ -658,10 +715,22 @@ class ParametersNeonatal:
         self.DicAcute = {}
         self.DicSequelae = {}
         self.qaly_death = 0
-
-    def resample_by_distr(self, seed):
+        # long-term (life table) QALYs loss of each outcome, updated in batch for every draw
+        self.DicNeonatalLoss = {}
+        self.DicMaternalLoss = {}
+        # the same for every simulation length of sim_time_list
+        self.DicNeonatalLossBySimTime = {}
+        self.DicMaternalLossBySimTime = {}
+
+    @profiled('resample_params')
+    def resample_by_distr(self, seed, rng=None):
+        """ resample parameters of a PSA iteration
+        :param seed: index of PSA iteration, also used as random seed if rng is not provided
+        :param rng: random state (or draws of this iteration sampled up front)
+        """
         i = int(seed)
-        rng = np.random.RandomState(seed=i)
+        if rng is None:
+            rng = np.random.RandomState(seed=i)
         ###############
         # PROBABILITY #
         ###############
@@ -742,15 +811,61 @@ class ParametersNeonatal:
                                       'maternal_dura': maternal_life_expec_sample}
                             }
 
+        # long-term QALYs loss of all neonatal and maternal outcomes
+        self._update_long_term_losses()
+
+    def _update_long_term_losses(self):
+        """ calculate life-table QALYs loss of all neonatal and maternal outcomes of the current draw in batch,
+        for every simulation length of sim_time_list (the life table is calculated once, as cumulative loss by
+        years since onset, and the loss within each simulation length is read off it) """
+        # neonatal perspective (intrapartum sequelae & intrauterine neurological impairment)
+        sequelae_list = ['nor', 'mil', 'mod', 'sev', 'neuro']
+        neonatal_cumulative, neonatal_annual = life_table_get_cumulative_loss_mixed_sex_batch(
+            age_onset=0, acute_sympt_disu=0, discount=self.discount, emort=0, if_utility=False,
+            seq_disu=[self.DicSequelae[sequelae]['disu'] for sequelae in sequelae_list])
+
+        # maternal perspective
+        outcome_list = ['nor', 'mil', 'mod', 'sev', 'dea', 'neuro']
+        grief_loss_list, age_onset_list, seq_disu_list, lifetime_dura_list = \
+            zip(*[self._get_maternal_loss_inputs(neonate_outcome=outcome) for outcome in outcome_list])
+        maternal_cumulative, maternal_annual = life_table_get_cumulative_loss_batch(
+            sex='female', age_onset=age_onset_list, seq_disu=seq_disu_list, discount=self.discount)
+
+        for sim_time in self.sim_time_list:
+            neonatal_loss = get_loss_within_duration(
+                cumulative_loss=neonatal_cumulative, annual_loss=neonatal_annual,
+                seq_dura=[self._get_neonatal_seq_dura(sequelae=sequelae, sim_time=sim_time)
+                          for sequelae in sequelae_list])
+            self.DicNeonatalLossBySimTime[sim_time] = dict(zip(sequelae_list, neonatal_loss.tolist()))
+            # maternal loss lasts for the simulation length, or the duration of the outcome if lifetime
+            long_term_loss = get_loss_within_duration(
+                cumulative_loss=maternal_cumulative, annual_loss=maternal_annual,
+                seq_dura=lifetime_dura_list if sim_time == 0 else sim_time)
+            self.DicMaternalLossBySimTime[sim_time] = {outcome: grief_loss + loss for outcome, grief_loss, loss
+                                                       in zip(outcome_list, grief_loss_list, long_term_loss.tolist())}
+        self.set_sim_time(sim_time=self.sim_time)
+
+    def set_sim_time(self, sim_time):
+        """ switch the simulation length of the current draw to one of sim_time_list (without recalculation) """
+        if sim_time not in self.sim_time_list:
+            raise ValueError('wrong simulation length, sim_time should be in sim_time_list')
+        self.sim_time = sim_time
+        self.DicNeonatalLoss = self.DicNeonatalLossBySimTime.get(sim_time, {})
+        self.DicMaternalLoss = self.DicMaternalLossBySimTime.get(sim_time, {})
+
+    def _get_neonatal_seq_dura(self, sequelae, sim_time):
+        """ duration of neonatal sequelae within simulation duration (0 = lifetime) """
+        if sequelae == 'sev':
+            if sim_time > 0:
+                sim_time = min(sim_time, self.DicSequelae['sev']['dura'])
+        return sim_time
+
     def get_intrauterine_qaly_loss(self):
         """ get total QALYs lost due to intrauterine HSV infection within simulation duration (sim_d)"""
         # long-term QALYs loss (normal, sequelae, death)
         # QALYs loss of death = total QALYs for a child with normal outcome (discounted)
         prob_outcomes = self.list_intrauterine_long_term_outcomes
-        neuro_loss = life_table_get_long_term_loss_mixed_sex(age_onset=0, acute_sympt_disu=0,
-                                                             seq_disu=self.DicSequelae['neuro']['disu'],
-                                                             discount=self.discount, seq_dura=self.sim_time,
-                                                             emort=0, if_utility=False)
+        neuro_loss = self.DicNeonatalLoss['neuro']
         sequelae_and_death_qaly_loss = neuro_loss * prob_outcomes[1] + self.qaly_death * prob_outcomes[2]
 
         # maternal QALYs loss (having an impaired child, losing a child), dependent on simulation length
@@ -770,19 +885,18 @@ class ParametersNeonatal:
         :param excess_mort: (float) excess mortality with sequelae
         # :param sim_d: simulation length: (float) simulation length, sim_d = 0 means life time
         """
-        # calculate QALYs loss based on sequelae type
-        sim_time = self.sim_time
-        if sequelae == 'sev':
-            if sim_time > 0:
-                sim_time = min(self.sim_time, self.DicSequelae['sev']['dura'])
-        # Neonatal perspective
-        loss = life_table_get_long_term_loss_mixed_sex(age_onset=0,
-                                                       acute_sympt_disu=0,
-                                                       seq_disu=self.DicSequelae[sequelae]['disu'],
-                                                       discount=self.discount,
-                                                       seq_dura=sim_time,
-                                                       emort=excess_mort,
-                                                       if_utility=utility)
+        # Neonatal perspective (QALYs loss without excess mortality is calculated in batch for every draw)
+        if not utility and excess_mort == 0:
+            loss = self.DicNeonatalLoss[sequelae]
+        else:
+            loss = life_table_get_long_term_loss_mixed_sex(age_onset=0,
+                                                           acute_sympt_disu=0,
+                                                           seq_disu=self.DicSequelae[sequelae]['disu'],
+                                                           discount=self.discount,
+                                                           seq_dura=self._get_neonatal_seq_dura(
+                                                               sequelae=sequelae, sim_time=self.sim_time),
+                                                           emort=excess_mort,
+                                                           if_utility=utility)
         # maternal perspective
         m_loss = self.get_maternal_loss(neonate_outcome=sequelae)
         total_loss = loss + m_loss
@@ -800,45 +914,55 @@ class ParametersNeonatal:
         """
         if neonate_outcome not in ['nor', 'mil', 'mod', 'sev', 'dea', 'neuro']:
             raise ValueError('Wrong type of neonatal outcome')
+        return self.DicMaternalLoss[neonate_outcome]
+
+    def _get_maternal_loss_inputs(self, neonate_outcome):
+        """ :returns (QALYs loss of grief period, age of onset, disutility, lifetime duration) of maternal loss
+        where the last three are inputs of the long-term (life table) QALYs loss
+        (the duration is replaced by the simulation length if it is not lifetime) """
         pregnant_age = self.m_avg_age_pregnancy_sample
-        if neonate_outcome == 'dea':
-            # 0.6 years as 'grief period'
+        if neonate_outcome in ['dea', 'mod']:
+            # losing a child (0.6 years as 'grief period') or having a moderately impaired child (1 year as
+            # initial 'shock' period) -> mothers experience a grief period before the long-term loss
             adjusted_disu = get_adjusted_disu(current_age=pregnant_age, disu=self.DicSequelae['dea']['maternal_disu'])
-            dea_duration = self.DicSequelae['dea']['maternal_dura']
-            loss_grief_period = adjusted_disu * dea_duration
-            # long-term loss (same as mothers with children having mild impairment
-            seq_dura = self.DicSequelae['mil']['maternal_dura']
-            seq_disu = self.DicSequelae['mil']['maternal_disu']
-            if self.sim_time != 0:
-                seq_dura = self.sim_time
-            loss = life_table_get_long_term_loss(sex='female', age_onset=pregnant_age + dea_duration,
-                                                 seq_disu=seq_disu, seq_dura=seq_dura, discount=self.discount)
-            return loss_grief_period + loss
-        elif neonate_outcome == 'mod':
-            # moderately impaired child -> mothers also experience an initial 'shock' period
-            # same logic as neonate_outcome == dea
-            # 1 year as 'grief period'
-            adjusted_disu = get_adjusted_disu(current_age=pregnant_age, disu=self.DicSequelae['dea']['maternal_disu'])
-            mod_duration = self.DicSequelae['mod']['maternal_dura']
-            loss_grief_period = adjusted_disu * mod_duration
+            grief_duration = self.DicSequelae[neonate_outcome]['maternal_dura']
+            loss_grief_period = adjusted_disu * grief_duration
+            age_onset = pregnant_age + grief_duration
             # long-term loss (same as mothers with children having mild impairment)
-            seq_dura = self.DicSequelae['mil']['maternal_dura']
-            seq_disu = self.DicSequelae['mil']['maternal_disu']
-            if self.sim_time != 0:
-                seq_dura = self.sim_time
-            loss = life_table_get_long_term_loss(sex='female', age_onset=pregnant_age + mod_duration,
-                                                 seq_disu=seq_disu, seq_dura=seq_dura, discount=self.discount)
-            return loss_grief_period + loss
+            long_term_outcome = 'mil'
         else:
-            seq_dura = self.DicSequelae[neonate_outcome]['maternal_dura']
-            seq_disu = self.DicSequelae[neonate_outcome]['maternal_disu']
-            if self.sim_time != 0:
-                seq_dura = self.sim_time
-            loss = life_table_get_long_term_loss(sex='female', age_onset=pregnant_age, seq_disu=seq_disu,
-                                                 seq_dura=seq_dura, discount=self.discount)
-            return loss
+            loss_grief_period = 0
+            age_onset = pregnant_age
+            long_term_outcome = neonate_outcome
+        seq_dura = self.DicSequelae[long_term_outcome]['maternal_dura']
+        seq_disu = self.DicSequelae[long_term_outcome]['maternal_disu']
+        return loss_grief_period, age_onset, seq_disu, seq_dura
+
+    @property
+    def maternal_disu_matrix(self):
+        """ (num_psa x 3) matrix of maternal disutilities (mild, moderate, severe) sampled by utility order """
+        if self._maternal_disu_matrix is None:
+            self._maternal_disu_matrix = self._sample_by_utility_order(mil=self.maternal_mil_disu,
+                                                                       mod=self.maternal_mod_disu,
+                                                                       sev=self.maternal_sev_disu)
+        return self._maternal_disu_matrix
 
     def _sample_by_utility_order(self, mil, mod, sev):
+        matrix_q = np.asarray([[0, 0, 0], [-1, 0, 0], [-1, -1, 0]])
+        epsilon = 0.05  # tolerance threshold
+        delta = 0.01  # decrement correlation (rho)
+
+        # the matrix only depends on the distributions, the number of PSA iterations, the seeds and the version of
+        # CorrelateUtils (seeds 0, ..., num_psa-1 are used by the PSA iterations, so the reference matrix uses the
+        # next seed)
+        reference_seed = self.num_psa
+        key = ('maternal_disu', [(disu.a, disu.b) for disu in (mil, mod, sev)], self.num_psa, epsilon, delta,
+               reference_seed, CORRELATE_UTILS_VERSION)
+        if self.cache_dir is not None:
+            matrix_u_star = read_cached_matrix(cache_dir=self.cache_dir, key=key)
+            if matrix_u_star is not None:
+                return matrix_u_star
+
         # random sample num_psa times
         seed_list = np.linspace(0, self.num_psa - 1, self.num_psa)
         mil_list = []
@@ -852,10 +976,8 @@ class ParametersNeonatal:
 
         # construct matrix
         matrix_u = np.asarray([mil_list, mod_list, sev_list]).T   # col1 mil, col2 mod, col3 sev
-        matrix_q = np.asarray([[0, 0, 0], [-1, 0, 0], [-1, -1, 0]])
-
-        epsilon = 0.05  # tolerance threshold
-        delta = 0.01  # decrement correlation (rho)
-
-        matrix_u_star = CorrelateUtils(matrix_u=matrix_u, matrix_q=matrix_q, epsilon=epsilon, delta=delta)
+        matrix_u_star = CorrelateUtils(matrix_u=matrix_u, matrix_q=matrix_q, epsilon=epsilon, delta=delta,
+                                       seed=reference_seed)
+        if self.cache_dir is not None:
+            write_cached_matrix(cache_dir=self.cache_dir, key=key, matrix=matrix_u_star)
         return matrix_u_star
@@ -1,46 +1,37 @@
-from classes.RecurrentPeriodClass import RecurrentPeriodTypeTwo, RecurrentPeriodTypeOne
-
-
-def initiate_recur_object_helper_type_two(params, rm, age_of_infection, sex, discount):
-    """ for HSV-2 probabilistic tree, return three objects for no, infreq, freq, freq + cst terminal nodes """
-    no = RecurrentPeriodTypeTwo(parameters=params, recur_type='no', rm=rm,
-                                age_of_infection=age_of_infection, sex=sex, discount=discount)
-    infreq = RecurrentPeriodTypeTwo(parameters=params, recur_type='infrequent', rm=rm,
-                                    age_of_infection=age_of_infection, sex=sex, discount=discount)
-    freq = RecurrentPeriodTypeTwo(parameters=params, recur_type='frequent', rm=rm,
-                                  age_of_infection=age_of_infection, sex=sex, discount=discount)
-    freq_cst = RecurrentPeriodTypeTwo(parameters=params, recur_type='frequent', cst=True, rm=rm,
-                                      age_of_infection=age_of_infection, sex=sex, discount=discount)
-    return no, infreq, freq, freq_cst
+from functools import partial
+from classes.RecurrentPeriodClass import RecurrentPeriodCache
+from supports.ProfilingSupport import profiled
 
+# recurrent periods shared by the tree builders, terminal nodes with identical payoffs are computed once per sample
+recur_period_cache = RecurrentPeriodCache()
 
-def buildHSV1Tree(params, age_of_infection, sex, discount):
-    """ construct a probabilistic tree for HSV-1 infection """
-    # disutility values during primary infection
-    p_untreat = params.primary_sympt_undia_notreat_qaly
-    p_treat = params.primary_sympt_diag_treat_qaly
-    am = params.am_qaly
-    ur = params.ur_qaly
 
-    # cost, disutility, component_disutility_dics, [future nodes], probabilities
-    dictChances = {'c0': [0, 0, {}, ['c1', 'c2'], params.list_primary_type],
-                   'c1': [0, 0, {}, ['c3', 'c6', 'c7'], params.nor_am_ur_after_primary_prob_sample, {}],
-                   'c2': [0, 0, {}, ['cn5', 'cr5'], params.list_recur_type_after_asympt_primary, {}],
-                   'c3': [0, 0, {}, ['c4', 'c5'], params.list_diagnose, {}],
-                   'c4': [0, p_untreat, {'primary': p_untreat}, ['cn1', 'cr1'], params.list_recur_type_after_sympt_primary],
-                   'c5': [0, p_treat, {'primary': p_treat}, ['cn2', 'cr2'], params.list_recur_type_after_sympt_primary],
-                   'c6': [0, p_treat, {'primary': p_treat}, ['c8'], [1]],
-                   'c7': [0, p_treat, {'primary': p_treat}, ['c9'], [1]],
-                   'c8': [0, am, {'am': am}, ['cn3', 'cr3'], params.list_recur_type_after_sympt_primary],
-                   'c9': [0, ur, {'ur': ur}, ['cn4', 'cr4'], params.list_recur_type_after_sympt_primary]
-                   }
+def initiate_recur_object_helper_type_two(params, rm, age_of_infection, sex, discount, cache):
+    """ for HSV-2 probabilistic tree, return objects for no, infreq, freq, freq + cst terminal nodes
+    :param cache: (RecurrentPeriodCache) cache of recurrent periods shared across terminal nodes
+    """
+    no = cache.get_recur_period_type_two(parameters=params, recur_type='no', rm=rm,
+                                         age_of_infection=age_of_infection, sex=sex, discount=discount)
+    infreq = cache.get_recur_period_type_two(parameters=params, recur_type='infrequent', rm=rm,
+                                             age_of_infection=age_of_infection, sex=sex, discount=discount)
+    freq = cache.get_recur_period_type_two(parameters=params, recur_type='frequent', rm=rm,
+                                           age_of_infection=age_of_infection, sex=sex, discount=discount)
+    freq_cst = cache.get_recur_period_type_two(parameters=params, recur_type='frequent', cst=True, rm=rm,
+                                               age_of_infection=age_of_infection, sex=sex, discount=discount)
+    return no, infreq, freq, freq_cst
 
+
+def get_hsv1_terminals(params, age_of_infection, sex, discount, cache):
+    """ :return: terminal nodes of the HSV-1 probabilistic tree and the rate of recurrences for people with
+    infrequent recurrent outbreaks
+    :param cache: (RecurrentPeriodCache) cache of recurrent periods shared across terminal nodes
+    """
     # no/undetected recurrences
-    recur_no = RecurrentPeriodTypeOne(parameters=params, recur_type='no',
-                                      age_of_infection=age_of_infection, sex=sex, discount=discount)
+    recur_no = cache.get_recur_period_type_one(parameters=params, recur_type='no',
+                                               age_of_infection=age_of_infection, sex=sex, discount=discount)
     # infrequent recurrences
-    recur_infreq = RecurrentPeriodTypeOne(parameters=params, recur_type='infrequent',
-                                          age_of_infection=age_of_infection, sex=sex, discount=discount)
+    recur_infreq = cache.get_recur_period_type_one(parameters=params, recur_type='infrequent',
+                                                   age_of_infection=age_of_infection, sex=sex, discount=discount)
 
     # recurrent disutility component dictionary
     # we exclude genital-HSV-1 associated encephalitis and assume QALYs lost associated with it equals 0
@@ -66,57 +57,74 @@ def buildHSV1Tree(params, age_of_infection, sex, discount):
          'cr5': [0, recur_infreq.total_loss_hsv1, total_loss_hsv1_components_infreq]    # psycho + recur
          }
 
-    # cost, utility, component_utility_dic, future_node
-    dictDecisions = {'d1': [0, 0, {}, ['c0']]}
-
     # rate of recurrences for people with infrequent recurrent outbreaks
     rate_of_recur = recur_infreq.rate_of_recurrence
 
-    return dictDecisions, dictChances, dictTerminals, rate_of_recur
+    return dictTerminals, rate_of_recur
 
 
-def buildHSV2Tree(params, age_of_infection, sex, discount):
-    """ construct a probabilistic tree for HSV-2 infection """
+@profiled('build_tree')
+def buildHSV1Tree(params, age_of_infection, sex, discount, cache=None):
+    """ construct a probabilistic tree for HSV-1 infection
+    :param cache: (RecurrentPeriodCache) cache of recurrent periods, None to use recur_period_cache
+    """
+    if cache is None:
+        cache = recur_period_cache
     # disutility values during primary infection
     p_untreat = params.primary_sympt_undia_notreat_qaly
     p_treat = params.primary_sympt_diag_treat_qaly
-    ur = params.ur_qaly
     am = params.am_qaly
+    ur = params.ur_qaly
 
-    # cost, disutility, [future nodes], probabilities
+    # cost, disutility, component_disutility_dics, [future nodes], probabilities
     dictChances = {'c0': [0, 0, {}, ['c1', 'c2'], params.list_primary_type],
-                   'c1': [0, 0, {}, ['c3', 'c4', 'c5'], params.nor_am_ur_after_primary_prob_sample],
-                   'c2': [0, 0, {}, ['t6', 'ri6'], params.list_recur_type_after_asympt_primary],
-                   'c3': [0, 0, {}, ['c6', 'c7'], params.list_diagnose],
-                   'c4': [0, p_treat, {'primary': p_treat}, ['c10'], [1]],
-                   'c5': [0, p_treat, {'primary': p_treat}, ['c11'], [1]],
-                   'c6': [0, p_untreat, {'primary': p_untreat}, ['t1', 'ri1', 'rf1', 'rfc1'], params.list_recur_type_after_sympt_primary],
-                   'c7': [0, p_treat, {'primary': p_treat}, ['t2', 'ri2', 'rf2', 'rfc2'], params.list_recur_type_after_sympt_primary],
-                   'c8': [0, 0, {}, ['t3', 'ri3', 'rf3', 'rfc3'], params.list_recur_type_after_sympt_primary],
-                   'c9': [0, 0, {}, ['t4', 'ri4', 'rf4', 'rfc4'], params.list_recur_type_after_sympt_primary],
-                   'c10': [0, ur, {'ur': ur}, ['c8', 'c9'], params.list_recur_meningitis],
-                   'c11': [0, am, {'am': am}, ['t5', 'ri5', 'rf5', 'rfc5'], params.list_recur_type_after_sympt_primary]
+                   'c1': [0, 0, {}, ['c3', 'c6', 'c7'], params.nor_am_ur_after_primary_prob_sample, {}],
+                   'c2': [0, 0, {}, ['cn5', 'cr5'], params.list_recur_type_after_asympt_primary, {}],
+                   'c3': [0, 0, {}, ['c4', 'c5'], params.list_diagnose, {}],
+                   'c4': [0, p_untreat, {'primary': p_untreat}, ['cn1', 'cr1'], params.list_recur_type_after_sympt_primary],
+                   'c5': [0, p_treat, {'primary': p_treat}, ['cn2', 'cr2'], params.list_recur_type_after_sympt_primary],
+                   'c6': [0, p_treat, {'primary': p_treat}, ['c8'], [1]],
+                   'c7': [0, p_treat, {'primary': p_treat}, ['c9'], [1]],
+                   'c8': [0, am, {'am': am}, ['cn3', 'cr3'], params.list_recur_type_after_sympt_primary],
+                   'c9': [0, ur, {'ur': ur}, ['cn4', 'cr4'], params.list_recur_type_after_sympt_primary]
                    }
 
-    # define recurrent objects
+    # terminal nodes only depend on recurrent periods
+    dictTerminals, rate_of_recur = cache.get_terminals(
+        parameters=params, tree_name='HSV-1', age_of_infection=age_of_infection, sex=sex, discount=discount,
+        build=partial(get_hsv1_terminals, params=params, age_of_infection=age_of_infection, sex=sex,
+                      discount=discount, cache=cache))
+
+    # cost, utility, component_utility_dic, future_node
+    dictDecisions = {'d1': [0, 0, {}, ['c0']]}
+
+    return dictDecisions, dictChances, dictTerminals, rate_of_recur
+
+
+def get_hsv2_terminals(params, age_of_infection, sex, discount, cache):
+    """ :return: terminal nodes of the HSV-2 probabilistic tree and the rates of infrequent, frequent and
+    frequent (with CST) recurrences
+    :param cache: (RecurrentPeriodCache) cache of recurrent periods shared across terminal nodes
+    """
+    # define recurrent objects, terminal nodes with the same type of recurrences share the same object
     # after undiagnosed symptomatic primary HSV
     t1, ri1, rf1, rfc1 = initiate_recur_object_helper_type_two(params=params, rm=False, sex=sex, discount=discount,
-                                                               age_of_infection=age_of_infection)
+                                                               age_of_infection=age_of_infection, cache=cache)
     # after diagnosed symptomatic primary HSV
     t2, ri2, rf2, rfc2 = initiate_recur_object_helper_type_two(params=params, rm=False, sex=sex, discount=discount,
-                                                               age_of_infection=age_of_infection)
+                                                               age_of_infection=age_of_infection, cache=cache)
     # after symptomatic primary HSV (with aseptic meningitis) + no recurrent meningitis
     t3, ri3, rf3, rfc3 = initiate_recur_object_helper_type_two(params=params, rm=False, sex=sex, discount=discount,
-                                                               age_of_infection=age_of_infection)
+                                                               age_of_infection=age_of_infection, cache=cache)
     # after symptomatic primary HSV (with aseptic meningitis) + recurrent meningitis
     t4, ri4, rf4, rfc4 = initiate_recur_object_helper_type_two(params=params, rm=True, sex=sex, discount=discount,
-                                                               age_of_infection=age_of_infection)
+                                                               age_of_infection=age_of_infection, cache=cache)
     # after symptomatic primary HSV (with urinary retention)
     t5, ri5, rf5, rfc5 = initiate_recur_object_helper_type_two(params=params, rm=False, sex=sex, discount=discount,
-                                                               age_of_infection=age_of_infection)
+                                                               age_of_infection=age_of_infection, cache=cache)
     # after asymptomatic primary HSV
-    ri6 = RecurrentPeriodTypeTwo(parameters=params, recur_type='infrequent', age_of_infection=age_of_infection,
-                                 sex=sex, discount=discount)
+    ri6 = cache.get_recur_period_type_two(parameters=params, recur_type='infrequent', age_of_infection=age_of_infection,
+                                          sex=sex, discount=discount)
 
     dictTerminals = \
         {'t1': [0, t1.total_loss_hsv2, {}],  # no sympt recur -> no psycho loss
@@ -149,15 +157,53 @@ def buildHSV2Tree(params, age_of_infection, sex, discount):
          'ri6': [0, ri6.total_loss_hsv2, {'infreq': ri6.recur_only_qaly, 'ur': ri6.ur_qaly, 'psych': ri6.psych_qaly}]
          }
 
-    dictDecisions = {'d1': [0, 0, {}, ['c0']]}
-
     infreq_recur = ri1.rate_of_recurrence
     freq_no_cst_recur = rf1.rate_of_recurrence
     freq_cst_recur = rfc1.rate_of_recurrence
 
+    return dictTerminals, infreq_recur, freq_no_cst_recur, freq_cst_recur
+
+
+@profiled('build_tree')
+def buildHSV2Tree(params, age_of_infection, sex, discount, cache=None):
+    """ construct a probabilistic tree for HSV-2 infection
+    :param cache: (RecurrentPeriodCache) cache of recurrent periods, None to use recur_period_cache
+    """
+    if cache is None:
+        cache = recur_period_cache
+    # disutility values during primary infection
+    p_untreat = params.primary_sympt_undia_notreat_qaly
+    p_treat = params.primary_sympt_diag_treat_qaly
+    ur = params.ur_qaly
+    am = params.am_qaly
+
+    # cost, disutility, [future nodes], probabilities
+    dictChances = {'c0': [0, 0, {}, ['c1', 'c2'], params.list_primary_type],
+                   'c1': [0, 0, {}, ['c3', 'c4', 'c5'], params.nor_am_ur_after_primary_prob_sample],
+                   'c2': [0, 0, {}, ['t6', 'ri6'], params.list_recur_type_after_asympt_primary],
+                   'c3': [0, 0, {}, ['c6', 'c7'], params.list_diagnose],
+                   'c4': [0, p_treat, {'primary': p_treat}, ['c10'], [1]],
+                   'c5': [0, p_treat, {'primary': p_treat}, ['c11'], [1]],
+                   'c6': [0, p_untreat, {'primary': p_untreat}, ['t1', 'ri1', 'rf1', 'rfc1'], params.list_recur_type_after_sympt_primary],
+                   'c7': [0, p_treat, {'primary': p_treat}, ['t2', 'ri2', 'rf2', 'rfc2'], params.list_recur_type_after_sympt_primary],
+                   'c8': [0, 0, {}, ['t3', 'ri3', 'rf3', 'rfc3'], params.list_recur_type_after_sympt_primary],
+                   'c9': [0, 0, {}, ['t4', 'ri4', 'rf4', 'rfc4'], params.list_recur_type_after_sympt_primary],
+                   'c10': [0, ur, {'ur': ur}, ['c8', 'c9'], params.list_recur_meningitis],
+                   'c11': [0, am, {'am': am}, ['t5', 'ri5', 'rf5', 'rfc5'], params.list_recur_type_after_sympt_primary]
+                   }
+
+    # terminal nodes only depend on recurrent periods
+    dictTerminals, infreq_recur, freq_no_cst_recur, freq_cst_recur = cache.get_terminals(
+        parameters=params, tree_name='HSV-2', age_of_infection=age_of_infection, sex=sex, discount=discount,
+        build=partial(get_hsv2_terminals, params=params, age_of_infection=age_of_infection, sex=sex,
+                      discount=discount, cache=cache))
+
+    dictDecisions = {'d1': [0, 0, {}, ['c0']]}
+
     return dictDecisions, dictChances, dictTerminals, infreq_recur, freq_no_cst_recur, freq_cst_recur
 
 
+@profiled('build_tree')
 def buildNeonatalTree(params):
     """ construct a structure for neonatal HSV
     :param params: (object) input parameters
@@ -1,6 +1,147 @@
-from supports.DemographicValuesSupport import get_conditional_survival_rate, get_adjusted_disu
+from supports.DemographicValuesSupport import get_conditional_survival_rates, get_adjusted_disu
 from supports.ParameterAndRecurrentPeriodSupport import get_recur_initiate_rate_helper
+from supports.ProfilingSupport import profiler
 import math
+import numpy as np
+
+
+def _sequential_sum(values, axis=-1):
+    """ sum along axis in the same order as a python loop (keeps totals identical to the year-by-year loop) """
+    if values.shape[axis] == 0:
+        return np.zeros(np.delete(values.shape, axis))
+    return np.take(np.cumsum(values, axis=axis), -1, axis=axis)
+
+
+def get_sympt_recur_losses(parameters, age_of_infection, sex, discount, recur_rates, annual_reduction_rate):
+    """
+    calculate QALY loss due to symptomatic recurrences for several recurrence types at once, the rate of
+    recurrences decreases in a linear fashion over time. survival rates, adjusted disutilities and discounting
+    factors are computed once on a shared year grid.
+    :param parameters: the object stored all attribute parameters for a specific cohort
+    :param age_of_infection: age of HSV infection (the first year of recurrences is the year of primary infection)
+    :param sex: 'male' or 'female'
+    :param discount: discounting rate
+    :param recur_rates: list of (first-year recurrence rate, second-year recurrence rate), one per recurrence type
+    :param annual_reduction_rate: annual reduction in the rate of recurrence
+    :return: list of dictionaries (one per recurrence type) with keys 'rate_of_recurrence', 'sympt_recur_qaly',
+             'recur_only_qaly', 'ur_qaly' and 'psych_qaly'
+    """
+    return get_sympt_recur_losses_by_discount(parameters=parameters, age_of_infection=age_of_infection, sex=sex,
+                                              discount_list=[discount], recur_rates=recur_rates,
+                                              annual_reduction_rate=annual_reduction_rate)[0]
+
+
+def get_sympt_recur_losses_by_discount(parameters, age_of_infection, sex, discount_list, recur_rates,
+                                       annual_reduction_rate):
+    """
+    get_sympt_recur_losses for several discounting rates at once, only the discounting is repeated for each rate
+    :param discount_list: list of discounting rates
+    :return: list (one per discounting rate) of the lists returned by get_sympt_recur_losses
+    """
+    first_year_rates = np.array([rates[0] for rates in recur_rates], dtype=float)
+    second_year_rates = np.array([rates[1] for rates in recur_rates], dtype=float)
+
+    # number of years with sympt recurrences (first year is year_0)
+    num_years_with_recur = [int(math.ceil(rates[1] / annual_reduction_rate)) for rates in recur_rates]
+    # no year is evaluated when the second-year rate is not positive
+    num_years_used = np.array([max(num_years, 0) for num_years in num_years_with_recur])
+    num_years_grid = int(num_years_used.max(initial=0))
+
+    # shared year grid: years after primary infection (same as the exponent number for discounting)
+    years = np.arange(num_years_grid)
+    ages = age_of_infection + years
+    sur_rates = get_conditional_survival_rates(younger_ages=age_of_infection, older_ages=ages, sex=sex)
+    sur_rates = np.where(years == 0, 1, sur_rates)
+    # python pow keeps the discounting factors identical to the year-by-year loop, shape (# of rates, 1, # of years)
+    discount_factors = np.array([[(1 + discount) ** year for year in years.tolist()] for discount in discount_list],
+                                dtype=float).reshape(len(discount_list), 1, num_years_grid)
+
+    # adjusted disutility at each age with symptomatic recurrences
+    psycho_disu_a = parameters.diagnosis_disu_sample
+    # one-time reduction
+    psycho_disu_b = psycho_disu_a - parameters.diagnosis_disu_reduction_sample
+    recur_adjusted_disu = get_adjusted_disu(current_age=ages, disu=parameters.recur_sympt_treated_disu_sample)
+    ur_adjusted_disu = get_adjusted_disu(current_age=ages, disu=parameters.urinary_retention_disu_sample)
+    psycho_adjusted_disu = get_adjusted_disu(current_age=ages, disu=np.where(years == 0, psycho_disu_a, psycho_disu_b))
+
+    # recurrence rates, shape (# of types, # of years)
+    recur_rate_matrix = second_year_rates[:, None] - (years[None, :] - 1) * annual_reduction_rate
+    recur_rate_matrix[:, :1] = first_year_rates[:, None]
+    recur_rate_matrix[:, 1:2] = second_year_rates[:, None]
+    in_recur_period = years[None, :] < num_years_used[:, None]
+
+    # QALYs lost at each year = s * d * (# of recur * QALYs_recur + # of recur * prob_ur * QALYs_ur + psycho)
+    recur_qaly = recur_rate_matrix * recur_adjusted_disu * parameters.recur_treat_duration_sample
+    ur_prob = parameters.urinary_retention_recur_prob_sample
+    ur_qaly = recur_rate_matrix * ur_prob * ur_adjusted_disu * parameters.urinary_retention_duration_sample
+    psycho_qaly = np.broadcast_to(psycho_adjusted_disu * 1, recur_qaly.shape)
+    annual_qaly = sur_rates * (recur_qaly + ur_qaly + psycho_qaly) / discount_factors
+
+    sympt_recur_qaly = _sequential_sum(np.where(in_recur_period, annual_qaly, 0))
+    recur_only_qaly = _sequential_sum(np.where(in_recur_period, sur_rates * recur_qaly / discount_factors, 0))
+    ur_only_qaly = _sequential_sum(np.where(in_recur_period, sur_rates * ur_qaly / discount_factors, 0))
+    psych_qaly = _sequential_sum(np.where(in_recur_period, sur_rates * psycho_qaly / discount_factors, 0))
+
+    rate_of_recurrence_list = []
+    for idx, (first_year_rate, second_year_rate) in enumerate(recur_rates):
+        # recurrences rate
+        rate_of_recurrence = [first_year_rate, second_year_rate]
+        for i in range(1, num_years_with_recur[idx] - 1):
+            rate_of_recurrence.append(second_year_rate - i * annual_reduction_rate)
+        rate_of_recurrence_list.append(rate_of_recurrence)
+
+    sympt_recur_losses_by_discount = []
+    for k in range(len(discount_list)):
+        sympt_recur_losses_by_discount.append(
+            [{'rate_of_recurrence': list(rate_of_recurrence),
+              'sympt_recur_qaly': sympt_recur_qaly[k, idx],
+              'recur_only_qaly': recur_only_qaly[k, idx],
+              'ur_qaly': ur_only_qaly[k, idx],
+              'psych_qaly': psych_qaly[k, idx]} for idx, rate_of_recurrence in enumerate(rate_of_recurrence_list)])
+    return sympt_recur_losses_by_discount
+
+
+def get_recur_meningitis_loss(parameters, age_of_infection, sex, discount):
+    """
+    calculate QALYs lost due to recurrent meningitis, which is independent of the presence of HSV relapses
+    :param parameters: the object stored all attribute parameters for a specific cohort
+    :param age_of_infection: age of HSV infection
+    :param sex: 'male' or 'female'
+    :param discount: discounting rate
+    :return: total QALYs lost due to recurrent meningitis
+    """
+    return get_recur_meningitis_loss_by_discount(parameters=parameters, age_of_infection=age_of_infection, sex=sex,
+                                                 discount_list=[discount])[0]
+
+
+def get_recur_meningitis_loss_by_discount(parameters, age_of_infection, sex, discount_list):
+    """
+    get_recur_meningitis_loss for several discounting rates at once, only the discounting is repeated for each rate
+    :param discount_list: list of discounting rates
+    :return: list of total QALYs lost due to recurrent meningitis, one per discounting rate
+    """
+    # (avg.) total number of years that people experience meningitis relapses
+    total_year_with_meningitis = parameters.total_year_with_meningitis_sample
+    # (avg.) total number of meningitis people will experience
+    total_num_meningitis = round(parameters.total_num_recur_meningitis_sample)
+    # duration of each recurrent meningitis
+    rm_duration = parameters.recur_meningitis_duration_sample
+    # unadjusted disutility for each recurrent meningitis
+    rm_unadjusted_disu = parameters.recur_meningitis_disu_sample
+    # assuming the intermittent time between two relapses are the same
+    cal_1 = total_year_with_meningitis / total_num_meningitis  # (constant) time to the next recurrent meningitis
+
+    # (float) exact age having each recurrent meningitis, accumulated as in a year-by-year loop
+    cal_2 = np.cumsum([age_of_infection] + [cal_1] * total_num_meningitis)
+    # (int) rounded ages used for survival rate and discounting calculation
+    cal_2_round = np.rint(cal_2).astype(int)
+    sur_rates = get_conditional_survival_rates(younger_ages=cal_2_round[:-1], older_ages=cal_2_round[1:], sex=sex)
+    rm_adjusted_disu = get_adjusted_disu(current_age=cal_2_round[1:], disu=rm_unadjusted_disu)
+    discount_factors = np.array([[(1 + discount) ** (age - age_of_infection) for age in cal_2_round[1:].tolist()]
+                                 for discount in discount_list], dtype=float).reshape(len(discount_list), -1)
+    # QALYs lost = s(t) * d(t) * disutility * duration
+    per_rm_qaly_loss = sur_rates * rm_adjusted_disu * rm_duration / discount_factors
+    return _sequential_sum(per_rm_qaly_loss).tolist()
 
 
 class RecurrentPeriod:
@@ -31,74 +172,26 @@ class RecurrentPeriod:
         :param second_year_recur_rate: rate of symptomatic recurrences in the second year in recur period
         :param annual_reduction_rate: annual reduction in the rate of recurrence
         """
-        ##################################################
-        # Calendar 1: # of years after primary infection #
-        ##################################################
-        # cal_1 related events: current recurrence rate; utility discounting
-        # initiate calender 1, first- and second- year recurrence rate
-        cal_1 = 0  # initiate calender 1 (same as the exponent number for discounting equation)
-
-        # number of years with sympt recurrences (first year is year_0)
-        num_years_with_recur = int(math.ceil(second_year_recur_rate / annual_reduction_rate))
+        sympt_recur_loss = get_sympt_recur_losses(parameters=self.params, age_of_infection=self.age_of_infection,
+                                                  sex=self.sex, discount=self.discount,
+                                                  recur_rates=[(first_year_recur_rate, second_year_recur_rate)],
+                                                  annual_reduction_rate=annual_reduction_rate)[0]
+        self._set_sympt_recur_loss(sympt_recur_loss=sympt_recur_loss)
 
-        # recurrences rate
-        self.rate_of_recurrence = [first_year_recur_rate, second_year_recur_rate]
-        for i in range(1, num_years_with_recur - 1):
-            self.rate_of_recurrence.append(second_year_recur_rate - i * annual_reduction_rate)
-
-        # the last year with sympt recurrences
-        cal_1_end = num_years_with_recur - 1
-
-        ###################################
-        # Calendar 2: age in current year #
-        ###################################
-        # cal_2 related events: survive rate; adjusted for background utility
-        cal_2 = self.age_of_infection  # age of primary infection (same year having first-year sympt recur)
-        # the age when the person does not experience sympt recurrences = cal_2 + num_year_with_recur
-        # for each iteration during the interval with symptomatic recurrences
-        psycho_disu_a = self.params.diagnosis_disu_sample
-        # one-time reduction
-        psycho_disu_b = psycho_disu_a - self.params.diagnosis_disu_reduction_sample
-        for i in range(cal_1, cal_1_end + 1):
-            # surviving rate & recurrence rate
-            if cal_1 == 0:
-                sur_rate = 1
-                psycho_disu = psycho_disu_a
-            else:
-                sur_rate = get_conditional_survival_rate(younger_age=self.age_of_infection,
-                                                         older_age=cal_2,
-                                                         sex=self.sex)
-                psycho_disu = psycho_disu_b
-
-            # recurrent rate
-            recur_rate = self.rate_of_recurrence[cal_1]
-
-            # discounting
-            discount_index = cal_1
-
-            # adjusted disutility
-            recur_adjusted_disu = get_adjusted_disu(current_age=cal_2, disu=self.params.recur_sympt_treated_disu_sample)
-            ur_adjusted_disu = get_adjusted_disu(current_age=cal_2, disu=self.params.urinary_retention_disu_sample)
-            psycho_adjusted_disu = get_adjusted_disu(current_age=cal_2, disu=psycho_disu)
-
-            # total QALYs lost at age cal_2 = s * d * (# of recur * QALYs_recur + # of recur * prob_ur * QALYs_ur)
-            recur_qaly = recur_rate * recur_adjusted_disu * self.params.recur_treat_duration_sample
-            ur_prob = self.params.urinary_retention_recur_prob_sample
-            ur_qaly = recur_rate * ur_prob * ur_adjusted_disu * self.params.urinary_retention_duration_sample
-            psycho_qaly = psycho_adjusted_disu * 1
-            annual_qaly = sur_rate * (recur_qaly + ur_qaly + psycho_qaly) / (1 + self.discount) ** discount_index
-
-            # update calendar times
-            cal_1 += 1
-            cal_2 += 1
-            self.sympt_recur_qaly += annual_qaly    # total QALYs lost
-            self.recur_only_qaly += sur_rate * recur_qaly / (1 + self.discount) ** discount_index
-            self.ur_qaly += sur_rate * ur_qaly / (1 + self.discount) ** discount_index
-            self.psych_qaly += sur_rate * psycho_qaly / (1 + self.discount) ** discount_index
+    def _set_sympt_recur_loss(self, sympt_recur_loss):
+        """ :param sympt_recur_loss: (dict) one of the dictionaries returned by get_sympt_recur_losses """
+        self.rate_of_recurrence = sympt_recur_loss['rate_of_recurrence']
+        self.sympt_recur_qaly += sympt_recur_loss['sympt_recur_qaly']
+        self.recur_only_qaly += sympt_recur_loss['recur_only_qaly']
+        self.ur_qaly += sympt_recur_loss['ur_qaly']
+        self.psych_qaly += sympt_recur_loss['psych_qaly']
 
 
 class RecurrentPeriodTypeOne(RecurrentPeriod):
-    def __init__(self, parameters, recur_type, age_of_infection, sex, discount=0.03):
+    def __init__(self, parameters, recur_type, age_of_infection, sex, discount=0.03, sympt_recur_loss=None):
+        """
+        :param sympt_recur_loss: (dict) precomputed loss from get_sympt_recur_losses, None to calculate it here
+        """
         super().__init__(parameters=parameters, recur_type=recur_type, age_of_infection=age_of_infection,
                          sex=sex, discount=discount)
         if self.recur_type == 'frequent':
@@ -110,16 +203,19 @@ class RecurrentPeriodTypeOne(RecurrentPeriod):
         # calculate total QALYs loss
         if self.recur_type == 'infrequent':
             # self._add_qaly_loss_of_psychosocial_impact()   # only people with sympt recur have long psychosocial loss
-            self._add_qaly_loss_of_sympt_recur()
+            self._add_qaly_loss_of_sympt_recur(sympt_recur_loss=sympt_recur_loss)
         # if ence:
         #     self._add_qaly_loss_of_ence()
 
-    def _add_qaly_loss_of_sympt_recur(self):
-        first_year_rate = self.params.infreq_first_year_recur_rate_sample  # recur rate in year 0 (after primary hsv)
-        second_year_rate = self.params.infreq_second_year_recur_rate_sample  # recur rate in year 1
-        annual_reduction_rate = self.params.avg_yearly_recur_reduction_sample
-        self._get_sympt_recur_loss(first_year_recur_rate=first_year_rate, second_year_recur_rate=second_year_rate,
-                                   annual_reduction_rate=annual_reduction_rate)
+    def _add_qaly_loss_of_sympt_recur(self, sympt_recur_loss=None):
+        if sympt_recur_loss is None:
+            first_year_rate = self.params.infreq_first_year_recur_rate_sample  # recur rate in year 0 (after primary)
+            second_year_rate = self.params.infreq_second_year_recur_rate_sample  # recur rate in year 1
+            annual_reduction_rate = self.params.avg_yearly_recur_reduction_sample
+            self._get_sympt_recur_loss(first_year_recur_rate=first_year_rate, second_year_recur_rate=second_year_rate,
+                                       annual_reduction_rate=annual_reduction_rate)
+        else:
+            self._set_sympt_recur_loss(sympt_recur_loss=sympt_recur_loss)
         # sum up to total QALYs loss
         self.total_loss_hsv1 += self.sympt_recur_qaly
 
@@ -177,7 +273,8 @@ class RecurrentPeriodTypeOne(RecurrentPeriod):
 
 
 class RecurrentPeriodTypeTwo(RecurrentPeriod):
-    def __init__(self, parameters, recur_type, age_of_infection, sex, rm=False, discount=0.03, cst=False):
+    def __init__(self, parameters, recur_type, age_of_infection, sex, rm=False, discount=0.03, cst=False,
+                 sympt_recur_loss=None, rm_qaly=None):
         """
         :param parameters: (object) parameters
         :param recur_type: (string) 'no', 'infrequent', 'frequent'
@@ -186,6 +283,8 @@ class RecurrentPeriodTypeTwo(RecurrentPeriod):
         :param rm: (bool) whether have recurrent meningitis
         :param discount: (float) discounting rate
         :param cst: (bool) whether receive CST, only useful when recur_type is 'frequent'
+        :param sympt_recur_loss: (dict) precomputed loss from get_sympt_recur_losses, None to calculate it here
+        :param rm_qaly: (float) precomputed loss from get_recur_meningitis_loss, None to calculate it here
         """
         super().__init__(parameters=parameters, recur_type=recur_type, age_of_infection=age_of_infection,
                          sex=sex, discount=discount)
@@ -196,50 +295,231 @@ class RecurrentPeriodTypeTwo(RecurrentPeriod):
 
         # calculate total QALYs loss
         if recur_type in ['infrequent', 'frequent']:
-            self._add_qaly_loss_of_sympt_recur()
+            self._add_qaly_loss_of_sympt_recur(sympt_recur_loss=sympt_recur_loss)
         # people with no symptomatic recurrences can also experience recurrent meningitis
         if rm:
-            self._add_qaly_loss_of_recur_meningitis()
-
-    def _add_qaly_loss_of_sympt_recur(self):
-        first_year_rate, second_year_rate = get_recur_initiate_rate_helper(recur_type=self.recur_type,
-                                                                           parameter=self.params,
-                                                                           long_term_therapy=self.long_term_therapy)
-        annual_reduction_rate = self.params.avg_yearly_recur_reduction_sample
-        self._get_sympt_recur_loss(first_year_recur_rate=first_year_rate, second_year_recur_rate=second_year_rate,
-                                   annual_reduction_rate=annual_reduction_rate)
+            self._add_qaly_loss_of_recur_meningitis(rm_qaly=rm_qaly)
+
+    def _add_qaly_loss_of_sympt_recur(self, sympt_recur_loss=None):
+        if sympt_recur_loss is None:
+            first_year_rate, second_year_rate = get_recur_initiate_rate_helper(recur_type=self.recur_type,
+                                                                               parameter=self.params,
+                                                                               long_term_therapy=self.long_term_therapy)
+            annual_reduction_rate = self.params.avg_yearly_recur_reduction_sample
+            self._get_sympt_recur_loss(first_year_recur_rate=first_year_rate, second_year_recur_rate=second_year_rate,
+                                       annual_reduction_rate=annual_reduction_rate)
+        else:
+            self._set_sympt_recur_loss(sympt_recur_loss=sympt_recur_loss)
         # sum up to total QALYs loss
         self.total_loss_hsv2 += self.sympt_recur_qaly
 
     def _get_recur_meningitis_loss(self):
         """ calculate QALYs lost due to recurrent meningitis, which is independent of the presence of HSV relapses """
-        # (avg.) total number of years that people experience meningitis relapses
-        total_year_with_meningitis = self.params.total_year_with_meningitis_sample
-        # (avg.) total number of meningitis people will experience
-        total_num_meningitis = round(self.params.total_num_recur_meningitis_sample)
-        # duration of each recurrent meningitis
-        rm_duration = self.params.recur_meningitis_duration_sample
-        # unadjusted disutility for each recurrent meningitis
-        rm_unadjusted_disu = self.params.recur_meningitis_disu_sample
-        # assuming the intermittent time between two relapses are the same
-        # initiate calendar time
-        cal_1 = total_year_with_meningitis / total_num_meningitis  # (constant) time to the next recurrent meningitis
-        cal_2 = self.age_of_infection  # age when having a meningitis
-
-        # calculate QALYs lost for each iteration
-        for iterate in range(0, total_num_meningitis):
-            cal_2_prev_round = round(cal_2)  # (int) rounded age used for survival rate calculation
-            cal_2 += cal_1  # (float) exact age having one recurrent meningitis
-            cal_2_round = round(cal_2)  # (int) rounded age used for survival rate and discounting calculation
-            sur_rate = get_conditional_survival_rate(younger_age=cal_2_prev_round, older_age=cal_2_round,
-                                                     sex=self.sex)
-            rm_adjusted_disu = get_adjusted_disu(current_age=cal_2_round, disu=rm_unadjusted_disu)
-            # QALYs lost = s(t) * d(t) * disutility * duration
-            per_rm_qaly_loss = sur_rate * rm_adjusted_disu * rm_duration / (1 + self.discount) ** (
-                        cal_2_round - self.age_of_infection)
-            self.rm_qaly += per_rm_qaly_loss
-
-    def _add_qaly_loss_of_recur_meningitis(self):
-        self._get_recur_meningitis_loss()
+        self.rm_qaly += get_recur_meningitis_loss(parameters=self.params, age_of_infection=self.age_of_infection,
+                                                  sex=self.sex, discount=self.discount)
+
+    def _add_qaly_loss_of_recur_meningitis(self, rm_qaly=None):
+        if rm_qaly is None:
+            self._get_recur_meningitis_loss()
+        else:
+            self.rm_qaly += rm_qaly
         # sum up to total QALYs loss
         self.total_loss_hsv2 += self.rm_qaly
+
+
+class RecurrentPeriodCache:
+    # parameter samples used by recurrent periods, overriding other samples (see Parameters.override_samples)
+    # does not change the recurrent periods of a parameter sample
+    sample_names = {'avg_yearly_recur_reduction_sample', 'diagnosis_disu_sample', 'diagnosis_disu_reduction_sample',
+                    'infreq_first_year_recur_rate_sample', 'infreq_second_year_recur_rate_sample',
+                    'freq_nocst_first_year_recur_rate_sample', 'freq_cst_first_year_recur_rate_sample',
+                    'recur_meningitis_disu_sample', 'recur_meningitis_duration_sample',
+                    'recur_sympt_treated_disu_sample', 'recur_treat_duration_sample',
+                    'total_num_recur_meningitis_sample', 'total_year_with_meningitis_sample',
+                    'urinary_retention_disu_sample', 'urinary_retention_duration_sample',
+                    'urinary_retention_recur_prob_sample'}
+
+    def __init__(self, discount_list=None):
+        """ recurrent periods memoized by (recur_type, cst, rm, age, sex, discount, parameter sample key), so that
+        terminal nodes with identical payoffs share one object. the sample key is the parameter sample id and the
+        overridden values of sample_names, so that scenarios overriding other parameters share recurrent periods.
+        for HSV-2, losses of infrequent, frequent and frequent + CST recurrences are calculated in one pass and the
+        loss of recurrent meningitis once.
+        losses of all discounting rates of discount_list are calculated in the same pass as the requested rate.
+        entries of previous parameter samples are dropped when a new sample is seen.
+        :param discount_list: list of discounting rates to be requested for every parameter sample
+        """
+        self.num_hits = 0               # number of requests served from the cache
+        self.num_misses = 0             # number of recurrent periods calculated
+        self.discount_list = [] if discount_list is None else list(discount_list)
+        self._sample_id = None          # parameter sample id of cached entries
+        self._sample_key = (None, None, None)   # (sample id, override id, sample key) of the last overridden sample
+        self._dic_recur_periods = {}    # key: (class name, recur_type, cst, rm, age, sex, discount, sample key)
+        self._dic_sympt_recur_losses = {}   # key: (age, sex, discount, sample key), value: {(recur_type, cst): loss}
+        self._dic_rm_qaly = {}              # key: (age, sex, discount, sample key), value: loss of recur meningitis
+        self._dic_terminals = {}        # key: (tree name, None, False, False, age, sex, discount, sample key)
+
+    def get_recur_period_type_one(self, parameters, recur_type, age_of_infection, sex, discount=0.03):
+        """
+        :param parameters: (ParametersTypeOne) parameters of the current sample
+        :param recur_type: (string) 'no', 'infrequent'
+        :param age_of_infection: (int) age of infection
+        :param sex: (string) 'male' or 'female'
+        :param discount: (float) discounting rate
+        :return: (RecurrentPeriodTypeOne) the recurrent period, shared by all calls with the same arguments
+        """
+        key = self._get_key(parameters=parameters, period_type='RecurrentPeriodTypeOne', recur_type=recur_type,
+                            cst=False, rm=False, age_of_infection=age_of_infection, sex=sex, discount=discount)
+        if key in self._dic_recur_periods:
+            self.num_hits += 1
+        else:
+            self.num_misses += 1
+            with profiler.stage('recurrent_period'):
+                sympt_recur_loss = None
+                if recur_type == 'infrequent':
+                    sympt_recur_loss = self._get_sympt_recur_losses(
+                        parameters=parameters, age_of_infection=age_of_infection, sex=sex, discount=discount,
+                        get_losses=self._get_type_one_sympt_recur_losses)[('infrequent', False)]
+                self._dic_recur_periods[key] = RecurrentPeriodTypeOne(
+                    parameters=parameters, recur_type=recur_type, age_of_infection=age_of_infection, sex=sex,
+                    discount=discount, sympt_recur_loss=sympt_recur_loss)
+        return self._dic_recur_periods[key]
+
+    def get_recur_period_type_two(self, parameters, recur_type, age_of_infection, sex, discount=0.03,
+                                  cst=False, rm=False):
+        """
+        :param parameters: (ParametersTypeTwo) parameters of the current sample
+        :param recur_type: (string) 'no', 'infrequent', 'frequent'
+        :param age_of_infection: (int) age of infection
+        :param sex: (string) 'male' or 'female'
+        :param discount: (float) discounting rate
+        :param cst: (bool) whether receive CST, only useful when recur_type is 'frequent'
+        :param rm: (bool) whether have recurrent meningitis
+        :return: (RecurrentPeriodTypeTwo) the recurrent period, shared by all calls with the same arguments
+        """
+        cst = cst and recur_type == 'frequent'
+        key = self._get_key(parameters=parameters, period_type='RecurrentPeriodTypeTwo', recur_type=recur_type,
+                            cst=cst, rm=rm, age_of_infection=age_of_infection, sex=sex, discount=discount)
+        if key in self._dic_recur_periods:
+            self.num_hits += 1
+        else:
+            self.num_misses += 1
+            with profiler.stage('recurrent_period'):
+                sympt_recur_loss = None
+                if recur_type in ['infrequent', 'frequent']:
+                    sympt_recur_loss = self._get_sympt_recur_losses(
+                        parameters=parameters, age_of_infection=age_of_infection, sex=sex, discount=discount,
+                        get_losses=self._get_type_two_sympt_recur_losses)[(recur_type, cst)]
+                rm_qaly = None
+                if rm:
+                    group_key = (age_of_infection, sex, discount, key[-1])
+                    if group_key not in self._dic_rm_qaly:
+                        discount_list = self._get_discount_list(discount=discount)
+                        rm_qaly_list = get_recur_meningitis_loss_by_discount(
+                            parameters=parameters, age_of_infection=age_of_infection, sex=sex,
+                            discount_list=discount_list)
+                        for rate, loss in zip(discount_list, rm_qaly_list):
+                            self._dic_rm_qaly[(age_of_infection, sex, rate, key[-1])] = loss
+                    rm_qaly = self._dic_rm_qaly[group_key]
+                self._dic_recur_periods[key] = RecurrentPeriodTypeTwo(
+                    parameters=parameters, recur_type=recur_type, age_of_infection=age_of_infection, sex=sex,
+                    rm=rm, discount=discount, cst=cst, sympt_recur_loss=sympt_recur_loss, rm_qaly=rm_qaly)
+        return self._dic_recur_periods[key]
+
+    def get_terminals(self, parameters, tree_name, age_of_infection, sex, discount, build):
+        """ terminal nodes of a tree only depend on recurrent periods, so trees of scenarios that do not override
+        the samples of sample_names share the terminal nodes of the same age, sex and discounting rate
+        :param parameters: parameters of the current sample
+        :param tree_name: (string) name of the tree, e.g. 'HSV-1'
+        :param age_of_infection: (int) age of infection
+        :param sex: (string) 'male' or 'female'
+        :param discount: (float) discounting rate
+        :param build: function that returns the terminal nodes (and outputs derived from recurrent periods),
+                      called at the first request
+        :return: the output of build, shared by all calls with the same arguments
+        """
+        key = self._get_key(parameters=parameters, period_type=tree_name, recur_type=None, cst=False, rm=False,
+                            age_of_infection=age_of_infection, sex=sex, discount=discount)
+        if key not in self._dic_terminals:
+            self._dic_terminals[key] = build()
+        return self._dic_terminals[key]
+
+    def get_hit_miss_counts(self):
+        """ :returns a dictionary with the number of cache hits, misses and the hit rate """
+        num_requests = self.num_hits + self.num_misses
+        return {'hits': self.num_hits,
+                'misses': self.num_misses,
+                'hit_rate': self.num_hits / num_requests if num_requests > 0 else 0}
+
+    def clear(self):
+        """ drop all cached recurrent periods and reset the hit/miss counts """
+        self.num_hits = 0
+        self.num_misses = 0
+        self._sample_id = None
+        self._sample_key = (None, None, None)
+        self._dic_recur_periods = {}
+        self._dic_sympt_recur_losses = {}
+        self._dic_rm_qaly = {}
+        self._dic_terminals = {}
+
+    def _get_key(self, parameters, period_type, recur_type, cst, rm, age_of_infection, sex, discount):
+        # recurrent periods of previous parameter samples can not be requested again
+        if parameters.sample_id != self._sample_id:
+            self._sample_id = parameters.sample_id
+            self._dic_recur_periods = {}
+            self._dic_sympt_recur_losses = {}
+            self._dic_rm_qaly = {}
+            self._dic_terminals = {}
+        return period_type, recur_type, cst, rm, age_of_infection, sex, discount, self._get_sample_key(parameters)
+
+    def _get_sample_key(self, parameters):
+        """ :returns the parameter sample id and the overridden values of the samples used by recurrent periods """
+        if not parameters.dic_overrides:
+            return parameters.sample_id, ()
+        if self._sample_key[:2] != (parameters.sample_id, parameters.override_id):
+            self._sample_key = (parameters.sample_id, parameters.override_id,
+                                (parameters.sample_id, tuple(sorted(
+                                    (name, value) for name, value in parameters.dic_overrides.items()
+                                    if name in self.sample_names))))
+        return self._sample_key[2]
+
+    def _get_discount_list(self, discount):
+        """ :returns the discounting rates to calculate together with the requested one (requested rate first) """
+        return [discount] + [rate for rate in self.discount_list if rate != discount]
+
+    def _get_sympt_recur_losses(self, parameters, age_of_infection, sex, discount, get_losses):
+        """ :returns a dictionary of losses due to symptomatic recurrences, key: (recur_type, cst), calculated
+        by get_losses for all discounting rates of discount_list at the first request """
+        sample_key = self._get_sample_key(parameters=parameters)
+        group_key = (age_of_infection, sex, discount, sample_key)
+        if group_key not in self._dic_sympt_recur_losses:
+            discount_list = self._get_discount_list(discount=discount)
+            losses_by_discount = get_losses(parameters=parameters, age_of_infection=age_of_infection, sex=sex,
+                                            discount_list=discount_list)
+            for rate, losses in zip(discount_list, losses_by_discount):
+                self._dic_sympt_recur_losses[(age_of_infection, sex, rate, sample_key)] = losses
+        return self._dic_sympt_recur_losses[group_key]
+
+    @staticmethod
+    def _get_type_one_sympt_recur_losses(parameters, age_of_infection, sex, discount_list):
+        """ :returns a list (one per discounting rate) of dictionaries of losses due to symptomatic recurrences,
+        key: (recur_type, cst) """
+        keys = [('infrequent', False)]
+        recur_rates = [(parameters.infreq_first_year_recur_rate_sample,
+                        parameters.infreq_second_year_recur_rate_sample)]
+        sympt_recur_losses_by_discount = get_sympt_recur_losses_by_discount(
+            parameters=parameters, age_of_infection=age_of_infection, sex=sex, discount_list=discount_list,
+            recur_rates=recur_rates, annual_reduction_rate=parameters.avg_yearly_recur_reduction_sample)
+        return [dict(zip(keys, sympt_recur_losses)) for sympt_recur_losses in sympt_recur_losses_by_discount]
+
+    @staticmethod
+    def _get_type_two_sympt_recur_losses(parameters, age_of_infection, sex, discount_list):
+        """ :returns a list (one per discounting rate) of dictionaries of losses due to symptomatic recurrences,
+        key: (recur_type, cst) """
+        keys = [('infrequent', False), ('frequent', False), ('frequent', True)]
+        recur_rates = [get_recur_initiate_rate_helper(recur_type=recur_type, parameter=parameters,
+                                                      long_term_therapy=cst) for recur_type, cst in keys]
+        sympt_recur_losses_by_discount = get_sympt_recur_losses_by_discount(
+            parameters=parameters, age_of_infection=age_of_infection, sex=sex, discount_list=discount_list,
+            recur_rates=recur_rates, annual_reduction_rate=parameters.avg_yearly_recur_reduction_sample)
+        return [dict(zip(keys, sympt_recur_losses)) for sympt_recur_losses in sympt_recur_losses_by_discount]
@@ -1,5 +1,7 @@
 import re
+import numpy as np
 import pandas as pd
+from supports.ProfilingSupport import profiled
 
 
 ####################
@@ -58,39 +60,52 @@ def get_clean_life_table(path=None, df_filename=None):
 ###########################
 # data source: EQ-5D background disutility estimation
 # https://www.ncbi.nlm.nih.gov/pmc/articles/PMC2634296/
+# (lower bound of age group, background utility)
+bg_utility_age_groups = [(0, 1), (18, 0.922), (30, 0.901), (40, 0.871), (50, 0.842),
+                         (60, 0.823), (70, 0.790), (80, 0.736)]
+
+
+def _get_bg_utility_by_age_array(age_groups):
+    """ :returns (numpy array) background utility indexed by integer age, ages >= the last lower bound share the
+    last element """
+    bg_u_array = np.ones(age_groups[-1][0] + 1)
+    for lower_age, bg_u in age_groups:
+        bg_u_array[lower_age:] = bg_u
+    bg_u_array.setflags(write=False)
+    return bg_u_array
+
+
+bg_utility_by_age = _get_bg_utility_by_age_array(age_groups=bg_utility_age_groups)
+_bg_utility_by_age_list = bg_utility_by_age.tolist()   # faster than numpy indexing for scalar ages
+_max_age_idx = len(_bg_utility_by_age_list) - 1
+
+
 def get_bg_utility(age):
-    """ get background utility value based on age """
-    bg_u = None  # initial background utility
-    if age < 18:
-        bg_u = 1
-    if 18 <= age < 30:
-        bg_u = 0.922
-    elif 30 <= age < 40:
-        bg_u = 0.901
-    elif 40 <= age < 50:
-        bg_u = 0.871
-    elif 50 <= age < 60:
-        bg_u = 0.842
-    elif 60 <= age < 70:
-        bg_u = 0.823
-    elif 70 <= age < 80:
-        bg_u = 0.790
-    elif age >= 80:
-        bg_u = 0.736
-    return bg_u
+    """ get background utility value based on age
+    :param age: (float or numpy array) age
+    :return: (float or numpy array) background utility
+    """
+    if isinstance(age, (np.ndarray, list, tuple)):
+        age_idx = np.clip(np.floor(age), 0, _max_age_idx).astype(int)
+        return bg_utility_by_age[age_idx]
+    # scalar age
+    if age >= _max_age_idx:
+        return _bg_utility_by_age_list[_max_age_idx]
+    if age < 0:
+        return _bg_utility_by_age_list[0]
+    return _bg_utility_by_age_list[int(age)]
 
 
 def get_adjusted_disu(current_age, disu, out='disu'):
     """ get adjusted disutility based on disease disutility and background disutility due to aging
-    :param current_age: current age of people
-    :param disu: represents disutility of disease
+    :param current_age: (float or numpy array) current age of people
+    :param disu: (float or numpy array) represents disutility of disease
     :param out: 'disu': we want to get adjusted disutility; 'utl': we want to get adjusted utility
     """
     bg_u = get_bg_utility(age=current_age)
     adjusted_disu = bg_u * disu
-    adjusted_utl = bg_u - adjusted_disu
     if out == 'utl':
-        return adjusted_utl
+        return bg_u - adjusted_disu
     else:
         return adjusted_disu
 
@@ -108,22 +123,106 @@ df_life_table = get_clean_life_table(
     path='source/data/US_lifetable2015_CDC.csv')
 
 
-def get_conditional_survival_rate(younger_age, older_age, sex=None):
-    younger_age = round(younger_age)
-    older_age = round(older_age)
-    if sex == 'female':
-        df = df_life_table_female
-    elif sex == 'male':
-        df = df_life_table_male
-    elif sex is None:
-        df = df_life_table
-    else:
+def get_lx_array(df):
+    """ convert the number surviving to age x into an integer array indexed by age
+    :param df: cleaned life table (see get_clean_life_table)
+    :return: (numpy array) lx, where lx[age] is the number of people surviving to age
+    """
+    ages = df['Start age'].astype(int).to_numpy()
+    lx = np.zeros(ages.max() + 1, dtype=np.int64)
+    lx[ages] = [convert_to_int(num_string=num_string) for num_string in df['Number surviving to age x']]
+    return lx
+
+
+def get_survival_ratio_matrix(lx):
+    """ precompute conditional survival rates between every pair of ages
+    :param lx: (numpy array) number surviving to age x, indexed by age
+    :return: (numpy array) matrix where [younger_age, older_age] = lx[older_age] / lx[younger_age], rounded to 4 digits
+    """
+    # python round() is kept (instead of np.round) so that values match the scalar calculation exactly
+    ratio_list = [[round(num_alive_old / num_alive_young, 4) for num_alive_old in lx.tolist()]
+                  for num_alive_young in lx.tolist()]
+    matrix = np.asarray(ratio_list, dtype=float)
+    matrix.setflags(write=False)
+    return matrix
+
+
+# number surviving to age x (index = age) and conditional survival rates for each sex, None = general population
+dic_lx = {'male': get_lx_array(df=df_life_table_male),
+          'female': get_lx_array(df=df_life_table_female),
+          None: get_lx_array(df=df_life_table)}
+dic_survival_ratio = {sex: get_survival_ratio_matrix(lx=lx) for sex, lx in dic_lx.items()}
+
+
+def _get_survival_ratio_matrix_by_sex(sex):
+    if sex not in dic_survival_ratio:
         raise ValueError('wrong sex type')
-    # calculate conditional surviving rate at age_old giving people being alive at age_young
-    num_alive_young = get_number_surviving(df=df, age=younger_age)
-    num_alive_old = get_number_surviving(df=df, age=older_age)
-    conditional_prob = num_alive_old / num_alive_young
-    return round(conditional_prob, 4)
+    return dic_survival_ratio[sex]
+
+
+def get_conditional_survival_rate(younger_age, older_age, sex=None):
+    """ conditional survival rate at older_age given being alive at younger_age (ages are rounded to integers)
+    :param younger_age: (float) younger age
+    :param older_age: (float) older age
+    :param sex: 'female', 'male', or None (general population)
+    :return: (float) survival rate rounded to 4 digits
+    """
+    matrix = _get_survival_ratio_matrix_by_sex(sex=sex)
+    return float(matrix[round(younger_age), round(older_age)])
+
+
+@profiled('life_table')
+def get_conditional_survival_rates(younger_ages, older_ages, sex=None):
+    """ vectorized version of get_conditional_survival_rate
+    :param younger_ages: (float or numpy array) younger ages
+    :param older_ages: (float or numpy array) older ages, broadcast against younger_ages
+    :param sex: 'female', 'male', or None (general population)
+    :return: (numpy array) survival rates rounded to 4 digits
+    """
+    matrix = _get_survival_ratio_matrix_by_sex(sex=sex)
+    # np.rint rounds half to even, the same as python round()
+    younger_idx = np.rint(younger_ages).astype(int)
+    older_idx = np.rint(older_ages).astype(int)
+    return matrix[younger_idx, older_idx]
+
+
+##########################
+#  life table for QALYs  #
+##########################
+class QalyLifeTable:
+    def __init__(self, path):
+        """ life table used for long-term QALYs loss, parsed once and stored as read-only column arrays
+        :param path: path to the csv file with columns x, nax, nbx, nqx and bg_utl
+        """
+        df = pd.read_csv(path)
+        self.x = self._to_read_only_array(df['x'], dtype=np.int64)              # age at the start of interval
+        self.nax = self._to_read_only_array(df['nax'], dtype=float)             # years lived by people who die
+        self.nbx = self._to_read_only_array(df['nbx'], dtype=float)             # years lived by people who survive
+        self.nqx = self._to_read_only_array(df['nqx'], dtype=float)             # mortality within the interval
+        self.bg_utl = self._to_read_only_array(df['bg_utl'], dtype=float)       # background utility
+
+    @staticmethod
+    def _to_read_only_array(column, dtype):
+        array = column.to_numpy(dtype=dtype, copy=True)
+        array.setflags(write=False)
+        return array
+
+    def to_data_frame(self):
+        """ :returns a new DataFrame (safe to modify) with columns x, nax, nbx, nqx and bg_utl """
+        return pd.DataFrame({'x': self.x, 'nax': self.nax, 'nbx': self.nbx, 'nqx': self.nqx, 'bg_utl': self.bg_utl})
+
+
+# read life tables for QALYs calculation once, key: 'female', 'male', or 'general'
+dic_qaly_life_tables = {'female': QalyLifeTable(path='source/data/life_table_for_qaly_female.csv'),
+                        'male': QalyLifeTable(path='source/data/life_table_for_qaly_male.csv'),
+                        'general': QalyLifeTable(path='source/data/life_table_for_qaly.csv')}
+
+
+def get_qaly_life_table(sex):
+    """ :returns the (QalyLifeTable) life table for 'female', 'male', or 'general' """
+    if sex not in dic_qaly_life_tables:
+        raise ValueError('wrong type of sex input')
+    return dic_qaly_life_tables[sex]
 
 
 # the target group aged between 18-49
@@ -149,7 +248,7 @@ def create_new_life_table_for_QALE(df, seq_disu, discount=0.03, excess_mort=None
         current_alive = current_alive * (1 - float(df_new['death_rate'][ind]))
     df_new['alive'] = new_col
     # background utility weights based on age
-    df_new['bg_utl'] = df_new.apply(lambda row: get_bg_utility(age=row['age']), axis=1)
+    df_new['bg_utl'] = get_bg_utility(age=df_new['age'].to_numpy(dtype=float))
     # adjusted utility (= bg_utl - bg adjusted seq_disu)
     df_new['adj_utl'] = df_new.apply(lambda row: row['bg_utl'] * (1 - seq_disu), axis=1)
     # utility-weights without discounting
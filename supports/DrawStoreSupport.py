@@ -0,0 +1,81 @@
+import os
+import numpy as np
+from SimPy.Statistics import SummaryStat
+from supports.RunProbTreeSupport import get_psa_outcomes
+from supports.ProfilingSupport import profiled
+
+
+@profiled('write_outputs')
+def write_draw_store(store_dir, dic_arrays):
+    """ save raw PSA draws to a folder with one .npy file per column (to be memory-mapped by DrawStore)
+    :param store_dir: folder of the store
+    :param dic_arrays: dictionary of column name and array
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    for name, array in dic_arrays.items():
+        np.save(os.path.join(store_dir, '{}.npy'.format(name)), np.asarray(array))
+
+
+class DrawStore:
+    def __init__(self, store_dir):
+        """ memory-mapped raw PSA draws saved by write_draw_store
+        :param store_dir: folder of the store
+        """
+        self.storeDir = store_dir
+        self.columns = {}   # memory-mapped array of each column
+        for file_name in sorted(os.listdir(store_dir)):
+            if file_name.endswith('.npy'):
+                self.columns[file_name[:-4]] = np.load(os.path.join(store_dir, file_name), mmap_mode='r')
+
+    def __getitem__(self, name):
+        """ :return: array of a column, or of a derived outcome (see get_outcome) """
+        if name in self.columns:
+            return self.columns[name]
+        return self.get_outcome(name)
+
+    def get_outcome(self, name):
+        """ calculate an outcome from the columns (to be overridden in derived classes) """
+        raise KeyError(name)
+
+    def get_formatted_mean_and_interval(self, name, deci):
+        """ :return: (string) mean and 95% percentile interval of the draws of an outcome """
+        stat = SummaryStat(name=name, data=np.asarray(self[name]))
+        return stat.get_formatted_mean_and_interval(deci=deci, interval_type='p')
+
+
+class HSVDrawStore(DrawStore):
+    """ raw draws of an HSV-1 or HSV-2 run, with columns:
+    'qaly_per_case' and 'incidence' (draw x sex x age), 'components' (draw x sex x age x component),
+    'sexes', 'ages' and 'component_names'.
+    The outcomes summarized in DicHSV*.pkl are available under the same keys, as draws instead of strings. """
+
+    def get_outcome(self, name):
+        outcomes = get_psa_outcomes(utility=self.columns['qaly_per_case'], incidence=self.columns['incidence'],
+                                    sex_list=self.columns['sexes'].tolist())
+        if name == 'age_sex_specific_qaly':
+            # list of draws of each age and sex subgroup, ordered by sex then age
+            return list(outcomes['qaly_per_case'].reshape(len(outcomes['qaly_per_case']), -1).T)
+        elif name == 'non_age_sex_qaly_avg':
+            return outcomes['non_age_sex_qaly']
+        elif name == 't_qaly_m_avg':
+            return outcomes['t_qaly_m']
+        elif name == 't_qaly_f_avg':
+            return outcomes['t_qaly_f']
+        elif name == 't_qaly_hsv_avg':
+            return outcomes['t_qaly_hsv']
+        raise KeyError(name)
+
+
+class NeonatalDrawStore(DrawStore):
+    """ raw draws of a neonatal run, with columns 'incidence', 'loss_per_infection' (neonatal+maternal) and
+    'm_loss_per_infection' (maternal).
+    The outcomes summarized in neonatalGH_*.pkl are available under the same keys, as draws instead of strings. """
+
+    def get_outcome(self, name):
+        if name == 'num_case':
+            return self.columns['incidence']
+        elif name == 'loss_total':
+            return self.columns['incidence'] * self.columns['loss_per_infection']
+        elif name == 'm_loss_total':
+            return self.columns['incidence'] * self.columns['m_loss_per_infection']
+        raise KeyError(name)
@@ -0,0 +1,65 @@
+from functools import partial
+import numpy as np
+from supports.RandomValueGenerators import RandomValueGenerator
+from supports.RunProbTreeSupport import run_psa_in_parallel, get_mean_and_interval
+
+
+def get_override_values(overrides, iteration):
+    """ values of the parameter samples overridden in a PSA iteration of a one-way sensitivity analysis scenario
+    :param overrides: dictionary of parameter sample name (attribute of the parameter object, e.g.
+                      'diagnosis_disu_sample') and a fixed value or a RandomValueGenerator to sample the value from
+    :param iteration: index of PSA iteration
+    :return: dictionary of parameter sample name and value
+    """
+    # sampled from a stream separate from the other parameters of the iteration (seeded by the iteration alone),
+    # so that the values of all other parameters are the same as in the base case
+    rng = np.random.RandomState(seed=[iteration, 1])
+    return {name: value.sample(rng=rng) if isinstance(value, RandomValueGenerator) else value
+            for name, value in overrides.items()}
+
+
+def run_one_way_sensitivity(simulate, get_outcome_draws, scenarios, base_discount, num_psa,
+                            num_workers=1, chunk_size=None):
+    """ run the base case and one-way sensitivity analysis scenarios in one PSA pass, on the same parameter samples
+    of each PSA iteration (work that does not depend on the overridden parameters is shared by the scenarios)
+    :param simulate: (picklable function) simulate(seeds, scenarios=) returns the list of results of PSA
+                     iterations, evaluated for each scenario of scenarios, a list of (dictionary of overrides or None,
+                     list of discounting rates)
+    :param get_outcome_draws: function(psa_results, k) returns a dictionary of outcome name and array of draws
+                              (one per PSA iteration) for the k-th pair of scenario and discounting rate
+    :param scenarios: list of dictionaries with key 'name', and optional keys 'discount' (discounting rate) and
+                      'overrides' (dictionary of parameter samples to override, see get_override_values and
+                      ScenarioRegistry)
+    :param base_discount: discounting rate of the base case and of scenarios without 'discount'
+    :param num_psa: number of PSA iterations
+    :param num_workers: number of worker processes (see run_psa_in_parallel)
+    :param chunk_size: number of PSA iterations per worker task (see run_psa_in_parallel)
+    :return: list of rows of the results table, dictionaries with keys 'scenario' ('base' for the base case),
+             'outcome', 'mean', 'lower' and 'upper' (95% percentile interval)
+    """
+    scenarios = [{'name': 'base'}] + list(scenarios)
+    # scenarios with the same overrides (None = base case) are evaluated on the same trees: [overrides, rates]
+    overrides_and_discounts = []
+    for scenario in scenarios:
+        overrides, discount = scenario.get('overrides'), scenario.get('discount', base_discount)
+        group = next((group for group in overrides_and_discounts if group[0] == overrides), None)
+        if group is None:
+            group = [overrides, []]
+            overrides_and_discounts.append(group)
+        if discount not in group[1]:
+            group[1].append(discount)
+    # pairs of overrides and discounting rate in the order of evaluation
+    evaluations = [(overrides, discount) for overrides, discount_list in overrides_and_discounts
+                   for discount in discount_list]
+
+    psa_results = run_psa_in_parallel(simulate=partial(simulate, scenarios=overrides_and_discounts),
+                                      num_psa=num_psa, num_workers=num_workers, chunk_size=chunk_size)
+    rows = []
+    for scenario in scenarios:
+        k = next(k for k, (overrides, discount) in enumerate(evaluations)
+                 if overrides == scenario.get('overrides') and discount == scenario.get('discount', base_discount))
+        for outcome, outcome_draws in get_outcome_draws(psa_results, k).items():
+            mean, interval = get_mean_and_interval(draws=outcome_draws)
+            rows.append({'scenario': scenario['name'], 'outcome': outcome, 'mean': float(mean),
+                         'lower': float(interval[0]), 'upper': float(interval[1])})
+    return rows
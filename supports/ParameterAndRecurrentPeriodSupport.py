@@ -1,5 +1,6 @@
-from supports.DemographicValuesSupport import get_adjusted_disu
-import pandas as pd
+import numpy as np
+from supports.DemographicValuesSupport import get_adjusted_disu, get_qaly_life_table
+from supports.ProfilingSupport import profiled
 
 
 def get_recur_initiate_rate_helper(recur_type, parameter, long_term_therapy):
@@ -30,18 +31,13 @@ def get_long_term_qaly_loss(start_age, length_of_condition, disease_disu, year_i
     :param year_idx: number of years after primary HSV infection. in the same year of primary infection, year_idx = 0
     :param discount: discounting rate
     """
-    idx = 0  # the number of years after start_age
-    qaly_list = []  # list of QALY loss from start age to end age
-    for age in range(start_age, round(length_of_condition) + start_age):
-        # adjust disutility based on age in the current year
-        current_year_adj_disu = get_adjusted_disu(current_age=age, disu=disease_disu)
-        # calculate QALYs lost in the current year (discounting)
-        current_year_qaly = current_year_adj_disu * disease_dura / (1 + discount)**(year_idx + idx)
-        # attach QALYs lost into the list
-        qaly_list.append(current_year_qaly)
-        idx += 1
+    idx = np.arange(round(length_of_condition))  # the number of years after start_age
+    # adjust disutility based on age in each year
+    adj_disu = get_adjusted_disu(current_age=start_age + idx, disu=disease_disu)
+    # calculate QALYs lost in each year (discounting)
+    qaly_array = adj_disu * disease_dura / (1 + discount) ** (year_idx + idx)
     # return total QALY loss due to this long-term condition
-    return sum(qaly_list)
+    return float(np.sum(qaly_array))
 
 
 def separate_cst_helper(np_array, cst_prob):
@@ -76,125 +72,215 @@ def life_table_get_long_term_loss(sex, age_onset, seq_disu, discount, seq_dura=0
     :param tmort: (float) total mortality (= nqx + ad_nqx)
     :param if_utility: (bool) whether we calculate QALYs loss (using utility=false) or total QALYs (using utility=True)
     """
-    if sex == 'female':
-        df = pd.read_csv('source/data/life_table_for_qaly_female.csv')
-    elif sex == 'male':
-        df = pd.read_csv('source/data/life_table_for_qaly_male.csv')
-    elif sex == 'general':
-        df = pd.read_csv('source/data/life_table_for_qaly.csv')
-    else:
-        raise ValueError('wrong type of sex input')
+    loss = life_table_get_long_term_loss_batch(sex=sex, age_onset=age_onset, seq_disu=seq_disu, discount=discount,
+                                               seq_dura=seq_dura, acute_sympt_disu=acute_sympt_disu, emort=emort,
+                                               emort_dura=emort_dura, tmort=tmort, if_utility=if_utility)
+    return float(loss[0])
+
+
+def life_table_get_long_term_loss_batch(sex, age_onset, seq_disu, discount, seq_dura=0,
+                                        acute_sympt_disu=0, emort=0, emort_dura=None, tmort=0, if_utility=False):
+    """ batch version of life_table_get_long_term_loss, evaluating many draws/outcomes at once.
+    age_onset, seq_disu, seq_dura, acute_sympt_disu, emort and tmort can be floats or 1-D arrays
+    (broadcast against each other); each row of the (draw x age) computation is one set of values.
+    :returns (numpy array) QALYs loss (or total QALYs if if_utility=True) of each draw
+    """
+    return life_table_get_long_term_loss_by_discount_batch(
+        sex=sex, age_onset=age_onset, seq_disu=seq_disu, discount_list=[discount], seq_dura=seq_dura,
+        acute_sympt_disu=acute_sympt_disu, emort=emort, emort_dura=emort_dura, tmort=tmort, if_utility=if_utility)[0]
+
+
+@profiled('life_table')
+def life_table_get_long_term_loss_by_discount_batch(sex, age_onset, seq_disu, discount_list, seq_dura=0,
+                                                    acute_sympt_disu=0, emort=0, emort_dura=None, tmort=0,
+                                                    if_utility=False):
+    """ life_table_get_long_term_loss_batch for several discounting rates at once, survival and (background)
+    utilities are calculated once and only the discounting of life years is repeated for each rate
+    :param discount_list: list of discounting rates
+    :returns (numpy array) (rate x draw) QALYs loss (or total QALYs if if_utility=True)
+    """
+    life_table = get_qaly_life_table(sex=sex)
+    # one row per draw, one column per age interval of the life table
+    age_onset, seq_disu, seq_dura, acute_sympt_disu, emort, tmort = \
+        [np.reshape(a, (-1, 1)) for a in np.broadcast_arrays(*np.atleast_1d(age_onset, seq_disu, seq_dura,
+                                                                              acute_sympt_disu, emort, tmort))]
     # round age onset
-    age_onset = round(age_onset)
-    # excess mortality during disease sequelae period
-    age_list = df['x']
-    ad_nqx_list = []
-    nqx_list = df['nqx']
-    for pair in zip(age_list, nqx_list):
-        if emort_dura is not None:
-            if age_onset <= pair[0] < (age_onset + emort_dura):
-                if emort > 0:
-                    ad_nqx_list.append(emort)
-                elif tmort > 0:
-                    ad_nqx_list.append(max(tmort - pair[1], 0))
-                else:
-                    raise ValueError('emort_dura should be NoneType')
-            else:
-                ad_nqx_list.append(0)
+    age_onset = np.rint(age_onset).astype(int)
+    # % alive (nlx) and avg. life years lived within each interval (nLx), without discounting
+    after_onset, is_onset, nLx_ud = _get_life_years_after_onset(life_table=life_table, age_onset=age_onset,
+                                                                emort=emort, emort_dura=emort_dura, tmort=tmort)
+    # disutility & utility (acute symptoms only happen in the interval of onset)
+    seq_disu_array = seq_disu + np.where(is_onset, acute_sympt_disu, 0)
+    seq_utl_array = 1 - seq_disu_array
+    losses = []
+    for discount in discount_list:
+        # discounted life years people live within each interval
+        nLx_d = _discount_life_years(nLx_ud=nLx_ud, discount=discount)
+        # life years lived with sequelae within each interval
+        nlx_d_with_sequelae = _get_life_years_with_sequelae(nLx_d=nLx_d, after_onset=after_onset, seq_dura=seq_dura)
+        # calculate QALYs loss with sequelae
+        if if_utility:
+            losses.append(np.sum(nlx_d_with_sequelae * life_table.bg_utl * seq_utl_array, axis=1))
         else:
-            if pair[0] >= age_onset:
-                if emort > 0:
-                    ad_nqx_list.append(emort)
-                elif tmort > 0:
-                    ad_nqx_list.append(max(tmort - pair[1], 0))
-                else:
-                    ad_nqx_list.append(0)
-            else:
-                ad_nqx_list.append(0)
-    df['ad_nqx'] = ad_nqx_list
+            losses.append(np.sum(nlx_d_with_sequelae * life_table.bg_utl * seq_disu_array, axis=1))
+    return np.array(losses).reshape(len(discount_list), len(age_onset))
+
+
+def life_table_get_cumulative_loss_batch(sex, age_onset, seq_disu, discount,
+                                         acute_sympt_disu=0, emort=0, emort_dura=None, tmort=0, if_utility=False):
+    """ cumulative QALYs loss (or total QALYs if if_utility=True) by number of years since onset, from which the
+    loss of any duration of sequelae is read off by get_loss_within_duration without recalculating the life table.
+    Inputs are the same as life_table_get_long_term_loss_batch, except seq_dura.
+    :returns (cumulative_loss, annual_loss): (draw x (age+1)) array of QALYs loss within the first k years since
+             onset (column k, the last column is the lifetime loss), and (draw x age) array of QALYs loss per year
+             lived with sequelae in year k+1 since onset (column k, for the fraction of the last year of sequelae)
+    """
+    cumulative_loss, annual_loss = life_table_get_cumulative_loss_by_discount_batch(
+        sex=sex, age_onset=age_onset, seq_disu=seq_disu, discount_list=[discount], acute_sympt_disu=acute_sympt_disu,
+        emort=emort, emort_dura=emort_dura, tmort=tmort, if_utility=if_utility)
+    return cumulative_loss[0], annual_loss
+
+
+@profiled('life_table')
+def life_table_get_cumulative_loss_by_discount_batch(sex, age_onset, seq_disu, discount_list, acute_sympt_disu=0,
+                                                     emort=0, emort_dura=None, tmort=0, if_utility=False):
+    """ life_table_get_cumulative_loss_batch for several discounting rates at once, only the discounting of life
+    years is repeated for each rate
+    :param discount_list: list of discounting rates
+    :returns (cumulative_loss, annual_loss): (rate x draw x (age+1)) array of cumulative QALYs loss and
+             (draw x age) array of QALYs loss per year lived with sequelae (independent of discounting)
+    """
+    life_table = get_qaly_life_table(sex=sex)
+    age_onset, seq_disu, acute_sympt_disu, emort, tmort = \
+        [np.reshape(a, (-1, 1)) for a in np.broadcast_arrays(*np.atleast_1d(age_onset, seq_disu, acute_sympt_disu,
+                                                                              emort, tmort))]
+    age_onset = np.rint(age_onset).astype(int)
+    after_onset, is_onset, nLx_ud = _get_life_years_after_onset(life_table=life_table, age_onset=age_onset,
+                                                                emort=emort, emort_dura=emort_dura, tmort=tmort)
+    seq_disu_array = seq_disu + np.where(is_onset, acute_sympt_disu, 0)
+    if if_utility:
+        annual_loss = np.where(after_onset, life_table.bg_utl * (1 - seq_disu_array), 0)
+    else:
+        annual_loss = np.where(after_onset, life_table.bg_utl * seq_disu_array, 0)
+    # discounted life years lived within each interval, shape (rate x draw x age)
+    nLx_d = np.array([_discount_life_years(nLx_ud=nLx_ud, discount=discount) for discount in discount_list])
+    loss = np.where(after_onset, nLx_d, 0) * annual_loss
+
+    # shift each row so that column k is year k+1 since onset (intervals after the last one lose nothing)
+    num_ages = len(life_table.x)
+    cols = np.argmax(after_onset, axis=1)[:, np.newaxis] + np.arange(num_ages)
+    in_table = cols < num_ages
+    cols = np.minimum(cols, num_ages - 1)
+    loss = np.where(in_table, np.take_along_axis(loss, np.broadcast_to(cols, loss.shape), axis=-1), 0)
+    annual_loss = np.where(in_table, np.take_along_axis(annual_loss, cols, axis=1), 0)
+    cumulative_loss = np.concatenate((np.zeros(loss.shape[:-1] + (1,)), np.cumsum(loss, axis=-1)), axis=-1)
+    return cumulative_loss, annual_loss
+
+
+def get_loss_within_duration(cumulative_loss, annual_loss, seq_dura):
+    """ QALYs loss of sequelae lasting seq_dura years, read off life_table_get_cumulative_loss_batch
+    (the same as life_table_get_long_term_loss_batch with this seq_dura)
+    :param cumulative_loss: (draw x (age+1)) cumulative QALYs loss by years since onset
+    :param annual_loss: (draw x age) QALYs loss per year lived with sequelae by years since onset
+    :param seq_dura: (float or 1-D array, one per draw) duration of sequelae, 0 = lifetime
+    :returns (numpy array) QALYs loss of each draw
+    """
+    rows = np.arange(len(cumulative_loss))
+    seq_dura = np.broadcast_to(np.asarray(seq_dura, dtype=float), rows.shape)
+    num_ages = annual_loss.shape[1]
+    num_years = np.minimum(np.floor(seq_dura).astype(int), num_ages)    # number of whole years with sequelae
+    fraction = seq_dura - np.floor(seq_dura)                            # fraction of the last year with sequelae
+    loss = cumulative_loss[rows, num_years] + \
+        np.where(num_years < num_ages, fraction * annual_loss[rows, np.minimum(num_years, num_ages - 1)], 0)
+    return np.where(seq_dura > 0, loss, cumulative_loss[:, -1])
+
+
+def _get_life_years_after_onset(life_table, age_onset, emort, emort_dura, tmort):
+    """ :returns (after_onset, is_onset, nLx_ud), (draw x age) arrays of whether each interval starts after (or at)
+    the age of onset, whether it is the interval of onset, and undiscounted life years lived within the interval """
+    x = life_table.x
+    nqx = life_table.nqx
+    after_onset = x >= age_onset
+    is_onset = x == age_onset
+    # excess mortality during disease sequelae period
+    if emort_dura is not None:
+        emort_period = after_onset & (x < age_onset + emort_dura)
+        if np.any(emort_period & (emort <= 0) & (tmort <= 0)):
+            raise ValueError('emort_dura should be NoneType')
+    else:
+        emort_period = after_onset
+    ad_nqx = np.where(emort_period, np.where(emort > 0, emort, np.where(tmort > 0, np.maximum(tmort - nqx, 0), 0)), 0)
     # total mortality/survival rate within time period x and x+n
-    df['aggre_nqx'] = df.apply(lambda row: row['nqx'] + row['ad_nqx'], axis=1)  # mortality = npx + excess mortality
-    df['npx'] = df.apply(lambda row: 1-row['aggre_nqx'], axis=1)                # survival rate = 1 - mortality
+    aggre_nqx = nqx + ad_nqx    # mortality = npx + excess mortality
+    npx = 1 - aggre_nqx         # survival rate = 1 - mortality
     # calculate % alive starting at the age of onset
-    aggre_nqx_list = df['aggre_nqx']
-    nlx_list = []
-    seq_disu_list = []
-    prev_row = None
-    for pair in zip(age_list, aggre_nqx_list):
-        # age of sequelae onset
-        if pair[0] == age_onset:
-            nlx_list.append(1)
-            seq_disu_list.append(seq_disu + acute_sympt_disu)
-        # age after sequelae onset
-        elif pair[0] > age_onset:
-            nlx_list.append(nlx_list[-1] * (1 - prev_row[1]))
-            seq_disu_list.append(seq_disu)
-        # age before sequelae onset
-        else:
-            nlx_list.append(0)
-            seq_disu_list.append(seq_disu)
-        prev_row = pair
-    df['nlx'] = nlx_list
-    # disutility & utility
-    df['seq_disu'] = seq_disu_list
-    df['seq_utl'] = df.apply(lambda row: 1 - row['seq_disu'], axis=1)
+    # (nobody is alive before onset, or at all if age of onset is not the start of an interval)
+    survival_after_onset = np.cumprod(np.where(after_onset, npx, 1), axis=1)
+    nlx = np.concatenate((np.ones((len(npx), 1)), survival_after_onset[:, :-1]), axis=1)
+    nlx = np.where(after_onset & is_onset.any(axis=1, keepdims=True), nlx, 0)
     # avg. life years people live within each interval
-    df['nLx_ud'] = df.apply(lambda row: (row['nax']*row['aggre_nqx'] + row['nbx']*row['npx'])*row['nlx'], axis=1)
-    # cumulative life years lived at age x/x+n
-    nLx_ud_list = df['nLx_ud']
-    xn_T_ud_list = []
-    x_T_ud_list = []
-    ud_T_total = 0
-    for value_ud in nLx_ud_list:
-        x_T_ud_list.append(ud_T_total)
-        ud_T_total += value_ud
-        xn_T_ud_list.append(ud_T_total)
-    df['(x+n)T_ud'] = xn_T_ud_list
-    df['(x)T_ud'] = x_T_ud_list
-    # discounted life years people live within each interval = discounted_(x+n)T_ud - discounted_(x)T_ud
+    nLx_ud = (life_table.nax * aggre_nqx + life_table.nbx * npx) * nlx
+    return after_onset, is_onset, nLx_ud
+
+
+def _discount_life_years(nLx_ud, discount):
+    """ discounted life years people live within each interval = discounted_(x+n)T_ud - discounted_(x)T_ud """
     if discount == 0:
-        # df['nLx_d'] = df.apply(lambda row: row['nLx_ud'])
-        df['nLx_d'] = df['nLx_ud']
-    else:
-        df['nLx_d'] = df.apply(lambda row: ((1-(1-discount)**row['(x+n)T_ud'])/discount - (1-(1-discount)**row['(x)T_ud'])/discount), axis=1)
-    # life years lived with sequelae within each interval
-    if seq_dura > 0:
-        nLx_d_list = df['nLx_d']
-        nlx_d_with_sequelae_list = []
-        count_n_years = 0
-        for pair in zip(age_list, nLx_d_list):
-            if pair[0] >= age_onset:
-                count_n_years += 1
-                if count_n_years <= seq_dura:
-                    nlx_d_with_sequelae_list.append(pair[1])
-                else:
-                    diff = count_n_years - seq_dura
-                    nlx_d_with_sequelae_list.append(max(0, 1-diff))
-            else:
-                nlx_d_with_sequelae_list.append(0)
-        df['nlx_d_with_sequelae'] = nlx_d_with_sequelae_list
-    else:
-        df['nlx_d_with_sequelae'] = df['nLx_d']
-    # calculate QALYs loss with sequelae
-    df['nQALYx_loss'] = df.apply(lambda row: row['nlx_d_with_sequelae'] * row['bg_utl'] * row['seq_disu'], axis=1)
-    df['nQALYs'] = df.apply(lambda row: row['nlx_d_with_sequelae'] * row['bg_utl'] * row['seq_utl'], axis=1)
-    if if_utility:
-        return sum(df['nQALYs'])
-    else:
-        return sum(df['nQALYx_loss'])
+        return nLx_ud
+    # cumulative life years lived at age x+n/x
+    xn_T_ud = np.cumsum(nLx_ud, axis=-1)
+    x_T_ud = np.concatenate((np.zeros_like(xn_T_ud[..., :1]), xn_T_ud[..., :-1]), axis=-1)
+    return (1 - (1 - discount) ** xn_T_ud) / discount - (1 - (1 - discount) ** x_T_ud) / discount
+
+
+def _get_life_years_with_sequelae(nLx_d, after_onset, seq_dura):
+    """ life years lived with sequelae within each interval, seq_dura = 0 for lifetime sequelae """
+    count_n_years = np.cumsum(after_onset, axis=1)  # number of intervals since onset (1 at the interval of onset)
+    with_sequelae = np.where(
+        after_onset,
+        np.where(count_n_years <= seq_dura, nLx_d, np.maximum(0, 1 - (count_n_years - seq_dura))),
+        0)
+    return np.where(seq_dura > 0, with_sequelae, nLx_d)
 
 
 def life_table_get_long_term_loss_mixed_sex(age_onset, seq_disu, discount,
                                             seq_dura=0, emort=0, acute_sympt_disu=0, if_utility=False):
-    female_loss = life_table_get_long_term_loss(sex='female', age_onset=age_onset, acute_sympt_disu=acute_sympt_disu,
-                                                seq_disu=seq_disu, discount=discount, seq_dura=seq_dura,
-                                                emort=emort, if_utility=if_utility)
-    male_loss = life_table_get_long_term_loss(sex='male', age_onset=age_onset, acute_sympt_disu=acute_sympt_disu,
-                                              seq_disu=seq_disu, discount=discount, seq_dura=seq_dura,
-                                              emort=emort, if_utility=if_utility)
+    loss = life_table_get_long_term_loss_mixed_sex_batch(age_onset=age_onset, seq_disu=seq_disu, discount=discount,
+                                                         seq_dura=seq_dura, emort=emort,
+                                                         acute_sympt_disu=acute_sympt_disu, if_utility=if_utility)
+    return float(loss[0])
+
+
+def life_table_get_long_term_loss_mixed_sex_batch(age_onset, seq_disu, discount,
+                                                  seq_dura=0, emort=0, acute_sympt_disu=0, if_utility=False):
+    """ batch version of life_table_get_long_term_loss_mixed_sex (see life_table_get_long_term_loss_batch) """
+    female_loss = life_table_get_long_term_loss_batch(sex='female', age_onset=age_onset,
+                                                      acute_sympt_disu=acute_sympt_disu, seq_disu=seq_disu,
+                                                      discount=discount, seq_dura=seq_dura,
+                                                      emort=emort, if_utility=if_utility)
+    male_loss = life_table_get_long_term_loss_batch(sex='male', age_onset=age_onset,
+                                                    acute_sympt_disu=acute_sympt_disu, seq_disu=seq_disu,
+                                                    discount=discount, seq_dura=seq_dura,
+                                                    emort=emort, if_utility=if_utility)
     # sex ratio at birth
     male_ratio = 0.511480215
     female_ratio = 0.488519785
 
     return male_ratio * male_loss + female_ratio * female_loss
 
+
+def life_table_get_cumulative_loss_mixed_sex_batch(age_onset, seq_disu, discount,
+                                                   emort=0, acute_sympt_disu=0, if_utility=False):
+    """ mixed sex version of life_table_get_cumulative_loss_batch (see life_table_get_long_term_loss_mixed_sex) """
+    female_cumulative, female_annual = \
+        life_table_get_cumulative_loss_batch(sex='female', age_onset=age_onset, acute_sympt_disu=acute_sympt_disu,
+                                             seq_disu=seq_disu, discount=discount, emort=emort, if_utility=if_utility)
+    male_cumulative, male_annual = \
+        life_table_get_cumulative_loss_batch(sex='male', age_onset=age_onset, acute_sympt_disu=acute_sympt_disu,
+                                             seq_disu=seq_disu, discount=discount, emort=emort, if_utility=if_utility)
+    # sex ratio at birth
+    male_ratio = 0.511480215
+    female_ratio = 0.488519785
+
+    return male_ratio * male_cumulative + female_ratio * female_cumulative, \
+        male_ratio * male_annual + female_ratio * female_annual
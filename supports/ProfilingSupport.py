@@ -0,0 +1,155 @@
+import functools
+import json
+import os
+import time
+
+
+class StageProfiler:
+    def __init__(self):
+        """ wall-clock times and numbers of calls of the stages of a PSA run, and counters of events.
+        stages may be nested (the time of a stage includes the stages it calls). disabled by default, when
+        disabled stage() returns a shared no-op context manager and count() returns at once. """
+        self.enabled = False
+        self.dicTimes = {}      # total seconds of each stage
+        self.dicCalls = {}      # number of calls of each stage
+        self.dicCounts = {}     # value of each counter
+        self._startTime = None  # time the profiler was enabled
+
+    def enable(self):
+        """ reset all stages and counters and start timing """
+        self.reset()
+        self.enabled = True
+        self._startTime = time.perf_counter()
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.dicTimes = {}
+        self.dicCalls = {}
+        self.dicCounts = {}
+        self._startTime = time.perf_counter()
+
+    def stage(self, name):
+        """ :return: context manager adding the time of its block to the stage of this name """
+        if not self.enabled:
+            return _no_stage
+        return _Stage(profiler=self, name=name)
+
+    def add_time(self, name, seconds, num_calls=1):
+        self.dicTimes[name] = self.dicTimes.get(name, 0) + seconds
+        self.dicCalls[name] = self.dicCalls.get(name, 0) + num_calls
+
+    def count(self, name, num=1):
+        """ add num to the counter of this name """
+        if self.enabled:
+            self.dicCounts[name] = self.dicCounts.get(name, 0) + num
+
+    def get_state(self):
+        """ :return: times, calls and counters (e.g. to send from a worker process, see run_profiled) """
+        return {'times': self.dicTimes, 'calls': self.dicCalls, 'counts': self.dicCounts}
+
+    def merge(self, output_and_state):
+        """ add the times, calls and counters of a worker process to this profiler
+        :param output_and_state: (output, state) returned by run_profiled
+        :return: output
+        """
+        output, state = output_and_state
+        for name, seconds in state['times'].items():
+            self.add_time(name=name, seconds=seconds, num_calls=state['calls'][name])
+        for name, num in state['counts'].items():
+            self.dicCounts[name] = self.dicCounts.get(name, 0) + num
+        return output
+
+    def get_report(self):
+        """ :return: dictionary with the wall time since the profiler was enabled, the total seconds, number of
+        calls, milliseconds per call and share of the wall time of each stage (slowest first), and the counters.
+        stages run in worker processes are summed over processes, so their shares can add up to more than 1.
+        """
+        wall_time = time.perf_counter() - self._startTime
+        stages = {}
+        for name in sorted(self.dicTimes, key=self.dicTimes.get, reverse=True):
+            seconds = self.dicTimes[name]
+            stages[name] = {'seconds': seconds,
+                            'calls': self.dicCalls[name],
+                            'ms_per_call': 1000 * seconds / self.dicCalls[name],
+                            'share': seconds / wall_time if wall_time > 0 else 0}
+        return {'wall_time': wall_time, 'stages': stages, 'counters': dict(self.dicCounts)}
+
+    def print_report(self):
+        report = self.get_report()
+        print('run time: {:.2f} s'.format(report['wall_time']))
+        print('{:<24}{:>12}{:>10}{:>14}{:>8}'.format('stage', 'seconds', 'calls', 'ms per call', 'share'))
+        for name, stage in report['stages'].items():
+            print('{:<24}{:>12.3f}{:>10}{:>14.3f}{:>8.1%}'.format(
+                name, stage['seconds'], stage['calls'], stage['ms_per_call'], stage['share']))
+        for name, num in report['counters'].items():
+            print('{}: {}'.format(name, num))
+
+    def write_json(self, path):
+        """ save the report (see get_report) to a json file """
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(self.get_report(), file, indent=2)
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'startTime')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.startTime = None
+
+    def __enter__(self):
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add_time(name=self.name, seconds=time.perf_counter() - self.startTime)
+        return False
+
+
+class _NoStage:
+    """ context manager that does nothing (stages of a disabled profiler) """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_no_stage = _NoStage()
+
+# profiler shared by all modules of a run
+profiler = StageProfiler()
+
+
+def profiled(name):
+    """ decorator timing every call of a function as a stage of profiler (only a flag check when disabled) """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.add_time(name=name, seconds=time.perf_counter() - start_time)
+        return wrapper
+    return decorate
+
+
+def run_profiled(func, *args):
+    """ run func with the profiler enabled (e.g. in a worker process)
+    :return: output of func and the times, calls and counters of the run (to be added by StageProfiler.merge)
+    """
+    profiler.enable()
+    output = func(*args)
+    state = profiler.get_state()
+    profiler.disable()
+    return output, state
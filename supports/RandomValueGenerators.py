@@ -1,13 +1,43 @@
 import numpy as np
+from scipy import stats
+from scipy.stats import qmc
 import SimPy.RandomVariateGenerators as RVG
+from supports.ProfilingSupport import profiled
+
+SAMPLERS = ['random', 'lhs', 'sobol', 'antithetic']   # samplers of PSA parameter draws (see PSADraws)
+ADAPTIVE_SAMPLERS = ['random', 'sobol', 'antithetic']  # samplers whose first draws can be used by adaptive PSA
 
 
 class RandomValueGenerator:
     """ parent class """
+    draw_shape = ()     # shape of a sample (one uniform per value is mapped by the inverse cdf)
 
     def __init__(self, note):
         self.note = note  # explanation of the variable
 
+    def sample(self, rng, size=None):
+        """ draw a random sample
+        :param rng: numpy random state, or a DrawSource (e.g. draws of a PSA iteration sampled up front)
+        :param size: None for a single sample, otherwise (int or tuple) shape of the array of samples
+        """
+        if isinstance(rng, DrawSource):
+            return rng.get_next_draw(generator=self)
+        return self._sample(rng=rng, size=size)
+
+    def _sample(self, rng, size):
+        """ draw from the parameterized distribution (to be overridden in derived classes) """
+        raise NotImplementedError
+
+    def _inverse_cdf(self, u):
+        """ values of the parameterized distribution at quantiles u (to be overridden in derived classes)
+        :param u: array of uniforms in [0, 1), with draw_shape as its last axes
+        """
+        raise NotImplementedError
+
+    def get_mean(self):
+        """ analytical mean of the parameterized distribution (to be overridden in derived classes) """
+        raise NotImplementedError
+
 
 class BetaValueGenerator(RandomValueGenerator):
     """ variables follow beta distribution """
@@ -16,11 +46,18 @@ class BetaValueGenerator(RandomValueGenerator):
         super().__init__(note)
 
         fit_output = RVG.Beta.fit_mm(mean=mean, st_dev=stdv)
-        self.rvg = RVG.Beta(a=fit_output['a'], b=fit_output['b'])
+        self.a = fit_output['a']
+        self.b = fit_output['b']
 
-    def sample(self, rng):
+    def _sample(self, rng, size):
         """ draw a random sample from parameterized beta distribution """
-        return self.rvg.sample(rng)
+        return rng.beta(self.a, self.b, size=size)
+
+    def _inverse_cdf(self, u):
+        return stats.beta.ppf(u, self.a, self.b)
+
+    def get_mean(self):
+        return self.a / (self.a + self.b)
 
 
 class LogNormalValueGenerator(RandomValueGenerator):
@@ -33,16 +70,24 @@ class LogNormalValueGenerator(RandomValueGenerator):
         # fit_mm(mean, st_dev), mean and st_dev are attributes for the observed sample (i.e., x)
         if mean is not None:
             fit_output = RVG.LogNormal.fit_mm(mean=mean, st_dev=stdv)
-            self.rvg = RVG.LogNormal(mu=fit_output['mu'], sigma=fit_output['sigma'])
+            self.mu = fit_output['mu']
+            self.sigma = fit_output['sigma']
         # fit_output['mu'] and fit_output['sigma'] are mean and StDev for the underlying normal distribution (log(x))
         elif log_mean is not None:
-            self.rvg = RVG.LogNormal(mu=log_mean, sigma=log_std)
+            self.mu = log_mean
+            self.sigma = log_std
         else:
             raise ValueError('wrong input of mean and st dev for log-normal distribution')
 
-    def sample(self, rng):
+    def _sample(self, rng, size):
         """ draw a random sample from parameterized log-normal distribution """
-        return self.rvg.sample(rng)
+        return rng.lognormal(mean=self.mu, sigma=self.sigma, size=size)
+
+    def _inverse_cdf(self, u):
+        return np.exp(self.mu + self.sigma * stats.norm.ppf(u))
+
+    def get_mean(self):
+        return np.exp(self.mu + self.sigma ** 2 / 2)
 
 
 class GammaValueGenerator(RandomValueGenerator):
@@ -52,11 +97,18 @@ class GammaValueGenerator(RandomValueGenerator):
         super().__init__(note)
 
         fit_output = RVG.Gamma.fit_mm(mean=mean, st_dev=stdv)
-        self.rvg = RVG.Gamma(a=fit_output['a'], scale=fit_output['scale'])
+        self.a = fit_output['a']
+        self.scale = fit_output['scale']
 
-    def sample(self, rng):
+    def _sample(self, rng, size):
         """ draw a random sample from parameterized gamma distribution """
-        return self.rvg.sample(rng)
+        return rng.gamma(self.a, self.scale, size=size)
+
+    def _inverse_cdf(self, u):
+        return stats.gamma.ppf(u, self.a, scale=self.scale)
+
+    def get_mean(self):
+        return self.a * self.scale
 
 
 class DirichletValueGenerator(RandomValueGenerator):
@@ -71,8 +123,163 @@ class DirichletValueGenerator(RandomValueGenerator):
         for i in range(len(self.prob_list)):
             event_num = self.N * self.prob_list[i]
             self.events_num.append(event_num)
+        self.draw_shape = (len(self.prob_list), )
 
-    def sample(self, rng):
+    def _sample(self, rng, size):
         """ draw a random sample from parameterized dirichlet distribution """
         # return np.random.dirichlet(alpha=self.events_num)
-        return rng.dirichlet(alpha=self.events_num)
+        return rng.dirichlet(alpha=self.events_num, size=size)
+
+    def _inverse_cdf(self, u):
+        """ dirichlet values from gamma components (one uniform per event) normalized to sum to 1 """
+        components = stats.gamma.ppf(u, self.events_num)
+        return components / components.sum(axis=-1, keepdims=True)
+
+    def get_mean(self):
+        return np.asarray(self.events_num) / sum(self.events_num)
+
+
+def sample_uniforms(sampler, num_psa, num_dims, rng):
+    """ uniforms of a sampling plan of PSA iterations
+    :param sampler: 'lhs': Latin hypercube (each dimension stratified into num_psa intervals of equal probability),
+                    'sobol': scrambled Sobol sequence,
+                    'antithetic': pseudo-random pairs u, 1 - u in iterations 2k and 2k + 1
+    :param num_psa: number of PSA iterations
+    :param num_dims: number of dimensions (parameter values sampled per iteration)
+    :param rng: numpy random state (seeds the permutations or scrambling)
+    :return: (num_psa x num_dims) array of uniforms in [0, 1)
+    """
+    seed = rng.randint(2 ** 31 - 1)
+    if sampler == 'lhs':
+        return qmc.LatinHypercube(d=num_dims, seed=seed).random(n=num_psa)
+    elif sampler == 'sobol':
+        # the first num_psa points of the smallest balanced (power of 2) Sobol sample
+        return qmc.Sobol(d=num_dims, scramble=True, seed=seed).random_base2(
+            m=int(np.ceil(np.log2(num_psa))))[:num_psa]
+    elif sampler == 'antithetic':
+        if num_psa % 2 != 0:
+            raise ValueError('wrong number of PSA iterations for antithetic pairs: {}'.format(num_psa))
+        u = rng.random_sample(size=(num_psa // 2, num_dims))
+        return np.stack([u, 1 - u], axis=1).reshape(num_psa, num_dims)
+    else:
+        raise ValueError('wrong sampler: {}'.format(sampler))
+
+
+def check_adaptive_sampler(sampler, min_psa, batch_size):
+    """ raises an error if adaptive PSA, which stops after any batch, cannot use the draws of this sampler: the first
+    draws of a Latin hypercube are not stratified (only the whole plan is), so they are neither a Latin hypercube nor
+    iid as assumed by the MCSE of the stopping rule, while first draws of Sobol and whole antithetic pairs are fine
+    :param sampler: sampler of PSA parameter draws (see sample_uniforms)
+    :param min_psa: number of iterations of the first batch
+    :param batch_size: number of iterations of the other batches
+    """
+    if sampler not in ADAPTIVE_SAMPLERS:
+        raise ValueError('wrong sampler for adaptive PSA: {}, use one of {}'.format(sampler, ADAPTIVE_SAMPLERS))
+    if sampler == 'antithetic' and (min_psa % 2 != 0 or batch_size % 2 != 0):
+        raise ValueError('wrong number of PSA iterations for antithetic pairs: batches of {} and {}'
+                         .format(min_psa, batch_size))
+
+
+class DrawSource:
+    """ parent class of objects that can be passed to RandomValueGenerator.sample in place of a random state """
+
+    def get_next_draw(self, generator):
+        raise NotImplementedError
+
+
+class _DrawRecorder(DrawSource):
+    """ records the generators sampled by one PSA iteration, in the order of sampling """
+
+    def __init__(self):
+        self.rng = np.random.RandomState(seed=0)
+        self.generators = []    # generator of each sample
+
+    def get_next_draw(self, generator):
+        self.generators.append(generator)
+        return generator._sample(rng=self.rng, size=None)
+
+
+class PSADraws:
+    @profiled('presample_params')
+    def __init__(self, params, resample, num_psa, rng, sampler='random'):
+        """ samples the parameters of all PSA iterations up front
+        :param params: parameter object to resample
+        :param resample: function(params, rng) that samples the parameters of one PSA iteration
+        :param num_psa: number of PSA iterations
+        :param rng: numpy random state
+        :param sampler: 'random': pseudo-random draws of each generator,
+                        'lhs', 'sobol' or 'antithetic': uniforms of a sampling plan (see sample_uniforms) over all
+                        parameter values of an iteration, mapped through the inverse cdf of each generator
+        """
+        if sampler not in SAMPLERS:
+            raise ValueError('wrong sampler: {}'.format(sampler))
+        self.numPsa = num_psa
+        self.sampler = sampler
+        # find the generators sampled by a PSA iteration (each generator may be sampled more than once)
+        recorder = _DrawRecorder()
+        resample(params, recorder)
+        keys = {}           # key of each generator
+        num_samples = {}    # number of samples of each generator per iteration
+        self.samples = []   # (key, repetition) of each sample of an iteration, in the order of sampling
+        for generator in recorder.generators:
+            if id(generator) not in keys:
+                key = generator.note
+                while key in num_samples:   # notes of different generators could be the same
+                    key += "'"
+                keys[id(generator)] = key
+                num_samples[key] = 0
+            key = keys[id(generator)]
+            self.samples.append((key, num_samples[key]))
+            num_samples[key] += 1
+
+        # draws of each generator, (iteration x repetition) array or (iteration x repetition x event) for dirichlet
+        self.draws = {}
+        generators = {keys[id(generator)]: generator for generator in recorder.generators}
+        self._keys = keys
+        if sampler == 'random':
+            for key, generator in generators.items():
+                self.draws[key] = generator._sample(rng=rng, size=(num_psa, num_samples[key]))
+        else:
+            # one dimension of the sampling plan for each value (each event of dirichlet) of each sample
+            dims = {key: num_samples[key] * int(np.prod(generator.draw_shape)) for key, generator in generators.items()}
+            uniforms = sample_uniforms(sampler=sampler, num_psa=num_psa, num_dims=sum(dims.values()), rng=rng)
+            first_dim = 0
+            for key, generator in generators.items():
+                u = uniforms[:, first_dim:first_dim + dims[key]]
+                self.draws[key] = generator._inverse_cdf(
+                    u=u.reshape((num_psa, num_samples[key]) + generator.draw_shape))
+                first_dim += dims[key]
+
+    def get_draws(self, generator):
+        """ :return: draws of a generator in all PSA iterations,
+                     (iteration x repetition) array or (iteration x repetition x event) for dirichlet """
+        if id(generator) not in self._keys:
+            raise ValueError('wrong generator: not sampled in PSA iterations ({})'.format(generator.note))
+        return self.draws[self._keys[id(generator)]]
+
+    def get_iteration(self, iteration):
+        """ :return: draws of a PSA iteration to be passed to RandomValueGenerator.sample in place of rng """
+        return PSAIterationDraws(psa_draws=self, iteration=iteration)
+
+
+class PSAIterationDraws(DrawSource):
+    def __init__(self, psa_draws, iteration):
+        """ draws of a PSA iteration, returned in the order they were sampled when recording
+        :param psa_draws: (PSADraws) draws of all PSA iterations
+        :param iteration: index of PSA iteration
+        """
+        self.psaDraws = psa_draws
+        self.iteration = iteration
+        self.numSamples = 0     # number of samples returned
+
+    def get_next_draw(self, generator):
+        if self.numSamples == len(self.psaDraws.samples):
+            raise ValueError('wrong number of samples in PSA iteration')
+        key, repetition = self.psaDraws.samples[self.numSamples]
+        if not key.startswith(generator.note):
+            raise ValueError('wrong order of samples in PSA iteration')
+        self.numSamples += 1
+        value = self.psaDraws.draws[key][self.iteration, repetition]
+        if np.ndim(value) == 0:
+            return float(value)
+        return value.copy()
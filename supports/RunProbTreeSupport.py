@@ -1,32 +1,385 @@
+import glob
+import hashlib
+import math
+import os
+import pickle
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from SimPy.Statistics import SummaryStat
+from supports.ProfilingSupport import profiler, profiled, run_profiled
+from supports.RandomValueGenerators import RandomValueGenerator
 
 
-def convert_list_to_dic(list_data, age_list, sex_list):
-    """ convert [[m1, m2, m3, m4, f1, f2, f3, f4], [...], ..., [...]] into dictionary """
-    colnames = []
-    for sex in sex_list:
-        for age in age_list:
-            name = '{}_{}'.format(sex, age)
-            colnames.append(name)
-    df = pd.DataFrame(list_data, columns=colnames)
-    uListDic = {'male': {}, 'female': {}}
-    uStatDic = {'male': {}, 'female': {}}
-    for sex in sex_list:
-        for age in age_list:
-            uListDic[sex][age] = df['{}_{}'.format(sex, age)].tolist()
-            uStatDic[sex][age] = SummaryStat(name='QALYs loss per infection for {} at age of {}'.format(sex, age),
-                                             data=df['{}_{}'.format(sex, age)].tolist())
-    return uListDic, uStatDic
+MAX_CHUNK_SIZE = 100    # largest default number of iterations per chunk (and per checkpoint shard)
+SOURCE_DIRS = ['classes', 'supports']  # folders of the model code, part of the fingerprint of saved iterations
 
 
-def get_pair_product(list1, list2):
-    inner_product = []
-    for a, b in zip(list1, list2):
-        inner_product.append(a * b)
-    return inner_product
+def run_psa_in_parallel(simulate, num_psa, num_workers=1, chunk_size=None, checkpoint_dir=None, first_seed=0,
+                        config=None):
+    """ run PSA iterations in chunks of iteration indices (used as seeds), in worker processes if num_workers > 1
+    :param simulate: (picklable function) takes a list of seeds and returns a list of results, one per seed
+    :param num_psa: number of probability sensitivity analysis iterations (seeds 0, 1, ..., num_psa - 1)
+    :param num_workers: number of worker processes, 1 runs all chunks in this process, None uses all CPUs
+    :param chunk_size: number of iterations per chunk, None splits the iterations into 4 chunks per worker
+                       (at most MAX_CHUNK_SIZE iterations each)
+    :param checkpoint_dir: folder to save the results of each completed chunk to, iterations already saved in this
+                           folder (e.g. by an interrupted run) are not simulated again, None = no checkpoints
+    :param first_seed: only run the iterations with seeds first_seed, ..., num_psa - 1 (e.g. a batch of adaptive PSA)
+    :param config: settings the results depend on (e.g. discounting rates, sampler, parameter distributions, see
+                   get_config_fingerprint), saved iterations of other settings are not resumed
+    :return: list of results of all iterations (from first_seed) in seed order
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count()
+
+    dic_results = {}    # result of each completed iteration
+    fingerprint = None  # fingerprint of the settings of this run, saved with each shard
+    if checkpoint_dir is not None:
+        fingerprint = get_config_fingerprint(simulate=simulate, config=config)
+        dic_results = {seed: result for seed, result in
+                       read_psa_shards(checkpoint_dir=checkpoint_dir, num_psa=num_psa,
+                                       fingerprint=fingerprint).items() if seed >= first_seed}
+        if len(dic_results) > 0:
+            print('resuming PSA: {} of {} iterations found in {}'.format(
+                len(dic_results), num_psa - first_seed, checkpoint_dir))
+    seeds = [seed for seed in range(first_seed, num_psa) if seed not in dic_results]
+    if chunk_size is None:
+        chunk_size = max(1, min(MAX_CHUNK_SIZE, math.ceil(len(seeds) / (4 * num_workers))))
+    chunks = [seeds[start:start + chunk_size] for start in range(0, len(seeds), chunk_size)]
+
+    def collect(chunk_results):
+        # chunk_results yields the results of chunks in the order of chunks
+        for chunk, results in zip(chunks, chunk_results):
+            if checkpoint_dir is not None:
+                write_psa_shard(checkpoint_dir=checkpoint_dir, seeds=chunk, results=results,
+                                fingerprint=fingerprint)
+            dic_results.update(zip(chunk, results))
+            # progress is reported here, in this process, as chunks complete
+            print('completed PSA iterations: {} of {}'.format(len(dic_results), num_psa - first_seed))
+
+    if num_workers == 1:
+        collect(map(simulate, chunks))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            if profiler.enabled:
+                # stages timed in worker processes are added to the profiler of this process
+                collect(profiler.merge(output_and_state) for output_and_state in
+                        executor.map(partial(run_profiled, simulate), chunks))
+            else:
+                collect(executor.map(simulate, chunks))
+    return [dic_results[seed] for seed in range(first_seed, num_psa)]
+
+
+def run_adaptive_psa(simulate, get_outputs, output_names, tolerance, min_psa, max_psa, batch_size,
+                     num_workers=1, chunk_size=None, checkpoint_dir=None, config=None):
+    """ run PSA iterations in batches until the relative Monte Carlo standard error (MCSE / |mean|) of every
+    headline output is below tolerance, after at least min_psa and at most max_psa iterations
+    :param simulate: (picklable function) takes a list of seeds and returns a list of results, one per seed
+    :param get_outputs: function that takes the result of an iteration and returns its headline outputs
+                        (in the order of output_names)
+    :param output_names: list of names of headline outputs
+    :param tolerance: largest relative MCSE of the headline outputs to stop at
+    :param min_psa: minimum number of iterations
+    :param max_psa: maximum number of iterations
+    :param batch_size: number of iterations between convergence checks
+    :param num_workers: number of worker processes (see run_psa_in_parallel)
+    :param chunk_size: number of iterations per chunk (see run_psa_in_parallel)
+    :param checkpoint_dir: folder of saved iterations to resume from (see run_psa_in_parallel)
+    :param config: settings the results depend on (see run_psa_in_parallel)
+    :return: list of results of all iterations in seed order, WelfordStatistics of the headline outputs and
+             the stopping trace (data frame with the relative MCSE of each output after each batch)
+    """
+    if not 0 < min_psa <= max_psa or batch_size < 1:
+        raise ValueError('wrong number of PSA iterations for adaptive PSA')
+    stats = WelfordStatistics(names=output_names)
+    results = []
+    trace = []      # one row per convergence check
+    while True:
+        # the first batch runs the minimum number of iterations
+        num_psa = min(max_psa, max(min_psa, len(results) + batch_size))
+        batch_results = run_psa_in_parallel(simulate=simulate, num_psa=num_psa, num_workers=num_workers,
+                                            chunk_size=chunk_size, checkpoint_dir=checkpoint_dir,
+                                            first_seed=len(results), config=config)
+        # statistics are updated in seed order, so that they do not depend on the number of workers
+        for result in batch_results:
+            stats.add(values=get_outputs(result))
+        results.extend(batch_results)
+
+        relative_mcse = stats.get_relative_mcse()
+        converged = bool(np.all(relative_mcse < tolerance))
+        trace.append(dict({'num_psa': len(results),
+                           'max_relative_mcse': float(relative_mcse.max()),
+                           'converged': converged},
+                          **dict(zip(output_names, relative_mcse.tolist()))))
+        print('adaptive PSA: {} iterations, largest relative MCSE {:.4g} ({})'.format(
+            len(results), relative_mcse.max(), output_names[int(np.argmax(relative_mcse))]))
+        if converged or len(results) >= max_psa:
+            break
+    if not converged:
+        print('adaptive PSA: relative MCSE above {} after the maximum of {} iterations'.format(tolerance, max_psa))
+    return results, stats, pd.DataFrame(trace)
+
+
+class WelfordStatistics:
+    def __init__(self, names):
+        """ streaming mean and variance (Welford's algorithm) of several outputs over PSA iterations
+        :param names: list of output names
+        """
+        self.names = list(names)
+        self.numPsa = 0                             # number of iterations added
+        self.mean = np.zeros(len(self.names))
+        self._sumSqDev = np.zeros(len(self.names))  # sum of squared deviations from the mean
+
+    def add(self, values):
+        """ :param values: outputs of one PSA iteration, in the order of names """
+        values = np.asarray(values, dtype=float)
+        if values.shape != self.mean.shape:
+            raise ValueError('wrong number of output values')
+        self.numPsa += 1
+        delta = values - self.mean
+        self.mean += delta / self.numPsa
+        self._sumSqDev += delta * (values - self.mean)
+
+    def get_variance(self):
+        """ :return: sample variance of each output """
+        if self.numPsa < 2:
+            return np.full(len(self.names), np.nan)
+        return self._sumSqDev / (self.numPsa - 1)
+
+    def get_mcse(self):
+        """ :return: Monte Carlo standard error of the mean of each output """
+        if self.numPsa < 2:
+            return np.full(len(self.names), np.inf)
+        return np.sqrt(self.get_variance() / self.numPsa)
+
+    def get_relative_mcse(self):
+        """ :return: Monte Carlo standard error relative to the absolute mean of each output
+        (0 for outputs without variation) """
+        mcse = self.get_mcse()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(mcse == 0, 0, mcse / np.abs(self.mean))
+
+    def to_dataframe(self):
+        """ :return: data frame with the mean, standard deviation, MCSE and relative MCSE of each output """
+        return pd.DataFrame({'output': self.names,
+                             'mean': self.mean,
+                             'stdev': np.sqrt(self.get_variance()),
+                             'mcse': self.get_mcse(),
+                             'relative_mcse': self.get_relative_mcse()})
+
+
+def get_distributions(params):
+    """ :return: dictionary of the RandomValueGenerators of a parameter object (and of the parameter objects it
+    holds, e.g. Incidence) by attribute name, as canonical values (see get_config_fingerprint) """
+    dic_distributions = {}
+    for name, value in vars(params).items():
+        if isinstance(value, RandomValueGenerator):
+            dic_distributions[name] = _get_canonical(value)
+        elif hasattr(value, '__dict__') and type(value).__module__ == type(params).__module__:
+            dic_distributions[name] = get_distributions(params=value)
+    return dic_distributions
+
+
+def get_config_fingerprint(simulate, config):
+    """ :return: (string) hash of the simulation function (its code and fixed keyword arguments, e.g. scenarios) and
+    the settings its results depend on, PSA iterations with the same fingerprint can be resumed
+    :param simulate: function that simulates PSA iterations (or a functools.partial of it)
+    :param config: dictionary of settings (numbers, strings, lists, dictionaries and RandomValueGenerators)
+    """
+    func = simulate.func if isinstance(simulate, partial) else simulate
+    keywords = simulate.keywords if isinstance(simulate, partial) else {}
+    key = (func.__module__, func.__qualname__, hashlib.sha256(func.__code__.co_code).hexdigest(),
+           _get_canonical(keywords), _get_canonical(config), get_source_hash())
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+
+def get_source_hash():
+    """ :return: (string) hash of the source files of the model code (SOURCE_DIRS), so that iterations saved before
+    the trees, parameters or life tables were edited are not resumed """
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    source_hash = hashlib.sha256()
+    for folder in SOURCE_DIRS:
+        for path in sorted(glob.glob(os.path.join(root_dir, folder, '*.py'))):
+            source_hash.update(os.path.relpath(path, root_dir).encode())
+            with open(path, 'rb') as source_file:
+                source_hash.update(source_file.read())
+    return source_hash.hexdigest()
+
+
+def _get_canonical(value):
+    """ :return: value with RandomValueGenerators replaced by their class name and attributes (so that the
+    representation does not depend on object addresses) """
+    if isinstance(value, RandomValueGenerator):
+        return type(value).__name__, _get_canonical(vars(value))
+    elif isinstance(value, dict):
+        return [(name, _get_canonical(item)) for name, item in value.items()]
+    elif isinstance(value, (list, tuple)):
+        return [_get_canonical(item) for item in value]
+    elif isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+@profiled('write_outputs')
+def write_psa_shard(checkpoint_dir, seeds, results, fingerprint=None):
+    """ save the results of a chunk of PSA iterations to a new shard file in checkpoint_dir
+    :param checkpoint_dir: folder of shard files
+    :param seeds: list of iteration indices of the chunk
+    :param results: list of results of the chunk, one per seed
+    :param fingerprint: fingerprint of the settings of the run (see get_config_fingerprint)
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, 'shard_{}_{}.pkl'.format(seeds[0], seeds[-1]))
+    # write to a temporary file first so that an interruption never leaves a partial shard
+    with open(path + '.tmp', 'wb') as output:
+        pickle.dump({'seeds': list(seeds), 'results': results, 'fingerprint': fingerprint}, output)
+    os.replace(path + '.tmp', path)
+
+
+def read_psa_shards(checkpoint_dir, num_psa, fingerprint=None):
+    """ :return: dictionary of results of PSA iterations (with seed < num_psa) saved in the shard files of
+    checkpoint_dir, keyed by seed
+    :param fingerprint: fingerprint of the settings of the run (see get_config_fingerprint), shards saved with other
+                        settings or model code are ignored (and replaced as their iterations are run again)
+    """
+    dic_results = {}
+    for path in sorted(glob.glob(os.path.join(checkpoint_dir, 'shard_*.pkl'))):
+        with open(path, 'rb') as shard_file:
+            shard = pickle.load(shard_file)
+        if shard.get('fingerprint') != fingerprint:
+            print('ignoring {}: saved by a run with other settings or model code'.format(path))
+            continue
+        for seed, result in zip(shard['seeds'], shard['results']):
+            if seed < num_psa:
+                dic_results[seed] = result
+    return dic_results
+
+
+def clear_psa_shards(checkpoint_dir):
+    """ remove the shard files of checkpoint_dir (once the outputs of a complete run are saved) """
+    for path in glob.glob(os.path.join(checkpoint_dir, 'shard_*.pkl*')):
+        os.remove(path)
+
+
+class ComponentLossAccumulator:
+    def __init__(self, components, sex_list, age_list, num_psa):
+        """ preallocated storage of component QALYs lost by PSA iteration, sex and age
+        :param components: list of component names
+        :param sex_list: list of sex groups
+        :param age_list: list of age groups
+        :param num_psa: number of probability sensitivity analysis iterations
+        """
+        self.components = list(components)
+        self.sexList = list(sex_list)
+        self.ageList = list(age_list)
+        self.numPsa = num_psa
+        self.numGroups = len(self.sexList) * len(self.ageList)    # number of sex and age subgroups per iteration
+        num_rows = num_psa * self.numGroups
+        # one row per (iteration, sex, age), in the order subgroups are simulated
+        self.values = np.zeros((num_rows, len(self.components)))
+        self.sexCodes = np.repeat(np.arange(len(self.sexList), dtype=np.int8), len(self.ageList))
+        self.ageCodes = np.tile(np.arange(len(self.ageList), dtype=np.int8), len(self.sexList))
+        self.iterNums = np.zeros(num_rows, dtype=np.int32)
+        self.recorded = np.zeros(num_psa, dtype=bool)   # whether the rows of each iteration are filled
+
+    @profiled('component_breakdown')
+    def add_iteration(self, iter_num, values):
+        """ record component QALYs lost of one iteration
+        :param iter_num: index of PSA iteration
+        :param values: (numGroups x components) array of component QALYs lost,
+                       subgroups ordered by sex then age, components in the order of self.components
+        """
+        values = np.asarray(values, dtype=float)
+        if values.shape != (self.numGroups, len(self.components)):
+            raise ValueError('wrong shape of component values')
+        start = iter_num * self.numGroups
+        self.values[start:start + self.numGroups] = values
+        self.iterNums[start:start + self.numGroups] = iter_num
+        self.recorded[iter_num] = True
+
+    def to_dataframe(self):
+        """ :return: data frame with one column per component plus sex, age and iter_num """
+        if not self.recorded.all():
+            raise ValueError('wrong number of recorded iterations')
+        df = pd.DataFrame(self.values, columns=self.components)
+        df['sex'] = np.array(self.sexList, dtype=object)[np.tile(self.sexCodes, self.numPsa)]
+        df['age'] = np.array(self.ageList)[np.tile(self.ageCodes, self.numPsa)]
+        df['iter_num'] = self.iterNums
+        return df
+
+    @profiled('write_outputs')
+    def to_csv(self, path):
+        """ write component QALYs lost to a csv file """
+        self.to_dataframe().to_csv(path)
+
+
+def get_psa_outcomes(utility, incidence, sex_list):
+    """ calculate the outcomes of all PSA iterations from age- and sex-specific QALYs loss and incidence
+    :param utility: (num_psa x sex x age) array of QALYs loss per infection
+    :param incidence: (num_psa x sex x age) array of incidence
+    :param sex_list: list of sex groups (order of the second axis)
+    :return: dictionary of arrays with one row per PSA iteration:
+             'qaly_per_case': QALYs loss per infection (num_psa x sex x age),
+             'incidence': incidence (num_psa x sex x age),
+             'total_qaly': total QALYs loss (num_psa x sex x age),
+             'non_age_sex_qaly': QALYs loss per infection among the general population,
+             't_qaly_m', 't_qaly_f' and 't_qaly_hsv': total QALYs loss among males, females and both
+    """
+    utility = np.asarray(utility, dtype=float)
+    incidence = np.asarray(incidence, dtype=float)
+    num_psa = utility.shape[0]
+    total_qaly = utility * incidence
+    male_qaly = total_qaly[:, sex_list.index('male')]
+    female_qaly = total_qaly[:, sex_list.index('female')]
+    # sums are accumulated in the order of sex and age groups (cumsum adds sequentially)
+    return {'qaly_per_case': utility,
+            'incidence': incidence,
+            'total_qaly': total_qaly,
+            'non_age_sex_qaly': np.cumsum(total_qaly.reshape(num_psa, -1), axis=1)[:, -1] /
+                                np.cumsum(incidence.reshape(num_psa, -1), axis=1)[:, -1],
+            't_qaly_m': np.cumsum(male_qaly, axis=1)[:, -1],
+            't_qaly_f': np.cumsum(female_qaly, axis=1)[:, -1],
+            't_qaly_hsv': np.cumsum(male_qaly + female_qaly, axis=1)[:, -1]}
+
+
+def get_headline_output_names(sex_list, age_list):
+    """ :return: names of the headline outputs of a PSA iteration (see get_headline_outputs) """
+    return ['qaly_per_case_{}_{}'.format(sex, age) for sex in sex_list for age in age_list] + \
+        ['qaly_per_case', 't_qaly_m', 't_qaly_f', 't_qaly_hsv']
+
+
+def get_headline_outputs(utility, incidence, sex_list):
+    """ headline outputs of a PSA iteration: age- and sex-specific QALYs loss per infection, QALYs loss per
+    infection among the general population and total QALYs loss among males, females and both
+    :param utility: list of age- and sex-specific QALYs loss per infection (sex x age) of one iteration
+    :param incidence: list of age- and sex-specific incidence (sex x age) of one iteration
+    :param sex_list: list of sex groups
+    :return: (array) headline outputs in the order of get_headline_output_names
+    """
+    utility = np.reshape(np.asarray(utility, dtype=float), (1, len(sex_list), -1))
+    outcomes = get_psa_outcomes(utility=utility, incidence=np.reshape(incidence, utility.shape), sex_list=sex_list)
+    return np.concatenate([outcomes['qaly_per_case'].ravel(), outcomes['non_age_sex_qaly'],
+                           outcomes['t_qaly_m'], outcomes['t_qaly_f'], outcomes['t_qaly_hsv']])
+
+
+def get_mean_and_interval(draws, alpha=0.05):
+    """ :param draws: array with one row per PSA iteration
+    :param alpha: significance level of the percentile interval
+    :return: mean and [lower, upper] percentile interval over PSA iterations, in the shape of a row of draws """
+    # put iterations on the last (contiguous) axis so that each mean sums a contiguous row, as SummaryStat does
+    draws = np.ascontiguousarray(np.moveaxis(np.asarray(draws, dtype=float), 0, -1))
+    return draws.mean(axis=-1), np.percentile(draws, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=-1)
+
+
+def format_mean_and_interval(draws, deci):
+    """ :return: (string) mean and 95% percentile interval of a one-dimensional array of draws """
+    return SummaryStat(name='draws', data=np.ascontiguousarray(draws)).get_formatted_mean_and_interval(
+        deci=deci, interval_type='p')
 
 
+@profiled('summary_stats')
 def get_summary_stats(mf_utility_lists, mf_id_lists, age_list, sex_list, num_psa, virus_type):
     """ calculate summary stats, including:
     1) QALYs loss per infection within each age- and sex-subgroups
@@ -41,73 +394,32 @@ def get_summary_stats(mf_utility_lists, mf_id_lists, age_list, sex_list, num_psa
     :param virus_type: 'HSV-1' or 'HSV-2'
     :return: several outcomes
     """
+    shape = (num_psa, len(sex_list), len(age_list))
+    outcomes = get_psa_outcomes(utility=np.reshape(mf_utility_lists, shape), incidence=np.reshape(mf_id_lists, shape),
+                                sex_list=sex_list)
 
     # 1) QALYs loss per infection within each age and sex subgroup
-    qaly_list_dic, qaly_stat_dic = convert_list_to_dic(list_data=mf_utility_lists, age_list=age_list, sex_list=sex_list)
-    # Incidence per infection within each age and sex subgroup
-    id_list_dic, id_stat_dic = convert_list_to_dic(list_data=mf_id_lists, age_list=age_list, sex_list=sex_list)
-    # for each (age- and sex-specific) id_stat_dic
-    age_sex_specific_qaly = []  # [m1, m2, m3, m4, f1, f2, f3, f4]
-    for sex in sex_list:
-        for age in age_list:
-            avg = qaly_stat_dic[sex][age].get_formatted_mean_and_interval(deci=5, interval_type='p')
-            age_sex_specific_qaly.append(avg)
-            # print('QALYs loss per {} HSV infection with an avg age of {}:'.format(sex, age), avg)
+    qaly_per_case = outcomes['qaly_per_case'].reshape(num_psa, -1)
+    age_sex_specific_qaly = [format_mean_and_interval(draws=qaly_per_case[:, i], deci=5)    # [m1, ..., f4]
+                             for i in range(qaly_per_case.shape[1])]
 
     # 2) QALYs loss per infection among the general population
-    non_age_sex_qaly = []
-    qaly_id_non_age_sex_list = []
-    for i in range(num_psa):
-        qaly_non_age_sex_per_psa = []
-        id_non_age_sex_per_psa = []
-        for sex in sex_list:
-            for age in age_list:
-                qaly_this_group = qaly_list_dic[sex][age][i]
-                id_this_group = id_list_dic[sex][age][i]
-                total_qaly_this_group = qaly_this_group * id_this_group
-                id_non_age_sex_per_psa.append(id_this_group)
-                qaly_non_age_sex_per_psa.append(total_qaly_this_group)
-        non_age_sex_qaly.append(sum(qaly_non_age_sex_per_psa) / sum(id_non_age_sex_per_psa))
-        qaly_id_non_age_sex_list.append([qaly_non_age_sex_per_psa, id_non_age_sex_per_psa])
-    non_age_sex_qaly_stat = SummaryStat(name='QALYs loss per {} infection among the general population'.format(virus_type),
-                                        data=non_age_sex_qaly)
-    non_age_sex_qaly_avg = non_age_sex_qaly_stat.get_formatted_mean_and_interval(deci=5, interval_type='p')
+    non_age_sex_qaly_avg = format_mean_and_interval(draws=outcomes['non_age_sex_qaly'], deci=5)
     print()
     print('QALYs loss per {} infection among the general population:'.format(virus_type), non_age_sex_qaly_avg)
+    # [[QALYs loss of each group], [incidence of each group]] of each iteration
+    qaly_id_non_age_sex_list = np.stack([outcomes['total_qaly'].reshape(num_psa, -1),
+                                         outcomes['incidence'].reshape(num_psa, -1)], axis=1).tolist()
 
     # 3) Total QALYs loss each gender (summing up age groups)
     # 4) Total QALYs loss per virus type (summing up sex groups)
-    t_qaly_dic = {'female': [], 'male': []}
-    for age in age_list:
-        t_qaly_dic['female'].append(get_pair_product(list1=qaly_list_dic['female'][age], list2=id_list_dic['female'][age]))
-        t_qaly_dic['male'].append(get_pair_product(list1=qaly_list_dic['male'][age], list2=id_list_dic['male'][age]))
-    t_qaly_loss_for_m = []
-    t_qaly_loss_for_f = []
-    t_qaly_loss_for_hsv = []
-    for i in range(num_psa):
-        t_qaly_loss_m = 0
-        t_qaly_loss_f = 0
-        t_qaly_loss = 0
-        for f_qaly, m_qaly in zip(t_qaly_dic['female'], t_qaly_dic['male']):
-            t_qaly_loss_m += m_qaly[i]
-            t_qaly_loss_f += f_qaly[i]
-            t_qaly_loss += m_qaly[i] + f_qaly[i]
-        t_qaly_loss_for_m.append(t_qaly_loss_m)
-        t_qaly_loss_for_f.append(t_qaly_loss_f)
-        t_qaly_loss_for_hsv.append(t_qaly_loss)
     print()
-    t_qaly_m_stat = SummaryStat(name='total QALYs loss among males due to {} infection in 2018'.format(virus_type),
-                                data=t_qaly_loss_for_m)
-    t_qaly_m_avg = t_qaly_m_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
+    t_qaly_m_avg = format_mean_and_interval(draws=outcomes['t_qaly_m'], deci=2)
     print('Total QALYs loss among males due to {} infection in 2018:'.format(virus_type), t_qaly_m_avg)
-    t_qaly_f_stat = SummaryStat(name='total QALYs loss among females due to {} infection in 2018'.format(virus_type),
-                                data=t_qaly_loss_for_f)
-    t_qaly_f_avg = t_qaly_f_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
+    t_qaly_f_avg = format_mean_and_interval(draws=outcomes['t_qaly_f'], deci=2)
     print('Total QALYs loss among females due to {} infection in 2018:'.format(virus_type), t_qaly_f_avg)
 
     print()
-    t_qaly_hsv_stat = SummaryStat(name='total QALYs loss for {} infection in 2018'.format(virus_type),
-                                  data=t_qaly_loss_for_hsv)
-    t_qaly_hsv_avg = t_qaly_hsv_stat.get_formatted_mean_and_interval(deci=2, interval_type='p')
+    t_qaly_hsv_avg = format_mean_and_interval(draws=outcomes['t_qaly_hsv'], deci=2)
     print('Total QALYs loss due to {} infection in 2018:'.format(virus_type), t_qaly_hsv_avg)
     return age_sex_specific_qaly, non_age_sex_qaly_avg, t_qaly_f_avg, t_qaly_m_avg, t_qaly_hsv_avg, qaly_id_non_age_sex_list
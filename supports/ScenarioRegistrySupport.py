@@ -0,0 +1,49 @@
+from supports.RandomValueGenerators import BetaValueGenerator
+
+
+class ScenarioRegistry:
+    def __init__(self):
+        """ named scenarios of alternative assumptions, each a dictionary of parameter samples to override
+        (parameter sample name, e.g. 'diagnosis_disu_sample': fixed value or RandomValueGenerator to sample the
+        value from in each PSA iteration, see get_override_values) """
+        self._dic_scenarios = {}
+
+    def register(self, name, overrides):
+        """
+        :param name: (string) name of the scenario
+        :param overrides: dictionary of parameter sample name and fixed value or RandomValueGenerator
+        """
+        if name in self._dic_scenarios:
+            raise ValueError('scenario already registered: {}'.format(name))
+        self._dic_scenarios[name] = dict(overrides)
+
+    def get_overrides(self, name):
+        """ :return: dictionary of parameter samples overridden by the scenario """
+        if name not in self._dic_scenarios:
+            raise ValueError('wrong scenario name: {}'.format(name))
+        return self._dic_scenarios[name]
+
+    def get_names(self):
+        """ :return: list of scenario names in the order of registration """
+        return list(self._dic_scenarios)
+
+
+# alternative assumptions (the same override objects are returned for every request of a scenario)
+scenario_registry = ScenarioRegistry()
+# disutilities of symptomatic outbreaks from GBD (instead of literatures)
+gbd_sympt_outbreak_disu = BetaValueGenerator(mean=0.051, stdv=0.0105,
+                                             note='disutility due to symptomatic primary infection (GBD)')
+scenario_registry.register(
+    name='GBD symptomatic outbreak disutility',
+    overrides={'primary_sympt_notreat_disu_sample': gbd_sympt_outbreak_disu,
+               'primary_sympt_treat_disu_sample': gbd_sympt_outbreak_disu,
+               'recur_sympt_treated_disu_sample':
+                   BetaValueGenerator(mean=0.006, stdv=0.0025, note='disutility per sympt recurrence (treated, GBD)')})
+# psychosocial disutility due to diagnosis
+scenario_registry.register(
+    name='0.02 psychosocial disutility',
+    overrides={'diagnosis_disu_sample': BetaValueGenerator(mean=0.02, stdv=0.005, note='disu due to hsv diagnosis')})
+scenario_registry.register(
+    name='0 psychosocial disutility',
+    overrides={'diagnosis_disu_sample': 0,
+               'diagnosis_disu_reduction_sample': 0})
@@ -1,77 +1,143 @@
+import os
+import hashlib
 import numpy as np
 from scipy.linalg import cholesky
-from statistics import mean
 
 
-def CorrelateUtils(matrix_u, matrix_q, epsilon, delta):
+# version of the CorrelateUtils algorithm, increase it whenever the algorithm changes its results so that
+# matrices cached on disk by earlier versions are not used
+CORRELATE_UTILS_VERSION = 1
+
+# correlated QoL weight matrices of CorrelateUtils, keyed by inputs
+_dic_correlated_utils = {}
+
+
+def CorrelateUtils(matrix_u, matrix_q, epsilon, delta, seed=None):
     """
     reference: https://www.ncbi.nlm.nih.gov/pmc/articles/PMC4794424/#APP1
     :param matrix_u: (numpy array) independent QoL weight matrix (nxs). n: row, PSA; s: col, health states
     :param matrix_q: (numpy array) preference order matrix (sxs). s: # of health states
     :param epsilon: % violation threshold
     :param delta: step for correlation coefficient reduction (rho)
+    :param seed: seed of the reference matrix (results are cached by inputs),
+                 None = draw the reference matrix from the global numpy random state (not cached)
     """
+    matrix_u = np.asarray(matrix_u, dtype=float)
+    matrix_q = np.asarray(matrix_q)
+    key = None
+    if seed is not None:
+        key = (matrix_u.shape, hashlib.sha1(matrix_u.tobytes()).hexdigest(), matrix_q.tobytes(), epsilon, delta, seed)
+        if key in _dic_correlated_utils:
+            return _dic_correlated_utils[key].copy()
+
     # Step 1: initializations
     n = matrix_u.shape[0]  # number of PSA samples
     s = matrix_u.shape[1]  # number of health states
 
     # reference matrix
-    matrix_r = np.random.normal(loc=0, scale=1, size=(n, s))
-    # desired correlation matrix
-    matrix_c = np.zeros(shape=(s, s))
-    # violation matrix
-    Viol = np.zeros(shape=(s, s))
+    if seed is None:
+        matrix_r = np.random.normal(loc=0, scale=1, size=(n, s))
+    else:
+        matrix_r = np.random.RandomState(seed=seed).normal(loc=0, scale=1, size=(n, s))
 
     # Step 2: find minimum correlation coefficients for pairwise health states
     # [j, k] is the selected pair for state comparison
-    for j in range(1, s):
-        for k in range(0, j):
-            rho = 1  # bi-variate correlation
-            matrix_x = matrix_u[:, [j, k]]      # select column of U (independent QoL weight matrix)
-            matrix_y = matrix_r[:, [j, k]]      # select column of R (reference matrix)
-            viol = 0
-            while (viol < epsilon) and (rho >= 0):  # if conditions met, continues
-                rho = rho - delta  # reduce correlation
-                matrix_x_star = induceRankCorrelation(matrix_x, matrix_y, rho)
-                # compute correlations between the col vectors (calculate the % of violation)
-                viol_list = (matrix_q[j, k] * matrix_x_star[:, 0]) < (matrix_q[j, k] * matrix_x_star[:, 1])
-                viol_list = viol_list.tolist()
-                viol = mean(viol_list)
-            matrix_c[j, k] = rho + delta    # record the desired correlation into desired correlation matrix
+    pairs = [(j, k) for j in range(1, s) for k in range(0, j)]
+    matrix_c = np.zeros(shape=(s, s))   # desired correlation matrix
+    if len(pairs) > 0:
+        rows, cols = np.asarray(pairs).T
+        matrix_c[rows, cols] = get_min_correlations(matrix_u=matrix_u, matrix_r=matrix_r, matrix_q=matrix_q,
+                                                    pairs=pairs, epsilon=epsilon, delta=delta)
 
     matrix_c += matrix_c.T
     for j in range(1, s):
         matrix_c[j, j] = 1      # fill the diagonal ones
 
-    # Step 3: Eigenvector and Eigenvalues correlation of C
-    B_orig, V = np.linalg.eig(matrix_c)
-    # set eigenvalues<=0 to a very small positive number
-    B = []
-    for value in B_orig:
-        if value <= 0:
-            value = 0.0001
-        B.append(value)
-    # reconstruct C (C* = V \times B \times V-1)
-    matrix_c_star = np.dot(np.dot(V, np.diag(B)), np.linalg.inv(V))
+    # Step 3: Eigenvector and Eigenvalues correlation of C (symmetric, so V is orthogonal)
+    B_orig, V = np.linalg.eigh(matrix_c)
+    # set eigenvalues<=0 (or numerically 0) to a very small positive number
+    B = np.maximum(B_orig, 0.0001)
+    # reconstruct C (C* = V \times B \times V-1), symmetric so that it can be factorized by Cholesky
+    matrix_c_star = np.dot(np.dot(V, np.diag(B)), V.T)
     # similar to above, induce the correlation
     matrix_u_star = induceRankCorrelation(matrix_u, matrix_r, matrix_c_star)
 
+    if key is not None:
+        _dic_correlated_utils[key] = matrix_u_star.copy()
     return matrix_u_star
 
 
+def get_cache_path(cache_dir, key):
+    """ :return: path of the .npy file of a matrix cached on disk under key (any object with a stable repr) """
+    return os.path.join(cache_dir, '{}.npy'.format(hashlib.sha1(repr(key).encode()).hexdigest()))
+
+
+def read_cached_matrix(cache_dir, key):
+    """ :return: matrix saved by write_cached_matrix under key, None if not cached """
+    path = get_cache_path(cache_dir=cache_dir, key=key)
+    if not os.path.exists(path):
+        return None
+    return np.load(path)
+
+
+def write_cached_matrix(cache_dir, key, matrix):
+    """ save a matrix to cache_dir under key (to be read by read_cached_matrix) """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = get_cache_path(cache_dir=cache_dir, key=key)
+    # write to a temporary file first so that concurrent runs never read a partial file
+    with open(path + '.tmp', 'wb') as output:
+        np.save(output, matrix)
+    os.replace(path + '.tmp', path)
+
+
+def get_min_correlations(matrix_u, matrix_r, matrix_q, pairs, epsilon, delta):
+    """ find the minimum correlation coefficient of each pair of health states [j, k], i.e. the correlation at which
+    rho = 1 - delta, 1 - 2 * delta, ... first reaches epsilon % violation of the preference order (or below 0),
+    plus delta. The violation decreases with correlation, so the step is found by bisection for all pairs together.
+    :param matrix_u: (numpy array) independent QoL weight matrix (nxs)
+    :param matrix_r: (numpy array) reference matrix (nxs)
+    :param matrix_q: (numpy array) preference order matrix (sxs)
+    :param pairs: list of pairs of health states [j, k]
+    :param epsilon: % violation threshold
+    :param delta: step for correlation coefficient reduction (rho)
+    :return: (numpy array) minimum correlation coefficient of each pair
+    """
+    # grid of correlation coefficients, from 1 until the first one below 0
+    rhos = [1]
+    while rhos[-1] >= 0:
+        rhos.append(rhos[-1] - delta)
+    rhos = np.asarray(rhos)
+
+    first, second = np.asarray(pairs).T
+    q = matrix_q[first, second]
+    # the first state of each pair is ordered by its own reference column for all rho
+    x_first = np.take_along_axis(np.sort(matrix_u[:, first], axis=0), np.argsort(matrix_r[:, first], axis=0), axis=0)
+    x_second_sorted = np.sort(matrix_u[:, second], axis=0)
+    y_first = matrix_r[:, first]
+    y_second = matrix_r[:, second]
+
+    # bisection over steps: find the first step with violation >= epsilon (or with rho < 0, the last step)
+    lows = np.ones(len(pairs), dtype=int)
+    highs = np.full(len(pairs), len(rhos) - 1)
+    while np.any(lows < highs):
+        active = np.where(lows < highs)[0]
+        mids = (lows[active] + highs[active]) // 2
+        rho = rhos[mids]
+        # correlated reference (Cholesky factor of [[1, rho], [rho, 1]]) and rank ordering of the second state
+        y_star = rho * y_first[:, active] + np.sqrt(1 - rho * rho) * y_second[:, active]
+        x_second = np.take_along_axis(x_second_sorted[:, active], np.argsort(y_star, axis=0), axis=0)
+        viol = np.mean(q[active] * x_first[:, active] < q[active] * x_second, axis=0)
+        violated = viol >= epsilon
+        highs[active[violated]] = mids[violated]
+        lows[active[~violated]] = mids[~violated] + 1
+    return rhos[lows] + delta
+
+
 def induceRankCorrelation(matrix_x, matrix_y, sigma):
     # if Sigma is a single value, convert to 2x2 matrix
     if isinstance(sigma, float):
         sigma = np.asarray([[1, sigma], [sigma, 1]])
 
-    n = matrix_x.shape[0]   # num of rows
-    s = matrix_x.shape[1]   # num of columns
-
-    # Initial matrices (not needed?)
-    matrix_x_sorted = np.zeros(shape=(n, s))
-    matrix_y_rank = np.zeros(shape=(n, s))
-    matrix_x_star = np.zeros(shape=(n, s))
-
     # compute the upper triangular matrix: Sigma = PP'
     matrix_p = cholesky(sigma)  # np.linalg.cholesky gives lower triangular matrix
     # sort the values in the reference factors by multiplying by matrix_p
@@ -83,9 +149,9 @@ def induceRankCorrelation(matrix_x, matrix_y, sigma):
     # sort X, then reorder X_sorted based on the rank order in Y*
     matrix_x_sorted = np.sort(matrix_x, axis=0)
     matrix_y_rank = np.argsort(matrix_y_star, axis=0)
-    matrix_x_star = np.array(list(map(lambda x, y: y[x], matrix_y_rank.T, matrix_x_sorted.T)))
+    matrix_x_star = np.take_along_axis(matrix_x_sorted, matrix_y_rank, axis=0)
 
-    return matrix_x_star.T
+    return matrix_x_star
 
 
 def calculate_violation_percentage(matrix):
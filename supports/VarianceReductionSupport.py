@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+
+def get_control_draws(psa_draws, generators, num_psa):
+    """ draws of parameters with analytically known means (control variates)
+    :param psa_draws: (PSADraws) parameter draws of all PSA iterations sampled up front
+    :param generators: list of RandomValueGenerators sampled in PSA iterations (each repetition of a sample and each
+                       event of dirichlet is one control variate)
+    :param num_psa: number of PSA iterations run (first rows of the draws)
+    :return: (num_psa x num_controls) array of draws and array of their analytical means
+    """
+    draws = []
+    means = []
+    for generator in generators:
+        values = psa_draws.get_draws(generator=generator)[:num_psa]
+        draws.append(values.reshape(num_psa, -1))
+        means.append(np.broadcast_to(generator.get_mean(), values.shape[1:]).ravel())
+    return np.hstack(draws), np.concatenate(means)
+
+
+def get_variance_reduced_stats(outputs, output_names, controls=None, control_means=None, pair_size=1):
+    """ means of PSA outputs adjusted by control variates (regression estimator), averaging antithetic pairs first
+    :param outputs: (num_psa x num_outputs) array of outputs of each PSA iteration
+    :param output_names: list of output names
+    :param controls: (num_psa x num_controls) array of draws of control variates, None = no control variates
+    :param control_means: array of analytical means of control variates
+    :param pair_size: 2 if iterations 2k and 2k + 1 are antithetic pairs, 1 if iterations are independent
+    :return: data frame with, for each output: mean and MCSE of independent iterations, adjusted mean and its MCSE,
+             effective sample size (number of independent iterations with the same MCSE) and its gain
+    """
+    outputs = np.asarray(outputs, dtype=float)
+    num_psa = outputs.shape[0]
+    if num_psa % pair_size != 0:
+        raise ValueError('wrong number of PSA iterations for pairs of {}: {}'.format(pair_size, num_psa))
+    num_units = num_psa // pair_size    # number of independent units (pairs)
+    # average of each pair
+    y = outputs.reshape(num_units, pair_size, -1).mean(axis=1)
+    design = np.ones((num_units, 1))
+    if controls is not None:
+        x = np.asarray(controls, dtype=float).reshape(num_units, pair_size, -1).mean(axis=1)
+        # with controls centered at their known means, the intercept is the adjusted mean
+        design = np.column_stack([design, x - control_means])
+    num_coefs = np.linalg.matrix_rank(design)
+    if num_units <= num_coefs:
+        raise ValueError('wrong number of PSA iterations: {} for {} control variates'.format(num_psa, num_coefs - 1))
+    coefs = np.linalg.lstsq(design, y, rcond=None)[0]
+    residual_var = ((y - design @ coefs) ** 2).sum(axis=0) / (num_units - num_coefs)
+    adjusted_var = residual_var * np.linalg.pinv(design.T @ design)[0, 0]
+
+    var = outputs.var(axis=0, ddof=1)
+    ess = var / adjusted_var
+    return pd.DataFrame({'output': output_names,
+                         'mean': outputs.mean(axis=0),
+                         'mcse': np.sqrt(var / num_psa),
+                         'adjusted_mean': coefs[0],
+                         'adjusted_mcse': np.sqrt(adjusted_var),
+                         'ess': ess,
+                         'ess_gain': ess / num_psa})
@@ -1,14 +1,46 @@
+import os
 import re
 import pickle
 import numpy as np
 import math
+import pandas as pd
 import matplotlib.pyplot as plt
+from SimPy.Statistics import SummaryStat
+from supports.DrawStoreSupport import HSVDrawStore
 
 sex_list = ['male', 'female']
 age_list = [21, 27, 32, 42]
 
 
+def read_outcomes(store_dir, pkl_path, store_class=HSVDrawStore):
+    """ :return: memory-mapped raw draws of store_dir if the store exists, otherwise the dictionary saved in pkl_path
+    (both can be passed to the functions below) """
+    if os.path.isdir(store_dir):
+        return store_class(store_dir)
+    with open(pkl_path, 'rb') as pkl_file:
+        return pickle.load(pkl_file)
+
+
+def read_one_way_outcomes(table_path, virus_type, scenarios):
+    """ :param table_path: results table of one-way sensitivity analysis (see analyses/RunOneWaySensitivity.py)
+    :param virus_type: 'HSV-1' or 'HSV-2'
+    :param scenarios: list of scenario names (order of the outputs)
+    :return: mean QALYs lost per case and total QALYs lost of the base case, and
+             [[QALYs lost per case of each scenario], [total QALYs lost of each scenario]] """
+    df = pd.read_csv(table_path)
+    dic_mean = {(row.scenario, row.outcome): row.mean for row in df[df['virus_type'] == virus_type].itertuples()}
+    return dic_mean[('base', 'qaly_per_case')], dic_mean[('base', 'total_qaly')], \
+        [[dic_mean[(scenario, 'qaly_per_case')] for scenario in scenarios],
+         [dic_mean[(scenario, 'total_qaly')] for scenario in scenarios]]
+
+
 def get_mean_min_max(string):
+    """ :param string: string formatted as 'mean (min, max)', or array of draws
+    :return: mean, lower and upper bounds of 95% percentile interval """
+    if not isinstance(string, str):
+        stat = SummaryStat(name='draws', data=np.asarray(string))
+        min_value, max_value = stat.get_PI(alpha=0.05)
+        return stat.get_mean(), min_value, max_value
     split_list = re.split('[(,)]', string)
     mean = float(split_list[0])
     min_value = float(split_list[1])
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# modules are imported as supports.X/classes.X and read data files by paths relative to the repository root
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.chdir(REPO_DIR)
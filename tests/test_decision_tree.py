@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from classes.DecisionTreeClass import DecisionNode, CompiledTree
+
+# [cost, utility, component dictionary, future nodes, probabilities of future nodes]
+DICT_DECISIONS = {'d1': [0, 0, {}, ['c0']]}
+DICT_TERMINALS = {'t1': [1, 0.5, {'a': 0.5}], 't2': [2, 0.2, {'b': 0.2}], 't3': [0, 0.1, {'a': 0.1}]}
+
+
+def get_dict_chances(p):
+    return {'c0': [3, 0.3, {'b': 0.3}, ['c1', 't3'], [p, 1 - p]],
+            'c1': [0, 0, {}, ['t1', 't2'], [0.25, 0.75]]}
+
+
+def test_arrays_match_node_graph():
+    p_list = [0.2, 0.7]
+    compiled = CompiledTree('d1', DICT_DECISIONS, get_dict_chances(p_list[0]), DICT_TERMINALS)
+    compiled.evaluate_batch([get_dict_chances(p) for p in p_list], [DICT_TERMINALS] * len(p_list))
+    costs, utilities = compiled.get_batch_cost_utility()['c0']
+    components = compiled.get_batch_component_loss()['c0']
+    terminal_probs = compiled.get_batch_terminal_prob()['c0']
+    for k, p in enumerate(p_list):
+        tree = DecisionNode('d1', DICT_DECISIONS, get_dict_chances(p), DICT_TERMINALS)
+        tree.evaluate()
+        assert [costs[k], utilities[k]] == pytest.approx(tree.get_cost_utility()['c0'], rel=1e-12)
+        for key, value in tree.get_component_loss()['c0'].items():
+            assert components[key][k] == pytest.approx(value, rel=1e-12)
+        for key, value in tree.get_terminal_prob()['c0'].items():
+            assert terminal_probs[key][k] == pytest.approx(value, rel=1e-12)
+
+    # the same draws given as (draw x node) arrays, nodes in the order of compiled.nodeNames
+    probs = [[1 if name == 'c0' else {'c1': p, 't3': 1 - p, 't1': 0.25, 't2': 0.75}[name]
+              for name in compiled.nodeNames] for p in p_list]
+    dict_nodes = dict(get_dict_chances(0), **DICT_TERMINALS)
+    node_costs = [[dict_nodes[name][0] for name in compiled.nodeNames]] * len(p_list)
+    node_utilities = [[dict_nodes[name][1] for name in compiled.nodeNames]] * len(p_list)
+    node_components = [[[dict_nodes[name][2].get(key, 0) for key in ['a', 'b']]
+                        for name in compiled.nodeNames]] * len(p_list)
+    compiled.evaluate_arrays(probs, node_costs, node_utilities, node_components, component_keys=['a', 'b'])
+    np.testing.assert_array_equal(compiled.get_batch_cost_utility()['c0'][0], costs)
+    np.testing.assert_array_equal(compiled.get_batch_cost_utility()['c0'][1], utilities)
+    for key, values in compiled.get_batch_component_loss()['c0'].items():
+        np.testing.assert_array_equal(values, components[key])
+
+
+def test_wrong_probabilities_and_components():
+    compiled = CompiledTree('d1', DICT_DECISIONS, get_dict_chances(0.2), DICT_TERMINALS)
+    dict_chances = get_dict_chances(0.2)
+    dict_chances['c1'][4] = [0.25, 0.5]
+    with pytest.raises(ValueError, match='Sum of probabilities'):
+        compiled.evaluate_batch([get_dict_chances(0.2), dict_chances], [DICT_TERMINALS] * 2)
+    dict_chances = get_dict_chances(0.2)
+    dict_chances['c0'][2] = {'b': 0.1}
+    with pytest.raises(ValueError, match='Sum of components'):
+        compiled.evaluate_batch([dict_chances], [DICT_TERMINALS])
+    with pytest.raises(ValueError, match='wrong shape'):
+        compiled.evaluate_arrays(np.ones((2, 3)), np.ones((2, 3)), np.ones((2, 3)))
@@ -0,0 +1,192 @@
+import functools
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+from supports.ParameterAndRecurrentPeriodSupport import life_table_get_long_term_loss, \
+    life_table_get_long_term_loss_batch, life_table_get_long_term_loss_by_discount_batch, \
+    life_table_get_cumulative_loss_by_discount_batch, get_loss_within_duration
+
+# tolerance of the array engine against the previous implementation (only the order of sums differs)
+RTOL = 1e-10
+ATOL = 1e-12
+
+SEX_LIST = ['female', 'male', 'general']
+AGE_ONSET_LIST = [0, 24.5, 25.4, 60, 99]
+SEQ_DISU_LIST = [0.05, 0.35]
+DISCOUNT_LIST = [0, 0.03]
+SEQ_DURA_LIST = [0, 2.5, 10]
+EMORT_LIST = [0, 0.01]
+TMORT_LIST = [0, 0.05]
+IF_UTILITY_LIST = [False, True]
+
+
+def reference_long_term_loss(sex, age_onset, seq_disu, discount, seq_dura=0,
+                             acute_sympt_disu=0, emort=0, emort_dura=None, tmort=0, if_utility=False):
+    """ previous (pandas) implementation of life_table_get_long_term_loss, kept as is to check the array engine """
+    if sex == 'female':
+        df = pd.read_csv('source/data/life_table_for_qaly_female.csv')
+    elif sex == 'male':
+        df = pd.read_csv('source/data/life_table_for_qaly_male.csv')
+    elif sex == 'general':
+        df = pd.read_csv('source/data/life_table_for_qaly.csv')
+    else:
+        raise ValueError('wrong type of sex input')
+    # round age onset
+    age_onset = round(age_onset)
+    # excess mortality during disease sequelae period
+    age_list = df['x']
+    ad_nqx_list = []
+    nqx_list = df['nqx']
+    for pair in zip(age_list, nqx_list):
+        if emort_dura is not None:
+            if age_onset <= pair[0] < (age_onset + emort_dura):
+                if emort > 0:
+                    ad_nqx_list.append(emort)
+                elif tmort > 0:
+                    ad_nqx_list.append(max(tmort - pair[1], 0))
+                else:
+                    raise ValueError('emort_dura should be NoneType')
+            else:
+                ad_nqx_list.append(0)
+        else:
+            if pair[0] >= age_onset:
+                if emort > 0:
+                    ad_nqx_list.append(emort)
+                elif tmort > 0:
+                    ad_nqx_list.append(max(tmort - pair[1], 0))
+                else:
+                    ad_nqx_list.append(0)
+            else:
+                ad_nqx_list.append(0)
+    df['ad_nqx'] = ad_nqx_list
+    # total mortality/survival rate within time period x and x+n
+    df['aggre_nqx'] = df.apply(lambda row: row['nqx'] + row['ad_nqx'], axis=1)
+    df['npx'] = df.apply(lambda row: 1-row['aggre_nqx'], axis=1)
+    # calculate % alive starting at the age of onset
+    aggre_nqx_list = df['aggre_nqx']
+    nlx_list = []
+    seq_disu_list = []
+    prev_row = None
+    for pair in zip(age_list, aggre_nqx_list):
+        if pair[0] == age_onset:
+            nlx_list.append(1)
+            seq_disu_list.append(seq_disu + acute_sympt_disu)
+        elif pair[0] > age_onset:
+            nlx_list.append(nlx_list[-1] * (1 - prev_row[1]))
+            seq_disu_list.append(seq_disu)
+        else:
+            nlx_list.append(0)
+            seq_disu_list.append(seq_disu)
+        prev_row = pair
+    df['nlx'] = nlx_list
+    # disutility & utility
+    df['seq_disu'] = seq_disu_list
+    df['seq_utl'] = df.apply(lambda row: 1 - row['seq_disu'], axis=1)
+    # avg. life years people live within each interval
+    df['nLx_ud'] = df.apply(lambda row: (row['nax']*row['aggre_nqx'] + row['nbx']*row['npx'])*row['nlx'], axis=1)
+    # cumulative life years lived at age x/x+n
+    nLx_ud_list = df['nLx_ud']
+    xn_T_ud_list = []
+    x_T_ud_list = []
+    ud_T_total = 0
+    for value_ud in nLx_ud_list:
+        x_T_ud_list.append(ud_T_total)
+        ud_T_total += value_ud
+        xn_T_ud_list.append(ud_T_total)
+    df['(x+n)T_ud'] = xn_T_ud_list
+    df['(x)T_ud'] = x_T_ud_list
+    # discounted life years people live within each interval = discounted_(x+n)T_ud - discounted_(x)T_ud
+    if discount == 0:
+        df['nLx_d'] = df['nLx_ud']
+    else:
+        df['nLx_d'] = df.apply(lambda row: ((1-(1-discount)**row['(x+n)T_ud'])/discount
+                                            - (1-(1-discount)**row['(x)T_ud'])/discount), axis=1)
+    # life years lived with sequelae within each interval
+    if seq_dura > 0:
+        nLx_d_list = df['nLx_d']
+        nlx_d_with_sequelae_list = []
+        count_n_years = 0
+        for pair in zip(age_list, nLx_d_list):
+            if pair[0] >= age_onset:
+                count_n_years += 1
+                if count_n_years <= seq_dura:
+                    nlx_d_with_sequelae_list.append(pair[1])
+                else:
+                    diff = count_n_years - seq_dura
+                    nlx_d_with_sequelae_list.append(max(0, 1-diff))
+            else:
+                nlx_d_with_sequelae_list.append(0)
+        df['nlx_d_with_sequelae'] = nlx_d_with_sequelae_list
+    else:
+        df['nlx_d_with_sequelae'] = df['nLx_d']
+    # calculate QALYs loss with sequelae
+    df['nQALYx_loss'] = df.apply(lambda row: row['nlx_d_with_sequelae'] * row['bg_utl'] * row['seq_disu'], axis=1)
+    df['nQALYs'] = df.apply(lambda row: row['nlx_d_with_sequelae'] * row['bg_utl'] * row['seq_utl'], axis=1)
+    if if_utility:
+        return sum(df['nQALYs'])
+    else:
+        return sum(df['nQALYx_loss'])
+
+
+def get_grid(seq_dura_list):
+    """ :returns age_onset, seq_disu and seq_dura arrays of all their combinations """
+    grid = np.array(list(itertools.product(AGE_ONSET_LIST, SEQ_DISU_LIST, seq_dura_list)), dtype=float)
+    return grid[:, 0], grid[:, 1], grid[:, 2]
+
+
+@functools.lru_cache(maxsize=None)
+def get_reference(sex, discount, emort, tmort, if_utility, seq_dura_list):
+    """ :returns previous implementation evaluated at each point of get_grid (cached, it is slow) """
+    return np.array([reference_long_term_loss(sex=sex, age_onset=age_onset, seq_disu=seq_disu, discount=discount,
+                                              seq_dura=seq_dura, emort=emort, tmort=tmort, if_utility=if_utility)
+                     for age_onset, seq_disu, seq_dura in zip(*get_grid(seq_dura_list))])
+
+
+@pytest.mark.parametrize('sex, discount, emort, tmort, if_utility',
+                         list(itertools.product(SEX_LIST, DISCOUNT_LIST, EMORT_LIST, TMORT_LIST, IF_UTILITY_LIST)))
+def test_batch_matches_previous_implementation(sex, discount, emort, tmort, if_utility):
+    expected = get_reference(sex=sex, discount=discount, emort=emort, tmort=tmort, if_utility=if_utility,
+                             seq_dura_list=tuple(SEQ_DURA_LIST))
+    age_onset, seq_disu, seq_dura = get_grid(SEQ_DURA_LIST)
+    loss = life_table_get_long_term_loss_batch(sex=sex, age_onset=age_onset, seq_disu=seq_disu, discount=discount,
+                                               seq_dura=seq_dura, emort=emort, tmort=tmort, if_utility=if_utility)
+    np.testing.assert_allclose(loss, expected, rtol=RTOL, atol=ATOL)
+
+    # cumulative engine, read off at each duration of sequelae
+    cumulative_loss, annual_loss = life_table_get_cumulative_loss_by_discount_batch(
+        sex=sex, age_onset=age_onset, seq_disu=seq_disu, discount_list=[discount], emort=emort, tmort=tmort,
+        if_utility=if_utility)
+    loss = get_loss_within_duration(cumulative_loss=cumulative_loss[0], annual_loss=annual_loss, seq_dura=seq_dura)
+    np.testing.assert_allclose(loss, expected, rtol=RTOL, atol=ATOL)
+
+
+@pytest.mark.parametrize('sex, if_utility', list(itertools.product(SEX_LIST, IF_UTILITY_LIST)))
+def test_by_discount_matches_previous_implementation(sex, if_utility):
+    age_onset, seq_disu, seq_dura = get_grid(SEQ_DURA_LIST)
+    losses = life_table_get_long_term_loss_by_discount_batch(
+        sex=sex, age_onset=age_onset, seq_disu=seq_disu, discount_list=DISCOUNT_LIST + [0.06], seq_dura=seq_dura,
+        emort=0.01, if_utility=if_utility)
+    for discount, loss in zip(DISCOUNT_LIST + [0.06], losses):
+        expected = get_reference(sex=sex, discount=discount, emort=0.01, tmort=0, if_utility=if_utility,
+                                 seq_dura_list=tuple(SEQ_DURA_LIST))
+        np.testing.assert_allclose(loss, expected, rtol=RTOL, atol=ATOL)
+
+
+@pytest.mark.parametrize('emort, tmort', [(0.01, 0), (0, 0.05)])
+def test_excess_mortality_duration_and_acute_symptoms(emort, tmort):
+    for sex, age_onset, seq_dura in itertools.product(SEX_LIST, AGE_ONSET_LIST, SEQ_DURA_LIST):
+        expected = reference_long_term_loss(sex=sex, age_onset=age_onset, seq_disu=0.2, discount=0.03,
+                                            seq_dura=seq_dura, acute_sympt_disu=0.1, emort=emort, emort_dura=5,
+                                            tmort=tmort)
+        loss = life_table_get_long_term_loss(sex=sex, age_onset=age_onset, seq_disu=0.2, discount=0.03,
+                                             seq_dura=seq_dura, acute_sympt_disu=0.1, emort=emort, emort_dura=5,
+                                             tmort=tmort)
+        assert loss == pytest.approx(expected, rel=RTOL, abs=ATOL)
+
+
+def test_wrong_inputs():
+    with pytest.raises(ValueError):
+        life_table_get_long_term_loss(sex='other', age_onset=30, seq_disu=0.1, discount=0.03)
+    with pytest.raises(ValueError):
+        life_table_get_long_term_loss(sex='female', age_onset=30, seq_disu=0.1, discount=0.03, emort_dura=5)
@@ -0,0 +1,259 @@
+import itertools
+import math
+from functools import partial
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from supports.DemographicValuesSupport import get_number_surviving, df_life_table_male, df_life_table_female
+from classes.RecurrentPeriodClass import get_sympt_recur_losses_by_discount, get_recur_meningitis_loss_by_discount, \
+    RecurrentPeriodCache
+
+# tolerance of the year grid against the previous year-by-year loops
+RTOL = 1e-12
+
+AGE_LIST = [0, 17, 21, 24.6, 32, 42, 59, 80]    # (ages with recurrences stay in the life table)
+SEX_LIST = ['male', 'female']
+DISCOUNT_LIST = [0, 0.03, 0.06]
+# (first-year rate, second-year rate) of recurrence types, including one without recurrences after the first year
+RECUR_RATES = [(4.5, 3.2), (1.3, 0.9), (8.0, 5.5), (2.0, 0)]
+ANNUAL_REDUCTION_LIST = [0.3, 0.85]
+
+
+def get_parameters(total_num_recur_meningitis=3.4):
+    """ parameter samples used by the recurrent period calculations """
+    return SimpleNamespace(diagnosis_disu_sample=0.05, diagnosis_disu_reduction_sample=0.02,
+                           recur_sympt_treated_disu_sample=0.1, urinary_retention_disu_sample=0.2,
+                           recur_treat_duration_sample=0.0137, urinary_retention_recur_prob_sample=0.01,
+                           urinary_retention_duration_sample=0.02, total_year_with_meningitis_sample=6.8,
+                           total_num_recur_meningitis_sample=total_num_recur_meningitis,
+                           recur_meningitis_duration_sample=0.038, recur_meningitis_disu_sample=0.6)
+
+
+def reference_bg_utility(age):
+    """ previous get_bg_utility """
+    bg_u = None
+    if age < 18:
+        bg_u = 1
+    if 18 <= age < 30:
+        bg_u = 0.922
+    elif 30 <= age < 40:
+        bg_u = 0.901
+    elif 40 <= age < 50:
+        bg_u = 0.871
+    elif 50 <= age < 60:
+        bg_u = 0.842
+    elif 60 <= age < 70:
+        bg_u = 0.823
+    elif 70 <= age < 80:
+        bg_u = 0.790
+    elif age >= 80:
+        bg_u = 0.736
+    return bg_u
+
+
+def reference_adjusted_disu(current_age, disu):
+    """ previous get_adjusted_disu """
+    return reference_bg_utility(age=current_age) * disu
+
+
+def reference_survival_rate(younger_age, older_age, sex):
+    """ previous get_conditional_survival_rate """
+    df = df_life_table_female if sex == 'female' else df_life_table_male
+    num_alive_young = get_number_surviving(df=df, age=round(younger_age))
+    num_alive_old = get_number_surviving(df=df, age=round(older_age))
+    return round(num_alive_old / num_alive_young, 4)
+
+
+def reference_sympt_recur_loss(params, age_of_infection, sex, discount, first_year_recur_rate,
+                               second_year_recur_rate, annual_reduction_rate):
+    """ previous (year-by-year loop) RecurrentPeriod._get_sympt_recur_loss, kept as is to check the year grid
+    :return: dictionary of the outcomes of get_sympt_recur_losses_by_discount
+    """
+    sympt_recur_qaly = recur_only_qaly = ur_qaly = psych_qaly = 0
+    cal_1 = 0
+    num_years_with_recur = int(math.ceil(second_year_recur_rate / annual_reduction_rate))
+    rate_of_recurrence = [first_year_recur_rate, second_year_recur_rate]
+    for i in range(1, num_years_with_recur - 1):
+        rate_of_recurrence.append(second_year_recur_rate - i * annual_reduction_rate)
+    cal_1_end = num_years_with_recur - 1
+    cal_2 = age_of_infection
+    psycho_disu_a = params.diagnosis_disu_sample
+    psycho_disu_b = psycho_disu_a - params.diagnosis_disu_reduction_sample
+    for i in range(cal_1, cal_1_end + 1):
+        if cal_1 == 0:
+            sur_rate = 1
+            psycho_disu = psycho_disu_a
+        else:
+            sur_rate = reference_survival_rate(younger_age=age_of_infection, older_age=cal_2, sex=sex)
+            psycho_disu = psycho_disu_b
+        recur_rate = rate_of_recurrence[cal_1]
+        discount_index = cal_1
+        recur_adjusted_disu = reference_adjusted_disu(current_age=cal_2, disu=params.recur_sympt_treated_disu_sample)
+        ur_adjusted_disu = reference_adjusted_disu(current_age=cal_2, disu=params.urinary_retention_disu_sample)
+        psycho_adjusted_disu = reference_adjusted_disu(current_age=cal_2, disu=psycho_disu)
+        recur_qaly = recur_rate * recur_adjusted_disu * params.recur_treat_duration_sample
+        ur_prob = params.urinary_retention_recur_prob_sample
+        ur_qaly_year = recur_rate * ur_prob * ur_adjusted_disu * params.urinary_retention_duration_sample
+        psycho_qaly = psycho_adjusted_disu * 1
+        annual_qaly = sur_rate * (recur_qaly + ur_qaly_year + psycho_qaly) / (1 + discount) ** discount_index
+        cal_1 += 1
+        cal_2 += 1
+        sympt_recur_qaly += annual_qaly
+        recur_only_qaly += sur_rate * recur_qaly / (1 + discount) ** discount_index
+        ur_qaly += sur_rate * ur_qaly_year / (1 + discount) ** discount_index
+        psych_qaly += sur_rate * psycho_qaly / (1 + discount) ** discount_index
+    return {'rate_of_recurrence': rate_of_recurrence, 'sympt_recur_qaly': sympt_recur_qaly,
+            'recur_only_qaly': recur_only_qaly, 'ur_qaly': ur_qaly, 'psych_qaly': psych_qaly}
+
+
+def reference_recur_meningitis_loss(params, age_of_infection, sex, discount):
+    """ previous (loop) RecurrentPeriodTypeTwo._get_recur_meningitis_loss """
+    rm_qaly = 0
+    total_year_with_meningitis = params.total_year_with_meningitis_sample
+    total_num_meningitis = round(params.total_num_recur_meningitis_sample)
+    rm_duration = params.recur_meningitis_duration_sample
+    rm_unadjusted_disu = params.recur_meningitis_disu_sample
+    cal_1 = total_year_with_meningitis / total_num_meningitis
+    cal_2 = age_of_infection
+    for iterate in range(0, total_num_meningitis):
+        cal_2_prev_round = round(cal_2)
+        cal_2 += cal_1
+        cal_2_round = round(cal_2)
+        sur_rate = reference_survival_rate(younger_age=cal_2_prev_round, older_age=cal_2_round, sex=sex)
+        rm_adjusted_disu = reference_adjusted_disu(current_age=cal_2_round, disu=rm_unadjusted_disu)
+        rm_qaly += sur_rate * rm_adjusted_disu * rm_duration / (1 + discount) ** (cal_2_round - age_of_infection)
+    return rm_qaly
+
+
+@pytest.mark.parametrize('age_of_infection, sex, annual_reduction_rate',
+                         list(itertools.product(AGE_LIST, SEX_LIST, ANNUAL_REDUCTION_LIST)))
+def test_sympt_recur_losses_match_previous_loop(age_of_infection, sex, annual_reduction_rate):
+    params = get_parameters()
+    losses_by_discount = get_sympt_recur_losses_by_discount(
+        parameters=params, age_of_infection=age_of_infection, sex=sex, discount_list=DISCOUNT_LIST,
+        recur_rates=RECUR_RATES, annual_reduction_rate=annual_reduction_rate)
+    for discount, losses in zip(DISCOUNT_LIST, losses_by_discount):
+        for (first_year_rate, second_year_rate), loss in zip(RECUR_RATES, losses):
+            expected = reference_sympt_recur_loss(
+                params=params, age_of_infection=age_of_infection, sex=sex, discount=discount,
+                first_year_recur_rate=first_year_rate, second_year_recur_rate=second_year_rate,
+                annual_reduction_rate=annual_reduction_rate)
+            assert loss['rate_of_recurrence'] == expected['rate_of_recurrence']
+            for key in ['sympt_recur_qaly', 'recur_only_qaly', 'ur_qaly', 'psych_qaly']:
+                assert loss[key] == pytest.approx(expected[key], rel=RTOL, abs=0), key
+
+
+@pytest.mark.parametrize('age_of_infection, sex, total_num_recur_meningitis',
+                         list(itertools.product(AGE_LIST, SEX_LIST, [1, 3.4, 7.6])))
+def test_recur_meningitis_loss_matches_previous_loop(age_of_infection, sex, total_num_recur_meningitis):
+    params = get_parameters(total_num_recur_meningitis=total_num_recur_meningitis)
+    losses = get_recur_meningitis_loss_by_discount(parameters=params, age_of_infection=age_of_infection, sex=sex,
+                                                   discount_list=DISCOUNT_LIST)
+    expected = [reference_recur_meningitis_loss(params=params, age_of_infection=age_of_infection, sex=sex,
+                                                discount=discount) for discount in DISCOUNT_LIST]
+    np.testing.assert_allclose(losses, expected, rtol=RTOL, atol=0)
+
+
+def get_sample(sample_id=1):
+    """ stand-in for a parameter sample of ParametersTypeTwo, with the attributes read by RecurrentPeriodCache """
+    params = get_parameters()
+    params.__dict__.update(sample_id=sample_id, override_id=0, dic_overrides={}, avg_yearly_recur_reduction_sample=0.3,
+                           infreq_first_year_recur_rate_sample=1.3, infreq_second_year_recur_rate_sample=0.9,
+                           freq_nocst_first_year_recur_rate_sample=4.5, freq_cst_first_year_recur_rate_sample=2.0,
+                           primary_treat_duration_sample=0.02)
+    return params
+
+
+def override_samples(params, dic_values):
+    """ as Parameters.override_samples """
+    for name, value in dic_values.items():
+        setattr(params, name, value)
+        params.dic_overrides[name] = value
+    params.override_id += 1
+
+
+def test_cache_hits_within_one_draw():
+    cache = RecurrentPeriodCache(discount_list=[0, 0.03])
+    params = get_sample()
+    period = cache.get_recur_period_type_two(parameters=params, recur_type='frequent', age_of_infection=21,
+                                             sex='female', discount=0.03, cst=True, rm=True)
+    assert cache.get_hit_miss_counts() == {'hits': 0, 'misses': 1, 'hit_rate': 0}
+    # the same configuration, also requested by another tree of the same draw
+    assert cache.get_recur_period_type_two(parameters=params, recur_type='frequent', age_of_infection=21,
+                                           sex='female', discount=0.03, cst=True, rm=True) is period
+    # other rates of discount_list are calculated in the same pass, and match a cache without them
+    period_0 = cache.get_recur_period_type_two(parameters=params, recur_type='frequent', age_of_infection=21,
+                                               sex='female', discount=0, cst=True, rm=True)
+    assert cache.get_hit_miss_counts() == {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3}
+    expected = RecurrentPeriodCache().get_recur_period_type_two(
+        parameters=params, recur_type='frequent', age_of_infection=21, sex='female', discount=0, cst=True, rm=True)
+    assert period_0.total_loss_hsv2 == expected.total_loss_hsv2
+
+    builds = []
+
+    def build():
+        builds.append('HSV-2')
+        return {'t1': period}
+
+    for _ in range(2):
+        terminals = cache.get_terminals(parameters=params, tree_name='HSV-2', age_of_infection=21, sex='female',
+                                        discount=0.03, build=build)
+    assert len(builds) == 1
+    assert terminals == {'t1': period}
+
+
+def test_new_sample_or_override_misses():
+    cache = RecurrentPeriodCache()
+    params = get_sample()
+    period = cache.get_recur_period_type_one(parameters=params, recur_type='infrequent', age_of_infection=32,
+                                             sex='male')
+    # a new draw, even with the same values
+    params.sample_id = 2
+    assert cache.get_recur_period_type_one(parameters=params, recur_type='infrequent', age_of_infection=32,
+                                           sex='male') is not period
+    assert cache.num_misses == 2
+    # overriding a sample used by recurrent periods
+    period = cache.get_recur_period_type_one(parameters=params, recur_type='infrequent', age_of_infection=32,
+                                             sex='male')
+    override_samples(params=params, dic_values={'recur_sympt_treated_disu_sample': 0.2})
+    overridden = cache.get_recur_period_type_one(parameters=params, recur_type='infrequent', age_of_infection=32,
+                                                 sex='male')
+    assert overridden is not period
+    assert overridden.total_loss_hsv1 > period.total_loss_hsv1
+    assert cache.get_hit_miss_counts()['misses'] == 3
+    # overriding other samples only: the recurrent periods of the draw are shared
+    params = get_sample(sample_id=3)
+    period = cache.get_recur_period_type_one(parameters=params, recur_type='infrequent', age_of_infection=32,
+                                             sex='male')
+    override_samples(params=params, dic_values={'primary_treat_duration_sample': 0.05})
+    assert cache.get_recur_period_type_one(parameters=params, recur_type='infrequent', age_of_infection=32,
+                                           sex='male') is period
+
+
+def test_overridden_scenarios_never_reuse_base_terminals():
+    cache = RecurrentPeriodCache(discount_list=[0.03, 0.06])
+
+    def build(params):
+        return cache.get_recur_period_type_two(parameters=params, recur_type='infrequent', age_of_infection=42,
+                                               sex='female', discount=0.03, rm=True).total_loss_hsv2
+
+    params = get_sample()
+    base = cache.get_terminals(parameters=params, tree_name='HSV-2', age_of_infection=42, sex='female',
+                               discount=0.03, build=partial(build, params))
+    for name, value in [('avg_yearly_recur_reduction_sample', 0.5), ('recur_meningitis_disu_sample', 0.3),
+                        ('infreq_first_year_recur_rate_sample', 2.5)]:
+        override_samples(params=params, dic_values={name: value})
+        overridden = cache.get_terminals(parameters=params, tree_name='HSV-2', age_of_infection=42, sex='female',
+                                         discount=0.03, build=partial(build, params))
+        # as calculated by a cache that never saw the base sample
+        expected = RecurrentPeriodCache().get_recur_period_type_two(
+            parameters=params, recur_type='infrequent', age_of_infection=42, sex='female', discount=0.03,
+            rm=True).total_loss_hsv2
+        assert overridden != base
+        assert overridden == expected
+        # restore_samples: the terminals of the base sample are reused
+        setattr(params, name, getattr(get_sample(), name))
+        params.dic_overrides = {}
+        params.override_id += 1
+        assert cache.get_terminals(parameters=params, tree_name='HSV-2', age_of_infection=42, sex='female',
+                                   discount=0.03, build=None) == base
@@ -0,0 +1,209 @@
+import os
+from functools import partial
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('SimPy')
+from SimPy.Statistics import SummaryStat
+from supports import RunProbTreeSupport
+from supports.RunProbTreeSupport import run_psa_in_parallel, read_psa_shards, get_config_fingerprint, \
+    get_summary_stats, get_psa_outcomes, run_adaptive_psa, WelfordStatistics
+
+
+def simulate(seeds, offset=0, simulated=None):
+    """ picklable stand-in for a PSA simulation, the result of each seed depends on the seed only
+    :param simulated: list to record the seeds simulated (only seen when run in this process)
+    """
+    if simulated is not None:
+        simulated.extend(seeds)
+    return [(seed, offset + np.random.RandomState(seed=seed).random_sample()) for seed in seeds]
+
+
+@pytest.mark.parametrize('chunk_size', [None, 1, 3, 7])
+def test_parallel_matches_serial(chunk_size):
+    serial = run_psa_in_parallel(simulate=simulate, num_psa=20, num_workers=1)
+    parallel = run_psa_in_parallel(simulate=simulate, num_psa=20, num_workers=2, chunk_size=chunk_size)
+    assert parallel == serial
+    assert [result[0] for result in parallel] == list(range(20))     # in seed order
+    # a batch of seeds (as run by adaptive PSA)
+    assert run_psa_in_parallel(simulate=simulate, num_psa=20, num_workers=2, chunk_size=chunk_size,
+                               first_seed=5) == serial[5:]
+
+
+def test_resume_only_runs_missing_seeds(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    config = {'discount': 0.03}
+    simulated = []
+    run_psa_in_parallel(simulate=partial(simulate, simulated=simulated), num_psa=6, chunk_size=4,
+                        checkpoint_dir=checkpoint_dir, config=config)
+    assert simulated == list(range(6))
+    assert len(os.listdir(checkpoint_dir)) == 2
+
+    # a longer run with the same settings resumes the saved iterations
+    simulated = []
+    results = run_psa_in_parallel(simulate=partial(simulate, simulated=simulated), num_psa=10, chunk_size=4,
+                                  checkpoint_dir=checkpoint_dir, config=config)
+    assert simulated == list(range(6, 10))
+    assert results == simulate(list(range(10)))
+
+
+def test_other_settings_ignore_saved_shards(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    run_psa_in_parallel(simulate=partial(simulate, simulated=[]), num_psa=6, checkpoint_dir=checkpoint_dir,
+                        config={'discount': 0.03})
+
+    # other settings: saved iterations are simulated again, and replace the stale shards
+    simulated = []
+    results = run_psa_in_parallel(simulate=partial(simulate, offset=1, simulated=simulated), num_psa=6,
+                                  checkpoint_dir=checkpoint_dir, config={'discount': 0.06})
+    assert simulated == list(range(6))
+    assert results == simulate(list(range(6)), offset=1)
+    fingerprint = get_config_fingerprint(simulate=partial(simulate, offset=1, simulated=[]),
+                                         config={'discount': 0.06})
+    saved = read_psa_shards(checkpoint_dir=checkpoint_dir, num_psa=6, fingerprint=fingerprint)
+    assert saved == dict(enumerate(results))
+
+
+def test_fingerprint_depends_on_model_code(monkeypatch):
+    fingerprint = get_config_fingerprint(simulate=simulate, config=None)
+    assert get_config_fingerprint(simulate=simulate, config=None) == fingerprint
+    # other source files of the model code
+    monkeypatch.setattr(RunProbTreeSupport, 'SOURCE_DIRS', ['classes'])
+    assert get_config_fingerprint(simulate=simulate, config=None) != fingerprint
+
+
+def test_welford_matches_numpy_over_batches():
+    rng = np.random.RandomState(seed=1)
+    # a large offset, where the sum of squares would lose precision
+    values = 1e6 + rng.normal(scale=[1, 0.01, 100], size=(103, 3))
+    stats = WelfordStatistics(names=['a', 'b', 'c'])
+    for batch in np.array_split(values, [10, 11, 50, 90]):
+        for row in batch:
+            stats.add(values=row)
+        np.testing.assert_allclose(stats.mean, np.mean(values[:stats.numPsa], axis=0), rtol=1e-12)
+        np.testing.assert_allclose(stats.get_variance(), np.var(values[:stats.numPsa], axis=0, ddof=1), rtol=1e-8)
+    np.testing.assert_allclose(stats.get_mcse(), np.std(values, axis=0, ddof=1) / np.sqrt(len(values)), rtol=1e-8)
+    assert stats.to_dataframe()['output'].tolist() == ['a', 'b', 'c']
+    with pytest.raises(ValueError):
+        stats.add(values=[1, 2])
+
+
+def test_adaptive_psa_stops_at_min_psa_for_constant_outputs():
+    results, stats, trace = run_adaptive_psa(simulate=simulate, get_outputs=lambda result: [1.0, 2.0],
+                                             output_names=['a', 'b'], tolerance=0.01, min_psa=10, max_psa=40,
+                                             batch_size=5)
+    assert results == simulate(list(range(10)))
+    assert stats.numPsa == 10
+    assert trace['num_psa'].tolist() == [10]
+    assert trace['converged'].tolist() == [True]
+
+
+def test_adaptive_psa_stops_at_max_psa_without_convergence():
+    # an output with mean 0 never reaches a relative MCSE below tolerance
+    results, stats, trace = run_adaptive_psa(simulate=simulate,
+                                             get_outputs=lambda result: [result[1], result[0] % 2 - 0.5],
+                                             output_names=['a', 'b'], tolerance=0.5, min_psa=10, max_psa=23,
+                                             batch_size=5, num_workers=2, chunk_size=3)
+    assert results == simulate(list(range(23)))
+    assert stats.numPsa == 23
+    assert trace['num_psa'].tolist() == [10, 15, 20, 23]
+    assert not trace['converged'].any()
+    assert (trace['a'] < 0.5).all()     # the other output has converged
+    np.testing.assert_allclose(stats.mean, [np.mean([result[1] for result in results]), -0.5 / 23], rtol=1e-12)
+    with pytest.raises(ValueError):
+        run_adaptive_psa(simulate=simulate, get_outputs=lambda result: [result[1]], output_names=['a'],
+                         tolerance=0.5, min_psa=30, max_psa=23, batch_size=5)
+
+
+def reference_summary_stats(mf_utility_lists, mf_id_lists, age_list, sex_list, num_psa, virus_type):
+    """ previous (loop) implementation of get_summary_stats, kept as is to check the array version, except that the
+    per-iteration outcomes are also returned """
+    def convert_list_to_dic(list_data):
+        colnames = []
+        for sex in sex_list:
+            for age in age_list:
+                colnames.append('{}_{}'.format(sex, age))
+        df = pd.DataFrame(list_data, columns=colnames)
+        uListDic = {'male': {}, 'female': {}}
+        uStatDic = {'male': {}, 'female': {}}
+        for sex in sex_list:
+            for age in age_list:
+                uListDic[sex][age] = df['{}_{}'.format(sex, age)].tolist()
+                uStatDic[sex][age] = SummaryStat(name='QALYs loss per infection for {} at age of {}'.format(sex, age),
+                                                 data=df['{}_{}'.format(sex, age)].tolist())
+        return uListDic, uStatDic
+
+    qaly_list_dic, qaly_stat_dic = convert_list_to_dic(list_data=mf_utility_lists)
+    id_list_dic, id_stat_dic = convert_list_to_dic(list_data=mf_id_lists)
+    age_sex_specific_qaly = []
+    for sex in sex_list:
+        for age in age_list:
+            age_sex_specific_qaly.append(qaly_stat_dic[sex][age].get_formatted_mean_and_interval(deci=5,
+                                                                                                  interval_type='p'))
+    non_age_sex_qaly = []
+    qaly_id_non_age_sex_list = []
+    for i in range(num_psa):
+        qaly_non_age_sex_per_psa = []
+        id_non_age_sex_per_psa = []
+        for sex in sex_list:
+            for age in age_list:
+                qaly_this_group = qaly_list_dic[sex][age][i]
+                id_this_group = id_list_dic[sex][age][i]
+                id_non_age_sex_per_psa.append(id_this_group)
+                qaly_non_age_sex_per_psa.append(qaly_this_group * id_this_group)
+        non_age_sex_qaly.append(sum(qaly_non_age_sex_per_psa) / sum(id_non_age_sex_per_psa))
+        qaly_id_non_age_sex_list.append([qaly_non_age_sex_per_psa, id_non_age_sex_per_psa])
+    non_age_sex_qaly_avg = SummaryStat(name='general population', data=non_age_sex_qaly)\
+        .get_formatted_mean_and_interval(deci=5, interval_type='p')
+
+    t_qaly_dic = {'female': [], 'male': []}
+    for age in age_list:
+        for sex in ['female', 'male']:
+            t_qaly_dic[sex].append([a * b for a, b in zip(qaly_list_dic[sex][age], id_list_dic[sex][age])])
+    t_qaly_loss_for_m = []
+    t_qaly_loss_for_f = []
+    t_qaly_loss_for_hsv = []
+    for i in range(num_psa):
+        t_qaly_loss_m = 0
+        t_qaly_loss_f = 0
+        t_qaly_loss = 0
+        for f_qaly, m_qaly in zip(t_qaly_dic['female'], t_qaly_dic['male']):
+            t_qaly_loss_m += m_qaly[i]
+            t_qaly_loss_f += f_qaly[i]
+            t_qaly_loss += m_qaly[i] + f_qaly[i]
+        t_qaly_loss_for_m.append(t_qaly_loss_m)
+        t_qaly_loss_for_f.append(t_qaly_loss_f)
+        t_qaly_loss_for_hsv.append(t_qaly_loss)
+    t_qaly_m_avg = SummaryStat(name='males', data=t_qaly_loss_for_m).get_formatted_mean_and_interval(
+        deci=2, interval_type='p')
+    t_qaly_f_avg = SummaryStat(name='females', data=t_qaly_loss_for_f).get_formatted_mean_and_interval(
+        deci=2, interval_type='p')
+    t_qaly_hsv_avg = SummaryStat(name='total', data=t_qaly_loss_for_hsv).get_formatted_mean_and_interval(
+        deci=2, interval_type='p')
+    return (age_sex_specific_qaly, non_age_sex_qaly_avg, t_qaly_f_avg, t_qaly_m_avg, t_qaly_hsv_avg,
+            qaly_id_non_age_sex_list), \
+        {'non_age_sex_qaly': non_age_sex_qaly, 't_qaly_m': t_qaly_loss_for_m, 't_qaly_f': t_qaly_loss_for_f,
+         't_qaly_hsv': t_qaly_loss_for_hsv}
+
+
+@pytest.mark.parametrize('sex_list', [['male', 'female'], ['female', 'male']])
+def test_summary_stats_match_previous_implementation(sex_list):
+    age_list = [21, 27, 32, 42]
+    num_psa = 50
+    rng = np.random.RandomState(seed=1)
+    mf_utility_lists = rng.gamma(shape=2, scale=0.05, size=(num_psa, len(sex_list) * len(age_list))).tolist()
+    mf_id_lists = rng.uniform(1000, 50000, size=(num_psa, len(sex_list) * len(age_list))).tolist()
+    expected, dic_expected = reference_summary_stats(
+        mf_utility_lists=mf_utility_lists, mf_id_lists=mf_id_lists, age_list=age_list, sex_list=sex_list,
+        num_psa=num_psa, virus_type='HSV-1')
+    summary = get_summary_stats(mf_utility_lists=mf_utility_lists, mf_id_lists=mf_id_lists, age_list=age_list,
+                                sex_list=sex_list, num_psa=num_psa, virus_type='HSV-1')
+    assert summary == expected
+    assert type(summary[5]) is list     # saved in the outputs as nested lists, as before
+
+    shape = (num_psa, len(sex_list), len(age_list))
+    outcomes = get_psa_outcomes(utility=np.reshape(mf_utility_lists, shape), incidence=np.reshape(mf_id_lists, shape),
+                                sex_list=sex_list)
+    for name, values in dic_expected.items():
+        np.testing.assert_array_equal(outcomes[name], values)
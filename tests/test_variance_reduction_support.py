@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from supports.VarianceReductionSupport import get_variance_reduced_stats
+
+NUM_PSA = 200
+
+
+def test_control_variates_with_known_mean():
+    rng = np.random.RandomState(seed=1)
+    # outputs linear in a control of known mean 2 (true means 13 and 2), plus noise
+    controls = rng.normal(loc=2, scale=1, size=(NUM_PSA, 1))
+    outputs = np.column_stack([3 + 5 * controls[:, 0] + rng.normal(scale=0.1, size=NUM_PSA),
+                               4 - controls[:, 0] + rng.normal(scale=0.5, size=NUM_PSA)])
+    df = get_variance_reduced_stats(outputs=outputs, output_names=['a', 'b'], controls=controls,
+                                    control_means=np.array([2]))
+    assert df['output'].tolist() == ['a', 'b']
+    np.testing.assert_allclose(df['mean'], outputs.mean(axis=0))
+    for true_mean, row in zip([13, 2], df.itertuples()):
+        assert abs(row.adjusted_mean - true_mean) < 3 * row.adjusted_mcse
+        assert abs(row.adjusted_mean - true_mean) < abs(row.mean - true_mean)
+        assert row.adjusted_mcse < row.mcse
+        assert row.ess_gain > 1
+    # the less noisy output gains more
+    assert df['ess_gain'][0] > df['ess_gain'][1]
+
+
+def test_without_controls():
+    outputs = np.random.RandomState(seed=1).gamma(shape=2, size=(NUM_PSA, 1))
+    df = get_variance_reduced_stats(outputs=outputs, output_names=['a'])
+    assert df['adjusted_mean'][0] == pytest.approx(df['mean'][0], rel=1e-12)
+    assert df['adjusted_mcse'][0] == pytest.approx(df['mcse'][0], rel=1e-12)
+    assert df['ess_gain'][0] == pytest.approx(1, rel=1e-12)
+
+
+def test_antithetic_pairs():
+    u = np.random.RandomState(seed=1).random_sample(NUM_PSA // 2)
+    # iterations 2k and 2k + 1 are u and 1 - u, of an output monotone in u (true mean 1 / 3)
+    outputs = np.column_stack([u, 1 - u]).reshape(NUM_PSA, 1) ** 2
+    df = get_variance_reduced_stats(outputs=outputs, output_names=['a'], pair_size=2)
+    assert abs(df['adjusted_mean'][0] - 1 / 3) < 3 * df['adjusted_mcse'][0]
+    assert df['ess_gain'][0] > 1
+
+
+def test_wrong_number_of_psa_iterations():
+    outputs = np.ones((NUM_PSA + 1, 1))
+    with pytest.raises(ValueError):
+        get_variance_reduced_stats(outputs=outputs, output_names=['a'], pair_size=2)
+    # no residual degree of freedom for 2 controls
+    rng = np.random.RandomState(seed=1)
+    with pytest.raises(ValueError):
+        get_variance_reduced_stats(outputs=rng.random_sample((3, 1)), output_names=['a'],
+                                   controls=rng.random_sample((3, 2)), control_means=np.array([0.5, 0.5]))
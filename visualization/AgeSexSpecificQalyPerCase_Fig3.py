@@ -2,14 +2,11 @@ from supports.VisualizationSupport import *
 
 # outcomes: age_sex_specific_qaly, non_age_sex_qaly_avg, t_qaly_f_avg, t_qaly_m_avg, t_qaly_hsv_avg
 read_path = 'tree_outputs/dics/'
+draws_path = 'tree_outputs/draws/'
 output_path = 'visualization/graphs/'
-# read python dict back from the file
-pkl_file = open('{}DicHSV1.pkl'.format(read_path), 'rb')
-hsv1_Dic = pickle.load(pkl_file)
-pkl2_file = open('{}DicHSV2.pkl'.format(read_path), 'rb')
-hsv2_Dic = pickle.load(pkl2_file)
-pkl_file.close()
-pkl2_file.close()
+# read raw draws (or python dict back from the file)
+hsv1_Dic = read_outcomes(store_dir='{}hsv1'.format(draws_path), pkl_path='{}DicHSV1.pkl'.format(read_path))
+hsv2_Dic = read_outcomes(store_dir='{}hsv2'.format(draws_path), pkl_path='{}DicHSV2.pkl'.format(read_path))
 
 # Age and sex specific QALYs loss per infection
 mean_male1, ci_male1, mean_female1, ci_female1 = get_age_sex_qaly_loss(dic=hsv1_Dic)
@@ -1,29 +1,32 @@
 import matplotlib.pyplot as plt
 import numpy as np
 from supports.VisualizationSupport import *
+from supports.DrawStoreSupport import NeonatalDrawStore
 
 neonatal_color = '#5D62D5'
 maternal_color = '#2596be'
 
-# outcomes: age_sex_specific_qaly, non_age_sex_qaly_avg, t_qaly_f_avg, t_qaly_m_avg, t_qaly_hsv_avg
+read_path = 'tree_outputs/dics/'
+draws_path = 'tree_outputs/draws/'
 output_path = 'visualization/graphs/'
 sim_length = ['5 years', '10 years', '15 years', 'lifetime']
+sim_time_list = [5, 10, 15, 0]      # simulation durations of sim_length, 0 = life time
+
+# read raw draws (or python dict back from the file) of each simulation length
+neonatal_dic_list = [read_outcomes(store_dir='{}neonatal_{}'.format(draws_path, sim_time),
+                                   pkl_path='{}neonatalGH_20221010_{}.pkl'.format(read_path, sim_time),
+                                   store_class=NeonatalDrawStore) for sim_time in sim_time_list]
 
 # Neonatal + Maternal
-per_neonatal_loss_mean = [4.31, 4.99, 5.51, 7.93]
-per_neonatal_loss_min = [3.54, 4.14, 4.56, 6.63]
-per_neonatal_loss_max = [5.13, 5.9, 6.52, 9.19]
-t_neonatal_loss_mean = [1707.62, 1976.08, 2182.26, 3136.39]
-t_neonatal_loss_min = [1211.32, 1400.02, 1567.27, 2261.55]
-t_neonatal_loss_max = [2294.82, 2666.8, 2921.75, 4143.99]
+per_neonatal_loss_mean, per_neonatal_loss_min, per_neonatal_loss_max = \
+    get_mean_min_max_list([dic['loss_per_infection'] for dic in neonatal_dic_list])
+t_neonatal_loss_mean, t_neonatal_loss_min, t_neonatal_loss_max = \
+    get_mean_min_max_list([dic['loss_total'] for dic in neonatal_dic_list])
 # Maternal
-per_maternal_loss_mean = [0.21, 0.37, 0.51, 0.77]
-per_maternal_loss_min = [0.12, 0.22, 0.3, 0.42]
-per_maternal_loss_max = [0.31, 0.57, 0.8, 1.22]
-t_maternal_loss_mean = [81.62, 148.17, 203.58, 305.03]
-t_maternal_loss_min = [43.88, 78.45, 109.58, 153.36]
-t_maternal_loss_max = [132.95, 243.98, 333.67, 510.98]
-
+per_maternal_loss_mean, per_maternal_loss_min, per_maternal_loss_max = \
+    get_mean_min_max_list([dic['m_loss_per_infection'] for dic in neonatal_dic_list])
+t_maternal_loss_mean, t_maternal_loss_min, t_maternal_loss_max = \
+    get_mean_min_max_list([dic['m_loss_total'] for dic in neonatal_dic_list])
 
 ci_per_neonatal = []
 ci_t_neonatal = []
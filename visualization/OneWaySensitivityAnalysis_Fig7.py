@@ -1,21 +1,29 @@
 from supports.VisualizationSupport import *
 
 read_path = 'tree_outputs/dics/'
+sensitivity_path = 'tree_outputs/sensitivity/one_way.csv'
 output_path = 'visualization/graphs/'
 
-hsv1_main_per_case = 0.01403
-hsv1_main_total = 1925.52
-hsv1_outcomes = [[0.01359, 0.01452, 0.0083, 0.02593, 0.00633],
-                 [1864.9, 1992.89, 1142.59, 3542.85, 879.93]]
-hsv2_main_per_case = 0.05214
-hsv2_main_total = 31221.58
-hsv2_outcomes = [[0.04795, 0.05755, 0.02137, 0.08493, 0.03162],
-                 [28710.51, 34466.63, 12827.9, 50830.32, 18674.25]]
-
 # x-axis format
 label_text = ['0.06 discount rate', '0 discount rate',
               'GBD symptomatic outbreak disutility',
               '0.02 psychosocial disutility', '0 psychosocial disutility']
+
+if os.path.isfile(sensitivity_path):
+    # results table of analyses/RunOneWaySensitivity.py
+    hsv1_main_per_case, hsv1_main_total, hsv1_outcomes = \
+        read_one_way_outcomes(table_path=sensitivity_path, virus_type='HSV-1', scenarios=label_text)
+    hsv2_main_per_case, hsv2_main_total, hsv2_outcomes = \
+        read_one_way_outcomes(table_path=sensitivity_path, virus_type='HSV-2', scenarios=label_text)
+else:
+    hsv1_main_per_case = 0.01403
+    hsv1_main_total = 1925.52
+    hsv1_outcomes = [[0.01359, 0.01452, 0.0083, 0.02593, 0.00633],
+                     [1864.9, 1992.89, 1142.59, 3542.85, 879.93]]
+    hsv2_main_per_case = 0.05214
+    hsv2_main_total = 31221.58
+    hsv2_outcomes = [[0.04795, 0.05755, 0.02137, 0.08493, 0.03162],
+                     [28710.51, 34466.63, 12827.9, 50830.32, 18674.25]]
 x_pos = np.arange(len(label_text))
 # bar format
 width = 0.8
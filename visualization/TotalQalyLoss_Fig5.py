@@ -1,15 +1,12 @@
 from supports.VisualizationSupport import *
 
 read_path = 'tree_outputs/dics/'
+draws_path = 'tree_outputs/draws/'
 output_path = 'visualization/graphs/'
 
-# read python dict back from the file
-pkl_file = open('{}DicHSV1.pkl'.format(read_path), 'rb')
-hsv1_Dic = pickle.load(pkl_file)
-pkl2_file = open('{}DicHSV2.pkl'.format(read_path), 'rb')
-hsv2_Dic = pickle.load(pkl2_file)
-pkl_file.close()
-pkl2_file.close()
+# read raw draws (or python dict back from the file)
+hsv1_Dic = read_outcomes(store_dir='{}hsv1'.format(draws_path), pkl_path='{}DicHSV1.pkl'.format(read_path))
+hsv2_Dic = read_outcomes(store_dir='{}hsv2'.format(draws_path), pkl_path='{}DicHSV2.pkl'.format(read_path))
 
 mean_list1, ci_list1 = get_total_qaly_loss(dic=hsv1_Dic, scalar=1000)
 mean_list2, ci_list2 = get_total_qaly_loss(dic=hsv2_Dic, scalar=1000)